@@ -7,14 +7,12 @@ APILama - Main application module
 This module provides the Flask application for the APILama service.
 """
 
-# Initialize logging FIRST, before any other imports
-# This ensures environment variables are loaded before other libraries
-from apilama.logging_config import init_logging, get_logger
+# Load the .env file FIRST, so the settings read at import time see it;
+# LogLama and the log handlers are set up by create_app()
+from apilama.logging_config import load_environment, init_logging, get_logger
 
-# Initialize logging with LogLama
-init_logging()
+load_environment()
 
-# Now import other standard libraries
 import os
 import sys
 import argparse
@@ -31,13 +29,16 @@ logger = get_logger('apilama')
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 # Import blueprints
-from apilama.routes.devlama_routes import devlama_routes
-from apilama.routes.bexy_routes import bexy_routes
-from apilama.routes.getllm_routes import getllm_routes
+from apilama.routes.pylama_routes import devlama_routes
+from apilama.routes.pybox_routes import bexy_routes
+from apilama.routes.pyllm_routes import getllm_routes
 from apilama.routes.shellama_routes import shellama_routes
 from apilama.routes.file_routes import file_routes
 from apilama.routes.git_routes import git_routes
 from apilama.routes.weblama_routes import weblama_routes
+from apilama.routes.metrics_routes import metrics_routes
+from apilama.health import start_monitors
+from apilama.logger import HOT_PATH_SAMPLE, init_app as init_logger
 
 
 def create_app(test_config=None):
@@ -49,6 +50,9 @@ def create_app(test_config=None):
     Returns:
         Flask: The configured Flask application.
     """
+    # Build the log handler chain, once per process
+    init_logging()
+
     # Create and configure the app
     app = Flask(__name__)
     
@@ -65,14 +69,18 @@ def create_app(test_config=None):
     if test_config is not None:
         app.config.update(test_config)
     
-    # Add request logging middleware
+    # Capture the request context once per request for all log records
+    init_logger(app)
+    
+    # Add request logging middleware; the URL, client address and method
+    # are attached to the records by the hook above
     @app.before_request
     def log_request_info():
-        logger.debug(f"Request: {request.method} {request.url} from {request.remote_addr}")
+        logger.debug("Request received", sample=HOT_PATH_SAMPLE)
         
     @app.after_request
     def log_response_info(response):
-        logger.debug(f"Response: {response.status_code}")
+        logger.debug("Response: %s", response.status_code, sample=HOT_PATH_SAMPLE)
         return response
     
     # Register blueprints
@@ -83,6 +91,10 @@ def create_app(test_config=None):
     app.register_blueprint(file_routes)
     app.register_blueprint(git_routes)
     app.register_blueprint(weblama_routes)
+    app.register_blueprint(metrics_routes)
+    
+    # Start the background health probes of the backend services
+    start_monitors()
     
     # Add a health check endpoint
     @app.route('/health')
@@ -90,20 +102,10 @@ def create_app(test_config=None):
         return jsonify({'status': 'ok', 'service': 'apilama'})
     
     # Log the initialization with structured context
-    logger.info("APILama initialized", extra={
-        'context': {
-            'cors_enabled': True,
-            'debug_mode': app.config['DEBUG'],
-            'blueprints': [
-                'devlama_routes',
-                'bexy_routes',
-                'getllm_routes',
-                'shellama_routes',
-                'file_routes',
-                'git_routes',
-                'weblama_routes'
-            ]
-        }
+    logger.info("APILama initialized", context=lambda: {
+        'cors_enabled': True,
+        'debug_mode': app.config['DEBUG'],
+        'blueprints': list(app.blueprints)
     })
     
     return app
@@ -123,12 +125,52 @@ def main():
                         help='Host to run the server on (default: 127.0.0.1)')
     parser.add_argument('--debug', action='store_true', default=None,
                         help='Run in debug mode')
+    parser.add_argument('--server', choices=['dev', 'async', 'prefork'], default=os.environ.get('APILAMA_SERVER', 'dev'),
+                        help='Server to run: the Flask development server, the async ASGI server '
+                             'or the pre-forking production server (default: dev)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('APILAMA_WORKERS', 0)),
+                        help='Number of prefork workers (default: number of CPUs)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('APILAMA_WORKER_THREADS', 8)),
+                        help='Connections each prefork worker serves at the same time (default: 8)')
+    parser.add_argument('--max-requests', type=int, default=int(os.environ.get('APILAMA_MAX_REQUESTS', 0)),
+                        help='Recycle a prefork worker after this many requests (default: 0, disabled)')
+    parser.add_argument('--max-requests-jitter', type=int,
+                        default=int(os.environ.get('APILAMA_MAX_REQUESTS_JITTER', 0)),
+                        help='Random extra requests per worker before recycling (default: 0)')
+    parser.add_argument('--max-rss', type=int, default=int(os.environ.get('APILAMA_MAX_RSS_MB', 0)),
+                        help='Recycle a prefork worker above this resident memory in MB (default: 0, disabled)')
+    parser.add_argument('--graceful-timeout', type=float,
+                        default=float(os.environ.get('APILAMA_GRACEFUL_TIMEOUT', 30)),
+                        help='Seconds prefork workers get to finish in-flight requests (default: 30)')
     args = parser.parse_args()
     
     # Set environment variables from arguments
     if args.debug is not None:
         os.environ['DEBUG'] = str(args.debug)
     
+    if args.server == 'prefork':
+        from apilama import server
+        # The production launcher never runs in debug mode unless asked to
+        os.environ.setdefault('DEBUG', 'False')
+        print(f"Starting APILama (prefork) on {args.host}:{args.port}")
+        server.run(args.host, args.port,
+                   workers=args.workers or None,
+                   max_requests=args.max_requests,
+                   max_requests_jitter=args.max_requests_jitter,
+                   max_rss_mb=args.max_rss,
+                   graceful_timeout=args.graceful_timeout,
+                   threads=args.threads)
+        return
+    
+    if args.server == 'async':
+        from apilama import asgi
+        if not asgi.ASYNC_AVAILABLE:
+            parser.error('--server async requires the uvicorn and httpx packages (pip install "apilama[async]")')
+        debug = os.environ.get('DEBUG', 'True').lower() in ('true', '1', 't')
+        print(f"Starting APILama (async) on {args.host}:{args.port}")
+        asgi.run(args.host, args.port, debug=debug)
+        return
+    
     # Create the app
     app = create_app()
     
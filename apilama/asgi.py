@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama ASGI Application
+
+This module provides the async serving mode of APILama (``apilama --server async``).
+
+Proxy routes with a native async implementation are served directly on the
+event loop and await upstream I/O, so a single process can hold thousands of
+in-flight proxied requests. Every other route falls through to the regular
+Flask application, which runs in a bounded thread pool so blocking handlers
+(e.g. the git routes) never stall the event loop.
+
+Requires the optional ``uvicorn`` and ``httpx`` packages.
+"""
+
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from apilama.logger import HOT_PATH_SAMPLE, get_logger
+from apilama.upstream import close_all_async
+
+try:
+    import httpx  # noqa: F401
+    import uvicorn
+    ASYNC_AVAILABLE = True
+except ImportError:
+    ASYNC_AVAILABLE = False
+
+# Number of threads serving the Flask routes that have no async implementation
+DEFAULT_WSGI_WORKERS = 32
+
+_END_OF_BODY = object()
+
+logger = get_logger()
+
+
+class AsyncRequest:
+    """The parts of an HTTP request the async handlers need."""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+        self.body = body
+        self.remote_addr = scope['client'][0] if scope.get('client') else None
+
+    def get_json(self):
+        """Parse the request body as JSON.
+
+        Returns:
+            The parsed body, or None if the body is empty or not valid JSON.
+        """
+        if not self.body:
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+
+class JSONResponse:
+    """A JSON response sent by an async handler."""
+
+    def __init__(self, payload, status_code=200, headers=None):
+        self.body = json.dumps(payload).encode('utf-8')
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    async def send(self, send):
+        """Send the response over an ASGI connection."""
+        headers = [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(self.body)).encode('latin-1')),
+            (b'access-control-allow-origin', b'*')
+        ]
+        headers.extend((name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                       for name, value in self.headers.items())
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+class StreamingResponse:
+    """A response whose body is relayed from an async iterator chunk by chunk."""
+
+    def __init__(self, body_iterator, status_code=200, headers=None, on_close=None):
+        """Create the response.
+
+        Args:
+            body_iterator: Async iterator yielding the body as bytes.
+            status_code (int, optional): The HTTP status code.
+            headers (dict, optional): The response headers.
+            on_close (callable, optional): Coroutine function awaited once the
+                body is sent or the transfer failed, e.g. to release the
+                upstream connection.
+        """
+        self.body_iterator = body_iterator
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.on_close = on_close
+
+    async def send(self, send):
+        """Send the response over an ASGI connection."""
+        headers = [(b'access-control-allow-origin', b'*')]
+        headers.extend((name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                       for name, value in self.headers.items())
+        try:
+            await send({'type': 'http.response.start', 'status': self.status_code, 'headers': headers})
+            async for chunk in self.body_iterator:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if self.on_close is not None:
+                await self.on_close()
+
+
+async def _read_body(receive):
+    """Read the complete request body from an ASGI connection."""
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+class WSGIBridge:
+    """Serve a WSGI application from an ASGI server using a thread pool.
+
+    Response bodies are relayed chunk by chunk, so streaming Flask responses
+    keep streaming in async mode.
+    """
+
+    def __init__(self, wsgi_app, workers=DEFAULT_WSGI_WORKERS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='apilama-wsgi')
+
+    def _build_environ(self, scope, body):
+        """Build a PEP 3333 environ from an ASGI HTTP scope."""
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for raw_name, raw_value in scope.get('headers', []):
+            name = raw_name.decode('latin-1').upper().replace('-', '_')
+            value = raw_value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                key = 'CONTENT_TYPE'
+            elif name == 'CONTENT_LENGTH':
+                key = 'CONTENT_LENGTH'
+            else:
+                key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    async def __call__(self, scope, receive, send):
+        body = await _read_body(receive)
+        environ = self._build_environ(scope, body)
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in response_headers]
+            return lambda data: None
+
+        iterable = await loop.run_in_executor(self.executor, self.wsgi_app, environ, start_response)
+        try:
+            iterator = iter(iterable)
+            chunk = await loop.run_in_executor(self.executor, next, iterator, _END_OF_BODY)
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': started['headers']})
+            while chunk is not _END_OF_BODY:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(self.executor, next, iterator, _END_OF_BODY)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                await loop.run_in_executor(self.executor, iterable.close)
+
+
+class AsyncGateway:
+    """ASGI application dispatching to async handlers or the Flask application."""
+
+    def __init__(self, wsgi_app, routes, wsgi_workers=DEFAULT_WSGI_WORKERS):
+        """Create the gateway.
+
+        Args:
+            wsgi_app: The Flask application serving all other routes.
+            routes (list): ``(method, path, handler)`` tuples of async handlers.
+            wsgi_workers (int, optional): Threads serving the Flask application.
+        """
+        self.routes = {(method, path): handler for method, path, handler in routes}
+        self.wsgi = WSGIBridge(wsgi_app, wsgi_workers)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_all_async()
+                self.wsgi.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        handler = self.routes.get((scope['method'], scope['path']))
+        if handler is None:
+            return await self.wsgi(scope, receive, send)
+
+        request = AsyncRequest(scope, await _read_body(receive))
+        logger.debug("Request: %s %s from %s", request.method, request.path, request.remote_addr,
+                     sample=HOT_PATH_SAMPLE)
+        try:
+            response = await handler(request)
+        except Exception as e:
+            logger.error('Unhandled error in async handler for %s: %s', request.path, e)
+            response = JSONResponse({'status': 'error', 'message': str(e)}, 500)
+        logger.debug("Response: %s", response.status_code, sample=HOT_PATH_SAMPLE)
+        await response.send(send)
+
+
+def create_asgi_app(test_config=None):
+    """Create the ASGI application for the async serving mode.
+
+    Args:
+        test_config (dict, optional): Test configuration passed to ``create_app()``.
+
+    Returns:
+        AsyncGateway: The ASGI application.
+    """
+    from apilama.app import create_app
+    from apilama.routes.shellama_async_routes import shellama_async_routes
+
+    wsgi_workers = int(os.environ.get('APILAMA_ASYNC_WSGI_WORKERS', DEFAULT_WSGI_WORKERS))
+    return AsyncGateway(create_app(test_config), shellama_async_routes, wsgi_workers)
+
+
+def run(host, port, debug=False):
+    """Serve APILama with uvicorn on an asyncio event loop.
+
+    Args:
+        host (str): Host to bind to.
+        port (int): Port to listen on.
+        debug (bool, optional): Enable debug logging of the server.
+    """
+    if not ASYNC_AVAILABLE:
+        raise RuntimeError('The async server requires the uvicorn and httpx packages '
+                           '(pip install "apilama[async]")')
+    uvicorn.run(create_asgi_app(), host=host, port=port, lifespan='on',
+                log_level='debug' if debug else 'info')
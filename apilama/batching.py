@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Micro-Batching
+
+This module provides a scheduler that combines concurrent calls into
+batched calls.
+
+The first call for a key opens a batch and waits at most ``max_wait``
+seconds for other calls with the same key to join it, or until the batch is
+full. It then runs the whole batch in a single call and hands every waiting
+caller its own result. No dispatcher thread is needed, and the extra latency
+of a call is bounded by ``max_wait``.
+"""
+
+import threading
+import time
+
+
+class _Batch:
+    """The calls collected for one batched call and its outcome."""
+
+    __slots__ = ('items', 'full', 'done', 'results', 'error')
+
+    def __init__(self):
+        self.items = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Combine concurrent calls with the same key into batched calls."""
+
+    def __init__(self, run_batch, max_size, max_wait):
+        """Create the batcher.
+
+        Args:
+            run_batch (callable): Called with a key and the list of items of a
+                batch; returns one result per item, in order. A result that
+                is an exception is raised to the caller of that item.
+            max_size (int): Maximum number of items in a batch.
+            max_wait (float): Maximum seconds a batch waits for more items.
+        """
+        self.run_batch = run_batch
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._open = {}  # key -> batch still accepting items
+
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self._wait_total = 0.0
+
+    def submit(self, key, item):
+        """Add an item to the open batch of a key and wait for its result.
+
+        Args:
+            key: Hashable key; only items with the same key are batched.
+            item: The item passed to ``run_batch``.
+
+        Returns:
+            The result of the item.
+        """
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                self._open[key] = batch
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_size:
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            started = time.monotonic()
+            batch.full.wait(self.max_wait)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+                self.batches += 1
+                self.items += len(batch.items)
+                self.largest_batch = max(self.largest_batch, len(batch.items))
+                self._wait_total += time.monotonic() - started
+            try:
+                batch.results = self.run_batch(key, batch.items)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        result = batch.results[index]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def stats(self):
+        """Get the batch counters."""
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'max_wait': self.max_wait,
+                'batches': self.batches,
+                'items': self.items,
+                'average_batch_size': round(self.items / self.batches, 2) if self.batches else None,
+                'largest_batch': self.largest_batch,
+                'average_wait_seconds': round(self._wait_total / self.batches, 4) if self.batches else None
+            }
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Cache Utilities
+
+This module provides building blocks shared by the in-process caches of
+APILama.
+"""
+
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+from apilama.logger import logger
+
+
+class _Call:
+    """A computation in flight and its outcome."""
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Share one in-flight computation between concurrent callers.
+
+    While a computation for a key runs, other callers with the same key wait
+    for it and get its result (or its exception) instead of starting their
+    own. Results are not kept once the computation finished.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` unless a call for the key is in flight.
+
+        Args:
+            key: Hashable key identifying the computation.
+            fn (callable): The computation.
+
+        Returns:
+            The result of the computation.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entries, bytes and age.
+
+    Entries older than the time to live are never returned. When the cache
+    is over its entry count or its byte budget, the least recently used
+    entries are evicted first.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        """Create the cache.
+
+        Args:
+            max_entries (int): Maximum number of entries.
+            max_bytes (int): Maximum total size of the entries.
+            ttl (float): Seconds an entry stays valid.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, expires)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Get a value and mark it as recently used.
+
+        Returns:
+            The value, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store a value, evicting the least recently used entries as needed.
+
+        Args:
+            key: Hashable key.
+            value: The value.
+            size (int): The size of the value in bytes; values larger than
+                the byte budget are not stored.
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Get the size and the hit/miss counters of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class DiskLRUCache:
+    """Content-addressed cache of byte strings in a directory, bounded in size.
+
+    Each entry is a file named after its key. Reading an entry updates its
+    modification time, and once the directory grows beyond its budget the
+    entries read least recently are deleted. Several processes of the same
+    user may share a directory. The directory is created private (0700) and
+    is only used while it is owned by the current user and not writable by
+    anyone else, so other local users cannot plant entries. Failing disk
+    operations are logged and count as misses; they never fail the caller.
+    """
+
+    # Eviction removes entries until the cache is at this fraction of its budget
+    LOW_WATERMARK = 0.9
+
+    def __init__(self, directory, max_bytes):
+        """Create the cache.
+
+        Args:
+            directory (str): The directory of the cache, created on first write.
+            max_bytes (int): Maximum total size of the entries.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        self._usable = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _check_directory(self):
+        """Create the directory, and check that only this user can write to it.
+
+        Returns:
+            bool: Whether the cache can be used.
+        """
+        if self._usable is not None:
+            return self._usable
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            st = os.lstat(self.directory)
+            if not stat.S_ISDIR(st.st_mode):
+                raise OSError('not a directory')
+            if st.st_uid != os.geteuid():
+                raise OSError(f'owned by uid {st.st_uid}')
+            if st.st_mode & 0o077:
+                # E.g. created with the default permissions by an older version
+                os.chmod(self.directory, 0o700)
+            usable = True
+        except OSError as e:
+            logger.warning("Cache directory %s cannot be used safely, caching is off: %s", self.directory, e)
+            usable = False
+        self._usable = usable
+        return usable
+
+    def get(self, key):
+        """Read an entry and mark it as recently used.
+
+        Args:
+            key (str): A hex digest.
+
+        Returns:
+            bytes or None: The entry, or None if it is missing.
+        """
+        if not self._check_directory():
+            with self._lock:
+                self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            data = None
+        except OSError as e:
+            logger.warning('Reading cache entry %s failed: %s', path, e)
+            data = None
+            with self._lock:
+                self.errors += 1
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Store an entry, evicting the least recently used ones beyond the budget.
+
+        Args:
+            key (str): A hex digest.
+            data (bytes): The entry.
+        """
+        if len(data) > self.max_bytes or not self._check_directory():
+            return
+        path = self._path(key)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning('Writing cache entry %s failed: %s', path, e)
+            with self._lock:
+                self.errors += 1
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        """List the entries as (mtime, size, path) tuples."""
+        entries = []
+        try:
+            buckets = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return entries
+        for bucket in buckets:
+            if not bucket.is_dir(follow_symlinks=False):
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        # Other processes sharing the directory make the running total drift,
+        # so eviction starts from the actual content
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.LOW_WATERMARK
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning('Evicting cache entry %s failed: %s', path, e)
+                continue
+            total -= size
+            self.evictions += 1
+        self._size = total
+
+    def stats(self):
+        """Get the size and the hit/miss counters of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'directory': self.directory,
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'errors': self.errors
+            }
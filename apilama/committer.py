@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Write-Behind Committer
+
+This module provides the optional commit-on-save mode of APILama
+(``APILAMA_GIT_AUTOCOMMIT=true``).
+
+Saves through the file routes only queue the touched paths and return. A
+background thread per repository commits the queue once per window, so a
+burst of saves becomes a single commit that stages only the touched paths
+instead of the whole tree. A failed commit keeps its paths queued and is
+retried after the next window.
+"""
+
+import atexit
+import os
+import threading
+import time
+
+from apilama.git_engine import get_engine
+from apilama.logger import logger
+from apilama.metrics import register_metrics_provider
+
+# Seconds between the first queued save and the commit that includes it
+DEFAULT_WINDOW = 2.0
+DEFAULT_MESSAGE = 'Update {files}'
+
+# Number of file names spelled out in the default commit message
+MESSAGE_MAX_FILES = 3
+
+_committers = {}
+_committers_lock = threading.Lock()
+
+
+def autocommit_enabled():
+    """Check whether saves are committed by the write-behind committer."""
+    return os.environ.get('APILAMA_GIT_AUTOCOMMIT', 'False').lower() in ('true', '1', 't')
+
+
+class WriteBehindCommitter:
+    """Background committer coalescing the saves of one repository."""
+
+    def __init__(self, path, window=None, message=None):
+        """Create the committer.
+
+        Args:
+            path (str): The working tree of the repository.
+            window (float, optional): Seconds saves are collected before a commit.
+            message (str, optional): Commit message template; ``{files}`` and
+                ``{count}`` are replaced with the committed files.
+        """
+        self.path = os.path.abspath(path)
+        self.window = window if window is not None else float(
+            os.environ.get('APILAMA_GIT_AUTOCOMMIT_WINDOW', DEFAULT_WINDOW))
+        self.message = message or os.environ.get('APILAMA_GIT_AUTOCOMMIT_MESSAGE', DEFAULT_MESSAGE)
+
+        self._cond = threading.Condition()
+        self._pending = {}  # relative path -> monotonic time it was first queued
+        self._committing = 0
+        self._flush = False
+        self._retry_at = 0.0
+        self._thread = None
+        self._thread_pid = None
+
+        self.saves = 0
+        self.commits = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_commit_lag = None
+
+    def enqueue(self, paths):
+        """Queue saved paths for the next commit.
+
+        Args:
+            paths (list): Absolute paths inside the working tree.
+        """
+        now = time.monotonic()
+        with self._cond:
+            for path in paths:
+                relative = os.path.relpath(os.path.abspath(path), self.path)
+                if relative.startswith('..'):
+                    continue
+                self._pending.setdefault(relative.replace(os.sep, '/'), now)
+                self.saves += 1
+            self._start()
+            self._cond.notify_all()
+
+    def _start(self):
+        # Threads do not survive fork(), a child process starts its own
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='apilama-committer', daemon=True)
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                while True:
+                    now = time.monotonic()
+                    deadline = now if self._flush else min(self._pending.values()) + self.window
+                    # A failed commit is not retried before the next window
+                    deadline = max(deadline, self._retry_at)
+                    if now >= deadline:
+                        break
+                    self._cond.wait(deadline - now)
+                batch = self._take()
+            self._commit(batch)
+
+    def _take(self):
+        batch = self._pending
+        self._pending = {}
+        self._committing += len(batch)
+        return batch
+
+    def _format_message(self, paths):
+        if len(paths) <= MESSAGE_MAX_FILES:
+            files = ', '.join(paths)
+        else:
+            files = f'{len(paths)} files'
+        return self.message.format(files=files, count=len(paths))
+
+    def _commit(self, batch):
+        paths = sorted(batch)
+        try:
+            commit = get_engine(self.path).commit(self._format_message(paths), paths=paths)
+            with self._cond:
+                if commit is not None:
+                    self.commits += 1
+                self.last_commit_lag = time.monotonic() - min(batch.values())
+                self._retry_at = 0.0
+        except Exception as e:
+            logger.error('Write-behind commit in %s failed: %s', self.path, e)
+            with self._cond:
+                self.errors += 1
+                self.last_error = str(e)
+                self._retry_at = time.monotonic() + self.window
+                for path, queued_at in batch.items():
+                    self._pending.setdefault(path, queued_at)
+        finally:
+            with self._cond:
+                self._committing -= len(batch)
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Commit all queued saves now and wait for the commit.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait.
+
+        Returns:
+            bool: Whether the queue is empty.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            threadless = (self._thread is None or self._thread_pid != os.getpid()
+                          or not self._thread.is_alive())
+            if threadless:
+                batch = self._take()
+
+        if threadless:
+            # No committer thread in this process: commit in the caller
+            if batch:
+                self._commit(batch)
+            with self._cond:
+                return not self._pending
+
+        with self._cond:
+            self._flush = True
+            self._retry_at = 0.0
+            self._cond.notify_all()
+            try:
+                while self._pending or self._committing:
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            finally:
+                self._flush = False
+            return not self._pending and not self._committing
+
+    def stats(self):
+        """Get the queue depth, lag and counters of the committer."""
+        with self._cond:
+            oldest = min(self._pending.values()) if self._pending else None
+            return {
+                'path': self.path,
+                'queue_depth': len(self._pending) + self._committing,
+                'lag_seconds': round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+                'saves': self.saves,
+                'commits': self.commits,
+                'errors': self.errors,
+                'last_error': self.last_error,
+                'last_commit_lag_seconds': (round(self.last_commit_lag, 3)
+                                            if self.last_commit_lag is not None else None)
+            }
+
+
+def get_committer(path):
+    """Get the committer of a repository, creating it on first use.
+
+    Args:
+        path (str): The working tree of the repository.
+
+    Returns:
+        WriteBehindCommitter: The committer.
+    """
+    path = os.path.abspath(path)
+    with _committers_lock:
+        committer = _committers.get(path)
+        if committer is None:
+            committer = WriteBehindCommitter(path)
+            _committers[path] = committer
+        return committer
+
+
+def queue_commit(repo_path, paths):
+    """Queue saved files for a write-behind commit if the mode is enabled.
+
+    Args:
+        repo_path (str): The working tree the files were saved in.
+        paths (list): The absolute paths of the saved or deleted files.
+
+    Returns:
+        bool: Whether the files were queued.
+    """
+    if not autocommit_enabled() or not os.path.isdir(os.path.join(repo_path, '.git')):
+        return False
+    get_committer(repo_path).enqueue(paths)
+    return True
+
+
+def flush_all(timeout=10.0):
+    """Commit the queued saves of all repositories, e.g. before exiting."""
+    with _committers_lock:
+        committers = list(_committers.values())
+    for committer in committers:
+        if not committer.flush(timeout):
+            logger.warning('Write-behind commits in %s were not flushed in time', committer.path)
+
+
+def get_committer_stats():
+    """Get the stats of all committers."""
+    with _committers_lock:
+        committers = list(_committers.values())
+    return [committer.stats() for committer in committers]
+
+
+atexit.register(flush_all)
+register_metrics_provider('committer', get_committer_stats)
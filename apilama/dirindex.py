@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Directory Index
+
+This module keeps an in-memory index of the files in a directory, so listing
+endpoints such as ``/api/files`` are served from memory instead of globbing
+and stat-ing every file on each request.
+
+The index is built from a single ``os.scandir`` pass and pre-serialized to a
+JSON body with a strong ETag. It is kept fresh by inotify events when
+available; otherwise each lookup compares the directory mtime (one ``stat``
+call) and rebuilds at least every ``APILAMA_DIR_INDEX_TTL`` seconds, since
+in-place edits of a file do not change the directory mtime. Writes made by
+APILama itself invalidate the index explicitly.
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import threading
+import time
+
+from apilama.fileio import is_state_file
+from apilama.fswatch import DirectoryWatcher
+from apilama.logger import logger
+from apilama.metrics import register_metrics_provider
+
+# Maximum age of an index in seconds when changes are detected by mtime only
+DEFAULT_TTL = 5.0
+
+
+class IndexSnapshot:
+    """An immutable listing of a directory at one point in time."""
+
+    __slots__ = ('files', 'body', 'etag', 'built_at')
+
+    def __init__(self, files, body, etag, built_at):
+        self.files = files
+        self.body = body
+        self.etag = etag
+        self.built_at = built_at
+
+
+class DirectoryIndex:
+    """In-memory, self-invalidating listing of the files in a directory."""
+
+    def __init__(self, path, pattern='*', ttl=None):
+        """Create the index.
+
+        Args:
+            path (str): The directory to index.
+            pattern (str, optional): Glob pattern file names must match.
+            ttl (float, optional): Maximum age of the index in mtime mode.
+        """
+        self.path = path
+        self.pattern = pattern
+        self.ttl = ttl if ttl is not None else float(os.environ.get('APILAMA_DIR_INDEX_TTL', DEFAULT_TTL))
+
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._dir_mtime = None
+        self._dirty = True
+        self._watcher = DirectoryWatcher(self._on_change)
+
+        self._hits = 0
+        self._rebuilds = 0
+
+    @property
+    def mode(self):
+        """How changes are detected: 'inotify' or 'mtime'."""
+        return 'inotify' if self._watcher.running else 'mtime'
+
+    def _on_change(self, path):
+        self._dirty = True
+
+    def invalidate(self):
+        """Mark the index as stale, e.g. after APILama wrote to the directory."""
+        self._dirty = True
+
+    def _is_fresh(self):
+        if self._snapshot is None or self._dirty:
+            return False
+        if self._watcher.running:
+            return True
+        if time.monotonic() - self._snapshot.built_at > self.ttl:
+            return False
+        try:
+            return os.stat(self.path).st_mtime_ns == self._dir_mtime
+        except OSError:
+            return False
+
+    def snapshot(self):
+        """Get the current listing, rebuilding it only if it is stale.
+
+        Returns:
+            IndexSnapshot: The listing with its JSON body and ETag.
+        """
+        if self._is_fresh():
+            self._hits += 1
+            return self._snapshot
+
+        with self._lock:
+            if self._is_fresh():
+                self._hits += 1
+                return self._snapshot
+            return self._rebuild()
+
+    def _rebuild(self):
+        if not os.path.isdir(self.path):
+            logger.info("Creating directory: %s", self.path)
+            os.makedirs(self.path, exist_ok=True)
+
+        if self._watcher.start() and not self._watcher.is_watching(self.path):
+            self._watcher.add_watch(self.path)
+
+        # Clear the flag before scanning: a change during the scan marks the
+        # new snapshot stale again instead of being lost
+        self._dirty = False
+        self._dir_mtime = os.stat(self.path).st_mtime_ns
+
+        files = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if not fnmatch.fnmatch(entry.name, self.pattern) or is_state_file(entry.name):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    # Removed between listing and stat
+                    continue
+                files.append({
+                    'name': entry.name,
+                    'path': entry.path,
+                    'size': stat.st_size,
+                    'last_modified': stat.st_mtime
+                })
+        files.sort(key=lambda f: f['name'])
+
+        body = json.dumps({'status': 'success', 'files': files}).encode('utf-8')
+        etag = hashlib.sha1(body).hexdigest()
+        self._snapshot = IndexSnapshot(files, body, etag, time.monotonic())
+        self._rebuilds += 1
+        return self._snapshot
+
+    def stats(self):
+        """Get the counters of the index."""
+        snapshot = self._snapshot
+        return {
+            'path': self.path,
+            'pattern': self.pattern,
+            'mode': self.mode,
+            'files': len(snapshot.files) if snapshot is not None else None,
+            'hits': self._hits,
+            'rebuilds': self._rebuilds
+        }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_directory_index(path, pattern='*'):
+    """Get the shared index of a directory, creating it on first use.
+
+    Args:
+        path (str): The directory to index.
+        pattern (str, optional): Glob pattern file names must match.
+
+    Returns:
+        DirectoryIndex: The shared index.
+    """
+    key = (os.path.abspath(path), pattern)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = DirectoryIndex(key[0], pattern)
+            _indexes[key] = index
+        return index
+
+
+def invalidate_directory(path):
+    """Invalidate every index of a directory after writing to it.
+
+    Args:
+        path (str): The directory that was written to.
+    """
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        indexes = [index for (index_path, _), index in _indexes.items() if index_path == path]
+    for index in indexes:
+        index.invalidate()
+
+
+def get_index_stats():
+    """Get the counters of all directory indexes."""
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    return [index.stats() for index in indexes]
+
+
+register_metrics_provider('directory_index', get_index_stats)
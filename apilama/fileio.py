@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama File I/O
+
+This module provides crash-safe writes of files in the markdown directory.
+
+Every file is written to a temporary file next to its target, fsynced and
+renamed over the target, so readers see either the old or the new content and
+never a truncated file. Batches fsync each directory once after all renames.
+
+Staged batches are all-or-nothing: all temporary files are written and
+fsynced first, then a journal listing the renames is made durable before any
+rename happens. A crash before the journal exists leaves the old files; a
+crash after it is rolled forward by ``recover_batches()``.
+
+Batches hold a shared ``flock`` on a lock file in the journal directory
+while their journal exists, and recovery holds it exclusively, so the
+workers of a prefork server never recover a batch that is still being
+applied, or the same batch twice.
+
+The lock file, the journals and the temporary files live in the directory
+being written, which may be a git working tree: ``exclude_state()`` lists
+them in ``.git/info/exclude`` so git status and commits never pick them up.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on this platform, batches are then only safe within one process
+    fcntl = None
+
+from apilama.logger import logger
+
+JOURNAL_PREFIX = '.apilama-batch-'
+TEMP_SUFFIX = '.apilama-tmp'
+LOCK_NAME = '.apilama-batch.lock'
+
+# Patterns of the files above, for .git/info/exclude
+STATE_PATTERNS = (LOCK_NAME, f'{JOURNAL_PREFIX}*.json', f'.*{TEMP_SUFFIX}')
+
+# Orphaned temporary files older than this many seconds are removed on recovery
+ORPHAN_AGE = 3600
+
+_recovered = set()
+_recovered_lock = threading.Lock()
+_excluded = set()
+_excluded_lock = threading.Lock()
+
+
+def fsync_directory(path):
+    """Flush the directory entries of a directory to disk.
+
+    Args:
+        path (str): The directory.
+    """
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def is_state_file(name):
+    """Check whether a file name is one of the batch state files.
+
+    Args:
+        name (str): The file name, without its directory.
+    """
+    return (name == LOCK_NAME or name.endswith(TEMP_SUFFIX)
+            or (name.startswith(JOURNAL_PREFIX) and name.endswith('.json')))
+
+
+def exclude_state(directory):
+    """Keep the batch state files out of the git repository of a directory.
+
+    Adds ``STATE_PATTERNS`` to ``.git/info/exclude`` if the directory is the
+    working tree of a repository and they are not listed yet.
+
+    Args:
+        directory (str): The directory the batch journals are kept in.
+
+    Returns:
+        bool: Whether the directory is a git working tree.
+    """
+    git_dir = os.path.join(directory, '.git')
+    if not os.path.isdir(git_dir):
+        return False
+    exclude_path = os.path.join(git_dir, 'info', 'exclude')
+    try:
+        with open(exclude_path) as f:
+            content = f.read()
+    except FileNotFoundError:
+        content = ''
+    lines = content.splitlines()
+    missing = [pattern for pattern in STATE_PATTERNS if pattern not in lines]
+    if missing:
+        os.makedirs(os.path.dirname(exclude_path), exist_ok=True)
+        with open(exclude_path, 'a') as f:
+            if content and not content.endswith('\n'):
+                f.write('\n')
+            f.write('# APILama batch state\n' + ''.join(f'{pattern}\n' for pattern in missing))
+    return True
+
+
+def _exclude_once(directory):
+    key = (os.getpid(), os.path.abspath(directory))
+    if key in _excluded:
+        return
+    with _excluded_lock:
+        if key not in _excluded:
+            exclude_state(directory)
+            _excluded.add(key)
+
+
+@contextlib.contextmanager
+def _journal_lock(directory, exclusive=False):
+    """Hold the lock serializing batch journals and their recovery.
+
+    Args:
+        directory (str): The directory the batch journals are kept in.
+        exclusive (bool, optional): Take the lock exclusively, as recovery does.
+    """
+    _exclude_once(directory)
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(os.path.join(directory, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def _temp_path(path, batch_id):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}.{batch_id}{TEMP_SUFFIX}')
+
+
+def _write_temp(path, data, batch_id):
+    """Write data to a fsynced temporary file next to path.
+
+    Returns:
+        str: The path of the temporary file.
+    """
+    temp_path = _temp_path(path, batch_id)
+    # 0o666 lets the umask apply like it does for open(path, 'w')
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            # Keep the permissions of the file being replaced
+            os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    return temp_path
+
+
+def atomic_write(path, content, sync_directory=True):
+    """Replace the content of a file atomically.
+
+    Args:
+        path (str): The file to write.
+        content (str or bytes): The new content; text is encoded as UTF-8.
+        sync_directory (bool, optional): Also fsync the parent directory, so
+            the rename itself survives a crash.
+    """
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    temp_path = _write_temp(path, data, uuid.uuid4().hex[:12])
+    os.replace(temp_path, path)
+    if sync_directory:
+        fsync_directory(os.path.dirname(path) or '.')
+
+
+def write_batch(directory, files, staged=False):
+    """Write several files, each atomically, with one fsync per directory.
+
+    Args:
+        directory (str): The directory the batch journal is kept in.
+        files (list): ``(path, content)`` pairs; text is encoded as UTF-8.
+        staged (bool, optional): Make the whole batch all-or-nothing.
+
+    Returns:
+        list: The paths that did not exist before the batch.
+    """
+    batch_id = uuid.uuid4().hex[:12]
+    created = [path for path, _ in files if not os.path.exists(path)]
+    directories = {os.path.dirname(path) or '.' for path, _ in files}
+
+    if not staged:
+        for path, content in files:
+            data = content.encode('utf-8') if isinstance(content, str) else content
+            os.replace(_write_temp(path, data, batch_id), path)
+        for synced in directories:
+            fsync_directory(synced)
+        return created
+
+    renames = []
+    try:
+        for path, content in files:
+            data = content.encode('utf-8') if isinstance(content, str) else content
+            renames.append((_write_temp(path, data, batch_id), path))
+    except BaseException:
+        for temp_path, _ in renames:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+        raise
+
+    # Temporary files must be durable before the journal makes them the
+    # committed state of the batch
+    for synced in directories:
+        fsync_directory(synced)
+
+    journal_path = os.path.join(directory, f'{JOURNAL_PREFIX}{batch_id}.json')
+    with _journal_lock(directory):
+        atomic_write(journal_path, json.dumps({'renames': renames}), sync_directory=True)
+
+        _apply_renames(renames)
+        for synced in directories:
+            fsync_directory(synced)
+        os.unlink(journal_path)
+    return created
+
+
+def _apply_renames(renames):
+    for temp_path, path in renames:
+        try:
+            os.replace(temp_path, path)
+        except FileNotFoundError:
+            # Already renamed before a crash, or by a concurrent recovery
+            pass
+
+
+def recover_batches(directory):
+    """Roll forward staged batches interrupted by a crash.
+
+    Committed batches (those with a journal) are completed; temporary files
+    older than ``ORPHAN_AGE`` that belong to no journal are removed. Safe to
+    run from several processes at once: a journal completed by another one
+    counts as recovered there.
+
+    Args:
+        directory (str): The directory the batch journals are kept in.
+
+    Returns:
+        int: The number of batches rolled forward by this call.
+    """
+    if not os.path.isdir(directory):
+        return 0
+
+    with _journal_lock(directory, exclusive=True):
+        recovered = _recover_journals(directory)
+
+        cutoff = time.time() - ORPHAN_AGE
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if name.startswith('.') and name.endswith(TEMP_SUFFIX):
+                    path = os.path.join(root, name)
+                    try:
+                        if os.stat(path).st_mtime < cutoff:
+                            os.unlink(path)
+                    except OSError:
+                        pass
+    return recovered
+
+
+def _recover_journals(directory):
+    recovered = 0
+    journals = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith(JOURNAL_PREFIX) and entry.name.endswith('.json'):
+                journals.append(entry.path)
+
+    for journal_path in journals:
+        try:
+            with open(journal_path) as f:
+                renames = json.load(f)['renames']
+        except FileNotFoundError:
+            # Completed since the directory was listed
+            continue
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning('Ignoring unreadable batch journal %s: %s', journal_path, e)
+            continue
+        _apply_renames(renames)
+        for synced in {os.path.dirname(path) or '.' for _, path in renames}:
+            fsync_directory(synced)
+        try:
+            os.unlink(journal_path)
+        except FileNotFoundError:
+            continue
+        recovered += 1
+        logger.info('Rolled forward interrupted batch %s', journal_path)
+    return recovered
+
+
+def ensure_recovered(directory):
+    """Run ``recover_batches()`` once per process for a directory.
+
+    Call it before writing to a directory: it also keeps the state files of
+    the writes out of git (see ``exclude_state()``).
+
+    Args:
+        directory (str): The directory the batch journals are kept in.
+    """
+    key = (os.getpid(), os.path.abspath(directory))
+    if key in _recovered:
+        return
+    with _recovered_lock:
+        if key not in _recovered:
+            recover_batches(directory)
+            _recovered.add(key)
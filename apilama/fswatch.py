@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Filesystem Watcher
+
+This module provides a small inotify based directory watcher used to keep
+in-memory caches of the markdown directory fresh.
+
+inotify is reached through ctypes, so there is no extra dependency; on
+platforms without it (or when ``APILAMA_FS_WATCH=mtime``) ``start()`` returns
+False and callers fall back to polling directory mtimes.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import sys
+import select
+import struct
+import threading
+
+from apilama.logger import logger
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc = libc
+    return _libc
+
+
+def inotify_available():
+    """Check whether inotify watching is available and enabled.
+
+    Returns:
+        bool: False on platforms without inotify or when ``APILAMA_FS_WATCH``
+        is set to 'mtime'.
+    """
+    if os.environ.get('APILAMA_FS_WATCH', 'inotify').lower() != 'inotify':
+        return False
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(_get_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+
+class DirectoryWatcher:
+    """Watch directories with inotify and report changes to a callback.
+
+    The callback is called from the watcher thread with the absolute path of
+    the changed entry, or with None when events were lost and everything must
+    be considered changed. It should be cheap, e.g. set a flag.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._fd = None
+        self._watches = {}  # wd -> (path, recursive, exclude)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        """Whether the watcher thread runs in the current process."""
+        return (self._thread is not None and self._thread.is_alive()
+                and self._pid == os.getpid())
+
+    def start(self):
+        """Start the watcher thread.
+
+        Returns:
+            bool: Whether inotify watching is active.
+        """
+        if self.running:
+            return True
+        if not inotify_available():
+            return False
+
+        fd = _get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logger.warning('inotify_init1 failed: %s', os.strerror(ctypes.get_errno()))
+            return False
+
+        self._fd = fd
+        self._watches = {}
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='apilama-fswatch', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Stop the watcher thread and release the inotify descriptor."""
+        self._stop.set()
+
+    def add_watch(self, path, recursive=False, exclude=()):
+        """Watch a directory.
+
+        Args:
+            path (str): The directory to watch.
+            recursive (bool, optional): Also watch all subdirectories, including
+                the ones created later.
+            exclude (tuple, optional): Names of subdirectories not to descend into.
+
+        Returns:
+            bool: Whether the watch was added.
+        """
+        if self._fd is None:
+            return False
+        wd = _get_libc().inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logger.warning('inotify watch limit reached, raise fs.inotify.max_user_watches')
+            else:
+                logger.warning('Cannot watch %s: %s', path, os.strerror(err))
+            return False
+
+        with self._lock:
+            self._watches[wd] = (path, recursive, tuple(exclude))
+
+        if recursive:
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False) and entry.name not in exclude:
+                            self.add_watch(entry.path, recursive=True, exclude=exclude)
+            except OSError:
+                pass
+        return True
+
+    def is_watching(self, path):
+        """Check whether a directory is currently watched.
+
+        A watch disappears when its directory is deleted or moved away.
+        """
+        if not self.running:
+            return False
+        with self._lock:
+            return any(watch[0] == path for watch in self._watches.values())
+
+    def _run(self):
+        fd = self._fd
+        try:
+            while not self._stop.is_set():
+                readable, _, _ = select.select([fd], [], [], 0.5)
+                if not readable:
+                    continue
+                try:
+                    data = os.read(fd, 65536)
+                except BlockingIOError:
+                    continue
+                self._dispatch(data)
+        except Exception as e:
+            logger.error('Filesystem watcher stopped: %s', e)
+            self.callback(None)
+        finally:
+            os.close(fd)
+            self._fd = None
+
+    def _dispatch(self, data):
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.callback(None)
+                continue
+
+            with self._lock:
+                watch = self._watches.get(wd)
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+            if watch is None:
+                continue
+
+            directory, recursive, exclude = watch
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            if recursive and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                if os.path.basename(path) not in exclude:
+                    self.add_watch(path, recursive=True, exclude=exclude)
+            self.callback(path)
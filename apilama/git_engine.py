@@ -0,0 +1,757 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Git Engine
+
+This module provides a long-lived git backend for the git routes.
+
+One engine is kept per repository and process. With GitPython it holds an
+open repository handle: the index and refs are parsed in Python and objects
+are read through one persistent ``git cat-file --batch`` process, so status
+and log do not fork a ``git`` process per call. Only the ignore rules are
+evaluated by git, in one ``git check-ignore`` call per status, and only when
+there are untracked files. Status falls back to ``git status`` for the states
+the Python reader does not model: merge conflicts, possible renames, files
+with attributes (filters, line endings) and extended index flags.
+
+Writes to the index and commits always go through the ``git`` CLI, which
+handles conflicts, merges and the index extensions. Without GitPython every
+operation uses the ``git`` CLI.
+
+All operations on a repository are serialized by a per-repository lock.
+Status results are cached until inotify reports a change in the working tree
+or in ``.git``, or our own writes invalidate them (``invalidate_status()``).
+"""
+
+import hashlib
+import heapq
+import importlib.util
+import os
+import subprocess
+import threading
+import time
+from struct import pack
+
+from apilama.cache import SingleFlight
+from apilama.fswatch import DirectoryWatcher
+from apilama.logger import logger
+from apilama.metrics import register_metrics_provider
+
+# GitPython is imported by the first engine (see load_gitpython), it is one
+# of the slowest imports of APILama
+GITPYTHON_AVAILABLE = importlib.util.find_spec('git') is not None
+_gitpython_loaded = False
+
+# Seconds within which a changed status is not recomputed again
+DEFAULT_STATUS_DEBOUNCE = 1.0
+
+# Output of `git commit` (in the C locale) when there is nothing to commit
+NOTHING_TO_COMMIT = ('nothing to commit', 'nothing added to commit', 'no changes added to commit')
+
+# Number of paths passed to one `git check-ignore` call
+CHECK_IGNORE_CHUNK = 500
+
+# Index entry flags: assume-unchanged, and extended flags (intent-to-add,
+# skip-worktree)
+CE_VALID = 0x8000
+CE_EXTENDED = 0x4000
+
+# New commits parsed on top of the cached history before the cache is rebuilt
+LOG_MAX_FAST_FORWARD = 1000
+
+# Maximum number of memoized (tree, path) lookups of the path filter
+PATH_MEMO_SIZE = 65536
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def load_gitpython():
+    """Import GitPython on first use.
+
+    Returns:
+        bool: Whether GitPython is available.
+    """
+    global GITPYTHON_AVAILABLE, _gitpython_loaded
+    global Repo, stat_mode_to_index_mode, Tree
+    if _gitpython_loaded or not GITPYTHON_AVAILABLE:
+        return GITPYTHON_AVAILABLE
+    try:
+        from git import Repo
+        from git.index.fun import stat_mode_to_index_mode
+        from git.objects import Tree
+    except ImportError:
+        # E.g. GitPython without a git executable
+        GITPYTHON_AVAILABLE = False
+    _gitpython_loaded = True
+    return GITPYTHON_AVAILABLE
+
+
+class GitError(Exception):
+    """A git operation failed."""
+
+
+def _format_commit(hexsha, author, date, message):
+    return {
+        'hash': hexsha[:7],
+        'author': author,
+        'date': date,
+        'message': message
+    }
+
+
+class _Engine:
+    """Status cache shared by the git engines.
+
+    The result of ``status()`` is kept until a filesystem event in the working
+    tree or in ``.git`` (inotify), or an explicit invalidation, marks it dirty.
+    A dirty result is recomputed at most once per debounce window; explicit
+    invalidations after our own writes take effect immediately. Without
+    inotify, results are reused for one debounce window. Concurrent callers
+    share one computation.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.lock = threading.RLock()
+        self.debounce = float(os.environ.get('APILAMA_GIT_STATUS_DEBOUNCE', DEFAULT_STATUS_DEBOUNCE))
+        self._status = None
+        self._status_at = 0.0
+        self._status_dirty = True
+        self._status_generation = 0
+        self._status_flight = SingleFlight()
+        self._status_hits = 0
+        self._watcher = DirectoryWatcher(self._on_change)
+
+    def close(self):
+        self._watcher.stop()
+
+    def _on_change(self, path):
+        self._status_dirty = True
+
+    def invalidate_status(self):
+        """Drop the cached status, e.g. after writing to the working tree."""
+        self._status_dirty = True
+        self._status_generation += 1
+
+    def _watch(self):
+        if not self._watcher.start() or self._watcher.is_watching(self.path):
+            return
+        git_dir = os.path.join(self.path, '.git')
+        self._watcher.add_watch(self.path, recursive=True, exclude=('.git',))
+        # The index, HEAD and the refs change when git is used directly
+        self._watcher.add_watch(git_dir)
+        self._watcher.add_watch(os.path.join(git_dir, 'refs'), recursive=True)
+
+    def _status_fresh(self, generation):
+        if self._status is None or self._status[0] != generation:
+            return False
+        if not self._watcher.running:
+            return time.monotonic() - self._status_at < self.debounce
+        return not self._status_dirty or time.monotonic() - self._status_at < self.debounce
+
+    def _compute_status(self, generation):
+        # Watch and reset the flag first: changes made while computing mark
+        # the new result dirty instead of being lost
+        self._watch()
+        self._status_dirty = False
+        files = self.status()
+        self._status = (generation, files)
+        self._status_at = time.monotonic()
+        return files
+
+    def cached_status(self):
+        """Get the result of ``status()`` from the cache when it is still valid.
+
+        Returns:
+            list: ``{'status': ..., 'filename': ...}`` dicts.
+        """
+        generation = self._status_generation
+        if self._status_fresh(generation):
+            self._status_hits += 1
+            return self._status[1]
+        return self._status_flight.do(generation, self._compute_status, generation)
+
+    def _run(self, *args):
+        result = subprocess.run(['git', *args], cwd=self.path, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise GitError(result.stderr.strip() or f'git {args[0]} failed')
+        return result.stdout
+
+    def _cli_status(self):
+        output = self._run('status', '--porcelain', '-z')
+        files = []
+        records = iter(output.split('\0'))
+        for record in records:
+            if not record:
+                continue
+            code, filename = record[:2], record[3:]
+            if code[0] in 'RC':
+                # Renames are followed by the original path
+                next(records, None)
+            files.append({'status': code.strip(), 'filename': filename})
+        return files
+
+    def _merging(self):
+        return os.path.exists(os.path.join(self.path, '.git', 'MERGE_HEAD'))
+
+    def add(self, paths=None):
+        """Stage files, like ``git add --all``.
+
+        Args:
+            paths (list, optional): Paths relative to the working tree. By
+                default every change is staged.
+
+        Returns:
+            list: The given paths.
+        """
+        with self.lock:
+            self._run('add', '--all', '--', *(paths or ['.']))
+            self.invalidate_status()
+        return paths
+
+    def _tracked(self, paths):
+        """Get which of the paths are in the index."""
+        return set(self._run('ls-files', '-z', '--', *paths).split('\0')) - {''}
+
+    def _committable(self, paths):
+        """Drop the paths that are neither in the working tree nor in the index.
+
+        A file created and deleted again before it was committed has nothing
+        to commit, and git rejects a pathspec matching no file.
+        """
+        missing = [path for path in paths if not os.path.lexists(os.path.join(self.path, path))]
+        if not missing:
+            return paths
+        tracked = self._tracked(missing)
+        return [path for path in paths if path in tracked or path not in missing]
+
+    def commit(self, message, paths=None):
+        """Stage changes and commit them.
+
+        A merge in progress is concluded with a merge commit.
+
+        Args:
+            message (str): The commit message.
+            paths (list, optional): Only stage and commit these paths instead
+                of all changes. Changes staged in other paths are left staged.
+
+        Returns:
+            dict or None: The new commit, or None if there was nothing to commit.
+        """
+        with self.lock:
+            if paths:
+                paths = self._committable(paths)
+                if not paths:
+                    return None
+            self.add(paths)
+            args = ['git', 'commit', '-m', message]
+            if paths and not self._merging():
+                # Without a pathspec git commits everything staged in the
+                # index; a merge can only be concluded as a whole
+                args.extend(['--', *paths])
+            # Untranslated output, to tell "nothing to commit" from errors
+            result = subprocess.run(args, cwd=self.path, capture_output=True, text=True,
+                                    env=dict(os.environ, LC_ALL='C'))
+            if result.returncode != 0:
+                if any(text in result.stdout for text in NOTHING_TO_COMMIT):
+                    return None
+                raise GitError(result.stderr.strip() or result.stdout.strip() or 'git commit failed')
+            self.invalidate_status()
+            commit = self.log(limit=1)[0][0]
+            logger.info("Committed %s in %s", commit['hash'], self.path)
+            return commit
+
+    def stats(self):
+        """Get the counters of the status cache."""
+        return {
+            'path': self.path,
+            'mode': 'inotify' if self._watcher.running else 'debounce',
+            'status_hits': self._status_hits,
+            'status_computations': self._status_flight.executed,
+            'status_shared': self._status_flight.shared
+        }
+
+
+class GitEngine(_Engine):
+    """Git operations on one repository through a persistent GitPython handle."""
+
+    def __init__(self, path):
+        """Open the repository.
+
+        Args:
+            path (str): The working tree of the repository.
+        """
+        load_gitpython()
+        super().__init__(path)
+        self.repo = Repo(self.path)
+        self._head_tree = (None, {})
+        self._path_memo = {}
+        self._reset_log(None)
+
+    def close(self):
+        """Stop the persistent git processes of the repository handle."""
+        super().close()
+        with self.lock:
+            self.repo.close()
+
+    # Helpers
+
+    def _head_commit(self):
+        return self.repo.head.commit if self.repo.head.is_valid() else None
+
+    def _head_blobs(self):
+        """Map the paths of the HEAD tree to their blob ids, cached per HEAD."""
+        head = self._head_commit()
+        head_sha = head.binsha if head is not None else None
+        if self._head_tree[0] != head_sha:
+            blobs = {}
+            if head is not None:
+                for item in head.tree.traverse():
+                    if item.type == 'blob':
+                        blobs[item.path] = (item.binsha, item.mode)
+            self._head_tree = (head_sha, blobs)
+        return self._head_tree[1]
+
+    @staticmethod
+    def _read_worktree(full_path, st):
+        if os.path.islink(full_path):
+            return os.fsencode(os.readlink(full_path))
+        with open(full_path, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def _blob_sha(data):
+        return hashlib.sha1(b'blob %d\0' % len(data) + data).digest()
+
+    @staticmethod
+    def _stat_fields(st):
+        return (
+            pack('>LL', int(st.st_ctime) & 0xffffffff, st.st_ctime_ns % 1000000000),
+            pack('>LL', int(st.st_mtime) & 0xffffffff, st.st_mtime_ns % 1000000000),
+            st.st_dev & 0xffffffff,
+            st.st_ino & 0xffffffff,
+            st.st_uid & 0xffffffff,
+            st.st_gid & 0xffffffff,
+            st.st_size & 0xffffffff
+        )
+
+    def _worktree_changed(self, entry, full_path, index_mtime):
+        """Compare an index entry with the working tree file.
+
+        Returns:
+            str or None: 'D' if the file is gone, 'M' if it changed, else None.
+        """
+        try:
+            st = os.lstat(full_path)
+        except FileNotFoundError:
+            return 'D'
+        if stat_mode_to_index_mode(st.st_mode) != entry.mode:
+            return 'M'
+
+        _, mtime_bytes, _, inode, _, _, size = self._stat_fields(st)
+        if size != entry.size:
+            return 'M'
+        # Unchanged stat data proves the file is clean unless it was modified
+        # within the same timestamp the index was written at ("racy git")
+        if mtime_bytes == entry.mtime_bytes and inode == entry.inode:
+            if entry.mtime < index_mtime:
+                return None
+        return 'M' if self._blob_sha(self._read_worktree(full_path, st)) != entry.binsha else None
+
+    def _untracked(self, tracked):
+        """List the untracked paths that are not ignored, like ``git status``.
+
+        As in git's default untracked mode, a directory without tracked files
+        is reported as ``dir/`` as soon as it holds one untracked file that
+        is not ignored, and nested repositories are reported as a directory.
+
+        The working tree is walked one depth at a time, with one
+        ``git check-ignore`` call per depth for the untracked files and the
+        directories without tracked files found at that depth, so ignored
+        trees (``node_modules/``, build output) are never entered, nor the
+        rest of a directory already known to be reported.
+        """
+        tracked_dirs = set()
+        for path in tracked:
+            parent = os.path.dirname(path)
+            while parent and parent not in tracked_dirs:
+                tracked_dirs.add(parent)
+                parent = os.path.dirname(parent)
+
+        untracked = set()
+        # (directory, the untracked directory it is reported as, or None)
+        level = [('', None)]
+        while level:
+            candidates = []
+            next_level = []
+            for rel_dir, owner in level:
+                if owner in untracked:
+                    continue
+                try:
+                    entries = list(os.scandir(os.path.join(self.path, rel_dir)))
+                except OSError:
+                    # Removed while walking
+                    continue
+                for entry in entries:
+                    rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+                    if rel_path in tracked:
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if not is_dir:
+                        candidates.append((rel_path, owner, False))
+                    elif entry.name == '.git':
+                        continue
+                    elif os.path.lexists(os.path.join(entry.path, '.git')):
+                        # A nested repository, git does not look inside
+                        candidates.append((rel_path + '/', owner, False))
+                    elif rel_path in tracked_dirs:
+                        # Walked without asking git, its files are checked
+                        next_level.append((rel_path, None))
+                    else:
+                        candidates.append((rel_path + '/', owner or rel_path + '/', True))
+
+            ignored = set()
+            for start in range(0, len(candidates), CHECK_IGNORE_CHUNK):
+                chunk = [path for path, _, _ in candidates[start:start + CHECK_IGNORE_CHUNK]]
+                ignored.update(self.repo.ignored(*chunk))
+            for path, owner, walk in candidates:
+                if path in ignored:
+                    continue
+                if walk:
+                    next_level.append((path[:-1], owner))
+                else:
+                    untracked.add(owner or path)
+            level = next_level
+        return untracked
+
+    def _tracked(self, paths):
+        # Read from the index file, without running git
+        return {path for path, _ in self.repo.index.entries}.intersection(paths)
+
+    def _index_mtime(self, index):
+        try:
+            st = os.stat(index.path)
+            return (int(st.st_mtime), st.st_mtime_ns % 1000000000)
+        except FileNotFoundError:
+            return (0, 0)
+
+    def _has_attributes(self, entries):
+        """Whether attributes or settings may convert files on the way to the index."""
+        if any(path == '.gitattributes' or path.endswith('/.gitattributes') for path in entries):
+            return True
+        if os.path.exists(os.path.join(self.repo.git_dir, 'info', 'attributes')):
+            return True
+        config = self.repo.config_reader()
+        return any(config.has_option('core', option)
+                   and config.get_value('core', option) not in (False, 'false')
+                   for option in ('autocrlf', 'attributesfile'))
+
+    # Operations
+
+    def status(self):
+        """Get the changed files, like ``git status --porcelain``.
+
+        Returns:
+            list: ``{'status': ..., 'filename': ...}`` dicts sorted by file name,
+            where status is the stripped two letter porcelain code.
+        """
+        with self.lock:
+            index = self.repo.index
+            entries = {}
+            for (path, stage), entry in index.entries.items():
+                if stage or entry.flags & CE_EXTENDED:
+                    # Conflicts, intent-to-add and skip-worktree entries
+                    return self._cli_status()
+                entries[path] = entry
+            if self._has_attributes(entries):
+                # Filters and line ending conversion change what is compared
+                return self._cli_status()
+            head_blobs = self._head_blobs()
+            index_mtime = self._index_mtime(index)
+
+            changes = {}
+            for path, entry in entries.items():
+                head = head_blobs.get(path)
+                if head is None:
+                    staged = 'A'
+                elif head != (entry.binsha, entry.mode):
+                    staged = 'M'
+                else:
+                    staged = ' '
+                if entry.flags & CE_VALID:
+                    # Assume-unchanged: git does not look at the file
+                    worktree = ' '
+                else:
+                    worktree = self._worktree_changed(entry, os.path.join(self.path, path), index_mtime) or ' '
+                if staged != ' ' or worktree != ' ':
+                    changes[path] = staged + worktree
+            for path in head_blobs:
+                if path not in entries:
+                    changes[path] = 'D '
+            if 'D ' in changes.values() and any(code[0] == 'A' for code in changes.values()):
+                # A staged deletion and addition may be a rename
+                return self._cli_status()
+            for path in self._untracked(entries):
+                changes[path] = '??'
+
+            return [{'status': code.strip(), 'filename': path} for path, code in sorted(changes.items())]
+
+    # History
+
+    def _reset_log(self, head):
+        """Restart the cached history walk at a new HEAD.
+
+        Records are keyed by a sequence number that grows towards older
+        commits; commits added on top of the cached HEAD get smaller numbers,
+        so both ends of the cache grow without renumbering.
+        """
+        self._log_head = head.binsha if head is not None else None
+        self._log_records = {}
+        self._log_seq = {}
+        self._log_first = 0
+        self._log_end = 0
+        self._log_queue = [(-head.committed_date, head.hexsha, head)] if head is not None else []
+        self._log_seen = {head.binsha} if head is not None else set()
+
+    def _parse_commit(self, commit, queue, seen):
+        """Turn a commit into a log record and queue its parents."""
+        parents = commit.parents
+        for parent in parents:
+            if parent.binsha not in seen:
+                seen.add(parent.binsha)
+                heapq.heappush(queue, (-parent.committed_date, parent.hexsha, parent))
+        return {
+            'id': commit.hexsha,
+            'tree': commit.tree.binsha,
+            'parent_tree': parents[0].tree.binsha if parents else None,
+            'commit': _format_commit(commit.hexsha, commit.author.name,
+                                     commit.authored_datetime.strftime('%Y-%m-%d %H:%M:%S %z'),
+                                     commit.summary)
+        }
+
+    def _sync_log(self):
+        """Bring the history cache up to date with HEAD.
+
+        When HEAD moved forward, only the new commits are parsed and put in
+        front of the cache. Any other change (reset, amend, rebase, a merge of
+        older history) restarts the walk.
+        """
+        head = self._head_commit()
+        head_sha = head.binsha if head is not None else None
+        if head_sha == self._log_head:
+            return
+        if head is None or self._log_head is None:
+            self._reset_log(head)
+            return
+
+        queue = [(-head.committed_date, head.hexsha, head)]
+        seen = {head.binsha}
+        new_records = []
+        while queue:
+            _, hexsha, commit = heapq.heappop(queue)
+            if commit.binsha == self._log_head and not queue:
+                break
+            if hexsha in self._log_seq or len(new_records) >= LOG_MAX_FAST_FORWARD:
+                self._reset_log(head)
+                return
+            new_records.append(self._parse_commit(commit, queue, seen))
+        else:
+            self._reset_log(head)
+            return
+
+        for record in reversed(new_records):
+            self._log_first -= 1
+            self._log_records[self._log_first] = record
+            self._log_seq[record['id']] = self._log_first
+        self._log_seen.update(seen)
+        self._log_head = head_sha
+
+    def _log_record(self, seq):
+        """Get the record at a position of the history, parsing up to it."""
+        while seq >= self._log_end and self._log_queue:
+            _, _, commit = heapq.heappop(self._log_queue)
+            record = self._parse_commit(commit, self._log_queue, self._log_seen)
+            self._log_records[self._log_end] = record
+            self._log_seq[record['id']] = self._log_end
+            self._log_end += 1
+        return self._log_records.get(seq)
+
+    def _path_sha(self, tree_binsha, parts):
+        """Get the object id at a path of a tree, memoized per subtree."""
+        if tree_binsha is None:
+            return None
+        key = (tree_binsha, parts)
+        if key in self._path_memo:
+            return self._path_memo[key]
+        try:
+            item = Tree(self.repo, tree_binsha, path='') / parts[0]
+        except KeyError:
+            sha = None
+        else:
+            if len(parts) == 1:
+                sha = item.binsha
+            elif item.type == 'tree':
+                sha = self._path_sha(item.binsha, parts[1:])
+            else:
+                sha = None
+        if len(self._path_memo) >= PATH_MEMO_SIZE:
+            self._path_memo.clear()
+        self._path_memo[key] = sha
+        return sha
+
+    def _touches(self, record, parts):
+        return self._path_sha(record['tree'], parts) != self._path_sha(record['parent_tree'], parts)
+
+    def log(self, after=None, limit=None, path=None):
+        """Get a page of the history of HEAD, newest commit first.
+
+        Parsed commits are cached per repository, so paging through the
+        history or polling an unchanged HEAD does not read commits again.
+
+        Args:
+            after (str, optional): Return the commits following this commit.
+            limit (int, optional): Maximum number of commits to return.
+            path (str, optional): Only return commits changing this file or directory.
+
+        Returns:
+            tuple: The ``{'hash', 'author', 'date', 'message'}`` dicts and the
+            cursor of the next page, or None on the last page.
+
+        Raises:
+            ValueError: If ``after`` is not a commit of the history.
+        """
+        parts = tuple(part for part in path.strip('/').split('/') if part) if path else None
+        with self.lock:
+            self._sync_log()
+            seq = self._log_first
+            if after:
+                try:
+                    after_sha = self.repo.rev_parse(after).hexsha
+                except Exception:
+                    raise ValueError(f'Unknown commit: {after}')
+                # Parse the history up to the cursor if it is not cached yet
+                while after_sha not in self._log_seq and self._log_record(self._log_end) is not None:
+                    pass
+                if after_sha not in self._log_seq:
+                    raise ValueError(f'Commit {after} is not in the history of HEAD')
+                seq = self._log_seq[after_sha] + 1
+
+            commits = []
+            last = None
+            record = self._log_record(seq)
+            while record is not None:
+                if parts is None or self._touches(record, parts):
+                    if limit is not None and len(commits) >= limit:
+                        return commits, last
+                    commits.append(record['commit'])
+                    last = record['id']
+                seq += 1
+                record = self._log_record(seq)
+            return commits, None
+
+
+class CliGitEngine(_Engine):
+    """Git operations on one repository through the ``git`` command line."""
+
+    def status(self):
+        with self.lock:
+            return self._cli_status()
+
+    def log(self, after=None, limit=None, path=None):
+        args = ['git', 'log', '--date=iso', '--format=%H%x1f%an%x1f%ad%x1f%s']
+        if path:
+            args.extend(['--', path])
+        commits = []
+        last = None
+        found = not after
+        with self.lock:
+            head = subprocess.run(['git', 'rev-parse', '--verify', '-q', 'HEAD'], cwd=self.path,
+                                  capture_output=True)
+            if head.returncode != 0:
+                # An empty repository has no HEAD yet
+                return [], None
+            if after:
+                try:
+                    after = self._run('rev-parse', '--verify', f'{after}^{{commit}}').strip()
+                except GitError:
+                    raise ValueError(f'Unknown commit: {after}')
+            # Stream the log and stop reading once the page is complete
+            process = subprocess.Popen(args, cwd=self.path, stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL, text=True)
+            try:
+                for line in process.stdout:
+                    hexsha, author, date, message = line.rstrip('\n').split('\x1f', 3)
+                    if not found:
+                        found = hexsha == after
+                        continue
+                    if limit is not None and len(commits) >= limit:
+                        return commits, last
+                    commits.append(_format_commit(hexsha, author, date, message))
+                    last = hexsha
+            finally:
+                process.kill()
+                process.wait()
+                process.stdout.close()
+        if not found:
+            raise ValueError(f'Commit {after} is not in the history of HEAD')
+        return commits, None
+
+
+def get_engine(path):
+    """Get the engine of a repository, opening it on first use.
+
+    Engines are kept per process, since the persistent git processes of a
+    repository handle cannot be shared with forked workers.
+
+    Args:
+        path (str): The working tree of the repository.
+
+    Returns:
+        GitEngine or CliGitEngine: The engine.
+    """
+    key = (os.getpid(), os.path.abspath(path))
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine_cls = GitEngine if load_gitpython() else CliGitEngine
+            engine = engine_cls(path)
+            _engines[key] = engine
+        return engine
+
+
+def close_engines():
+    """Close the engines of the current process."""
+    with _engines_lock:
+        engines = [engine for (pid, _), engine in _engines.items() if pid == os.getpid()]
+        _engines.clear()
+    for engine in engines:
+        engine.close()
+
+
+def invalidate_status(path):
+    """Drop the cached status of the repository containing a path.
+
+    Args:
+        path (str): A path inside the working tree that was written to.
+    """
+    path = os.path.abspath(path)
+    with _engines_lock:
+        engines = [engine for (pid, engine_path), engine in _engines.items()
+                   if pid == os.getpid() and (path == engine_path or path.startswith(engine_path + os.sep))]
+    for engine in engines:
+        engine.invalidate_status()
+
+
+def get_engine_stats():
+    """Get the status cache counters of the engines of the current process."""
+    with _engines_lock:
+        engines = [engine for (pid, _), engine in _engines.items() if pid == os.getpid()]
+    return [engine.stats() for engine in engines]
+
+
+register_metrics_provider('git', get_engine_stats)
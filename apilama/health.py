@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Backend Health
+
+This module tracks the availability of the backend services APILama proxies to.
+
+Each backend gets a monitor that probes its health endpoint from a background
+thread and caches the result, so neither startup nor request handling ever
+waits on a probe. The monitor also acts as a circuit breaker fed by the
+outcome of every proxied request:
+
+    closed     requests flow; consecutive failures open the circuit
+    open       requests are rejected until the recovery timeout elapses
+    half_open  a single trial request (or probe) decides whether to close
+               the circuit again or to re-open it
+
+Nothing heard of a backend, neither a probe result nor the outcome of a
+request, for longer than the TTL makes its state unknown: the monitor no
+longer trusts the cached state and turns half-open.
+"""
+
+import os
+import threading
+import time
+
+from apilama.logger import logger
+from apilama.metrics import register_metrics_provider
+from apilama.upstream import get_backend_setting
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Default settings, used when no environment variable overrides them
+DEFAULT_INTERVAL = 10.0
+DEFAULT_TTL = 30.0
+DEFAULT_PROBE_TIMEOUT = 2.0
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RECOVERY_TIMEOUT = 15.0
+
+# Upstream status codes that count as a backend failure
+FAILURE_STATUS_CODES = (502, 503, 504)
+
+
+class BackendHealthMonitor:
+    """Cached health state and circuit breaker for a single backend."""
+
+    def __init__(self, name, client, path='/health', interval=None, ttl=None, probe_timeout=None,
+                 failure_threshold=None, recovery_timeout=None):
+        """Create a monitor for a backend.
+
+        Args:
+            name (str): The name of the backend, e.g. 'shellama'.
+            client (UpstreamClient): The client used for probes. The monitor
+                registers itself on the client to see every request outcome.
+            path (str, optional): The health endpoint of the backend.
+            interval (float, optional): Seconds between two probes.
+            ttl (float, optional): Seconds after which a probe result is stale.
+            probe_timeout (float, optional): Read timeout of a probe in seconds.
+            failure_threshold (int, optional): Consecutive failures opening the circuit.
+            recovery_timeout (float, optional): Seconds the circuit stays open
+                before a trial request is allowed.
+        """
+        def setting(value, key, default):
+            if value is not None:
+                return value
+            return get_backend_setting(name, key, default, prefix='APILAMA_HEALTH')
+
+        self.name = name
+        self.client = client
+        self.path = path
+        self.interval = setting(interval, 'INTERVAL', DEFAULT_INTERVAL)
+        self.ttl = setting(ttl, 'TTL', DEFAULT_TTL)
+        self.probe_timeout = setting(probe_timeout, 'PROBE_TIMEOUT', DEFAULT_PROBE_TIMEOUT)
+        self.failure_threshold = setting(failure_threshold, 'FAILURE_THRESHOLD', DEFAULT_FAILURE_THRESHOLD)
+        self.recovery_timeout = setting(recovery_timeout, 'RECOVERY_TIMEOUT', DEFAULT_RECOVERY_TIMEOUT)
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = None
+        self._trial_started_at = None
+        self._consecutive_failures = 0
+        self._checked_at = None
+        self._heard_at = None
+        self._healthy = None
+        self._details = None
+        self._last_error = None
+
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+
+        client.health = self
+
+    # Background probing
+
+    def start(self):
+        """Start the background probe thread if it is not running.
+
+        Safe to call repeatedly and after a fork: a child process starts its
+        own thread, since threads do not survive ``fork()``.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f'apilama-health-{self.name}', daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background probe thread."""
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.probe()
+            self._stop.wait(self.interval)
+
+    def probe(self):
+        """Probe the health endpoint of the backend and cache the result.
+
+        Returns:
+            bool: Whether the backend answered the probe successfully.
+        """
+        try:
+            response = self.client.get(self.path, timeout=self.probe_timeout)
+        except Exception as e:
+            self._set_probe_result(False, None, f"Error connecting to {self.name} service: {str(e)}")
+            return False
+
+        if response.status_code == 200:
+            try:
+                details = response.json()
+            except ValueError:
+                details = None
+            self._set_probe_result(True, details, None)
+            return True
+
+        self._set_probe_result(False, None, f"{self.name} service returned status code {response.status_code}")
+        return False
+
+    def _set_probe_result(self, healthy, details, error):
+        with self._lock:
+            was_healthy = self._healthy
+            self._checked_at = time.time()
+            self._heard_at = self._checked_at
+            self._healthy = healthy
+            self._details = details
+            self._last_error = error
+        if healthy != was_healthy:
+            if healthy:
+                logger.info('%s service is available', self.name)
+            else:
+                logger.error(error)
+
+    # Circuit breaker
+
+    def record_response(self, status_code):
+        """Record the outcome of a request that got a response."""
+        if status_code in FAILURE_STATUS_CODES:
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def record_success(self):
+        """Record a successful request; closes the circuit."""
+        with self._lock:
+            self._heard_at = time.time()
+            self._consecutive_failures = 0
+            if self._state != CLOSED:
+                logger.info('Circuit for %s service closed', self.name)
+            self._state = CLOSED
+            self._opened_at = None
+            self._trial_started_at = None
+
+    def record_failure(self):
+        """Record a failed request; may open the circuit."""
+        with self._lock:
+            self._heard_at = time.time()
+            self._consecutive_failures += 1
+            if self._state == HALF_OPEN or (
+                    self._state == CLOSED and self._consecutive_failures >= self.failure_threshold):
+                if self._state != OPEN:
+                    logger.error('Circuit for %s service opened after %s consecutive failures',
+                                 self.name, self._consecutive_failures)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_started_at = None
+
+    def _is_stale(self):
+        """Check whether the cached state is older than the TTL; call with the lock held."""
+        return self._heard_at is not None and time.time() - self._heard_at > self.ttl
+
+    def allow_request(self):
+        """Check whether a request may be sent to the backend.
+
+        Returns:
+            bool: False while the circuit is open, or while a half-open trial
+            request is already in flight.
+        """
+        self.start()
+        now = time.monotonic()
+        with self._lock:
+            if self._state != HALF_OPEN and self._is_stale():
+                # The cached state is unknown by now, let a trial request find out
+                logger.warning('State of %s service is stale, circuit half-open', self.name)
+                self._state = HALF_OPEN
+                self._opened_at = None
+                self._trial_started_at = None
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if now - self._opened_at < self.recovery_timeout:
+                    return False
+                self._state = HALF_OPEN
+                self._trial_started_at = None
+            # Half-open: let one trial through; if it never reports back, allow
+            # another one after the recovery timeout
+            if self._trial_started_at is None or now - self._trial_started_at >= self.recovery_timeout:
+                self._trial_started_at = now
+                return True
+            return False
+
+    def is_available(self):
+        """Check whether the backend is considered available.
+
+        Returns:
+            bool: True unless the circuit is open or the last probe failed,
+            or if that state is stale and a trial request may find out.
+        """
+        self.start()
+        with self._lock:
+            return self._is_stale() or (self._state != OPEN and self._healthy is not False)
+
+    def status(self):
+        """Get the cached health state of the backend.
+
+        Returns:
+            dict: The circuit state, last probe result and its age.
+        """
+        self.start()
+        with self._lock:
+            age = time.time() - self._checked_at if self._checked_at is not None else None
+            return {
+                'available': self._is_stale() or (self._state != OPEN and self._healthy is not False),
+                'circuit': self._state,
+                'consecutive_failures': self._consecutive_failures,
+                'healthy': self._healthy,
+                'checked_at': self._checked_at,
+                'stale': age is None or age > self.ttl,
+                'details': self._details,
+                'error': self._last_error
+            }
+
+
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+
+def get_monitor(name, client=None, path='/health'):
+    """Get the health monitor for a backend, creating it on first use.
+
+    Args:
+        name (str): The name of the backend, e.g. 'shellama'.
+        client (UpstreamClient, optional): The client of the backend. Required
+            the first time the monitor is requested.
+        path (str, optional): The health endpoint of the backend.
+
+    Returns:
+        BackendHealthMonitor: The monitor of the backend.
+    """
+    with _monitors_lock:
+        monitor = _monitors.get(name)
+        if monitor is None:
+            if client is None:
+                raise ValueError(f'No health monitor registered for backend {name}')
+            monitor = BackendHealthMonitor(name, client, path)
+            _monitors[name] = monitor
+        return monitor
+
+
+def start_monitors():
+    """Start the background probes of all registered monitors."""
+    with _monitors_lock:
+        monitors = list(_monitors.values())
+    for monitor in monitors:
+        monitor.start()
+
+
+def get_health_stats():
+    """Get the health state of all monitored backends.
+
+    Returns:
+        dict: The state of each backend, keyed by backend name.
+    """
+    with _monitors_lock:
+        monitors = dict(_monitors)
+    return {name: monitor.status() for name, monitor in monitors.items()}
+
+
+register_metrics_provider('health', get_health_stats)
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Jobs
+
+This module provides a background job manager for long-running shell
+commands.
+
+Submitting a job returns at once; a bounded pool of worker threads runs the
+jobs with a concurrency limit per tenant, so one client cannot occupy every
+worker. The output of each job is kept in a bounded buffer of numbered chunks
+that clients can poll from any position or follow while the job runs.
+"""
+
+import codecs
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+
+from apilama.logger import logger
+from apilama.metrics import register_metrics_provider
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMED_OUT = 'timed_out'
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED, TIMED_OUT)
+
+# Default settings, used when no environment variable overrides them
+DEFAULT_WORKERS = 4
+DEFAULT_PER_TENANT = 2
+DEFAULT_MAX_QUEUED = 20
+DEFAULT_OUTPUT_LIMIT = 1024 * 1024
+DEFAULT_TIMEOUT = 3600.0
+DEFAULT_RETENTION = 3600.0
+
+# Seconds a cancelled process gets to exit after SIGTERM before SIGKILL
+KILL_GRACE = 5.0
+
+READ_SIZE = 4096
+
+
+class JobLimitError(Exception):
+    """A tenant has too many queued jobs."""
+
+
+class Job:
+    """A shell command run in the background, with its bounded output."""
+
+    def __init__(self, tenant, command, cwd=None, shell=False, timeout=None, output_limit=None):
+        self.id = uuid.uuid4().hex
+        self.tenant = tenant
+        self.command = command
+        self.cwd = cwd
+        self.shell = shell
+        self.timeout = timeout
+        self.output_limit = output_limit or DEFAULT_OUTPUT_LIMIT
+
+        self.state = QUEUED
+        self.exit_code = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self._cond = threading.Condition()
+        self._output = deque()  # (seq, stream, text)
+        self._output_size = 0
+        self._next_seq = 0
+        self._cancel = threading.Event()
+        self.process = None
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def append_output(self, stream, text):
+        """Add a chunk of output, dropping the oldest chunks beyond the limit.
+
+        Args:
+            stream (str): 'stdout' or 'stderr'.
+            text (str): The output.
+        """
+        if not text:
+            return
+        with self._cond:
+            self._output.append((self._next_seq, stream, text))
+            self._next_seq += 1
+            self._output_size += len(text)
+            while self._output_size > self.output_limit and len(self._output) > 1:
+                self._output_size -= len(self._output.popleft()[2])
+            self._cond.notify_all()
+
+    def read_output(self, since=0, wait=None):
+        """Read the output chunks from a position on.
+
+        Args:
+            since (int, optional): The first chunk to return.
+            wait (float, optional): Seconds to wait for new output if there
+                is none yet and the job is still running.
+
+        Returns:
+            tuple: The ``{'seq', 'stream', 'data'}`` chunks, the position to
+            read from next, and whether chunks before it were dropped.
+        """
+        with self._cond:
+            if wait and since >= self._next_seq and not self.finished:
+                self._cond.wait(wait)
+            first = self._output[0][0] if self._output else self._next_seq
+            chunks = [{'seq': seq, 'stream': stream, 'data': text}
+                      for seq, stream, text in self._output if seq >= since]
+            return chunks, self._next_seq, since < first
+
+    def finish(self, state, exit_code=None, error=None):
+        with self._cond:
+            if self.finished:
+                return
+            self.state = state
+            self.exit_code = exit_code
+            self.error = error
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def cancel(self):
+        """Request the job to stop; a queued job never starts."""
+        self._cancel.set()
+        with self._cond:
+            if self.state == QUEUED:
+                self.finish(CANCELLED)
+        process = self.process
+        if process is not None and process.poll() is None:
+            _signal_group(process, signal.SIGTERM)
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def to_dict(self):
+        """Get the state of the job."""
+        with self._cond:
+            return {
+                'id': self.id,
+                'command': self.command,
+                'state': self.state,
+                'cancel_requested': self.cancel_requested,
+                'exit_code': self.exit_code,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'output_next': self._next_seq
+            }
+
+
+def _signal_group(process, signum):
+    try:
+        os.killpg(process.pid, signum)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _pump(job, pipe, stream):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for data in iter(lambda: pipe.read1(READ_SIZE), b''):
+        job.append_output(stream, decoder.decode(data))
+    job.append_output(stream, decoder.decode(b'', final=True))
+    pipe.close()
+
+
+def run_local(job):
+    """Run a job as a local process, streaming its output into the job.
+
+    The process gets its own session, so cancelling or timing out stops the
+    whole process group, including children started by a shell.
+    """
+    args = job.command
+    if not job.shell and isinstance(args, str):
+        args = shlex.split(args)
+    process = subprocess.Popen(args, cwd=job.cwd, shell=job.shell, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    job.process = process
+    if job.cancel_requested:
+        _signal_group(process, signal.SIGTERM)
+
+    pumps = [threading.Thread(target=_pump, args=(job, process.stdout, 'stdout'), daemon=True),
+             threading.Thread(target=_pump, args=(job, process.stderr, 'stderr'), daemon=True)]
+    for pump in pumps:
+        pump.start()
+
+    deadline = time.monotonic() + job.timeout if job.timeout else None
+    stopped = None
+    kill_at = None
+    while process.poll() is None:
+        now = time.monotonic()
+        if stopped is None:
+            if job.cancel_requested:
+                stopped = CANCELLED
+            elif deadline is not None and now >= deadline:
+                stopped = TIMED_OUT
+            if stopped is not None:
+                _signal_group(process, signal.SIGTERM)
+                kill_at = now + KILL_GRACE
+        elif now >= kill_at:
+            _signal_group(process, signal.SIGKILL)
+        try:
+            process.wait(0.1)
+        except subprocess.TimeoutExpired:
+            pass
+
+    if stopped is None and job.cancel_requested:
+        # Cancelled between two checks
+        stopped = CANCELLED
+    if stopped is not None:
+        # Children left behind would keep the pipes open
+        _signal_group(process, signal.SIGKILL)
+    for pump in pumps:
+        pump.join()
+
+    if stopped == TIMED_OUT:
+        job.finish(TIMED_OUT, process.returncode, f'Timed out after {job.timeout} seconds')
+    elif stopped == CANCELLED:
+        job.finish(CANCELLED, process.returncode)
+    else:
+        job.finish(SUCCEEDED if process.returncode == 0 else FAILED, process.returncode)
+
+
+class JobManager:
+    """Worker pool running jobs with per-tenant concurrency limits."""
+
+    def __init__(self, runner=run_local, workers=None, per_tenant=None, max_queued=None,
+                 retention=None):
+        """Create the manager.
+
+        Args:
+            runner (callable, optional): Runs a job to completion; it must
+                call ``job.finish()`` and honour ``job.cancel_requested``.
+            workers (int, optional): Jobs running at the same time.
+            per_tenant (int, optional): Jobs of one tenant running at the same time.
+            max_queued (int, optional): Unfinished jobs a tenant may have.
+            retention (float, optional): Seconds finished jobs are kept.
+        """
+        self.runner = runner
+        self.workers = workers or int(os.environ.get('APILAMA_JOBS_WORKERS', DEFAULT_WORKERS))
+        self.per_tenant = per_tenant or int(os.environ.get('APILAMA_JOBS_PER_TENANT', DEFAULT_PER_TENANT))
+        self.max_queued = max_queued or int(os.environ.get('APILAMA_JOBS_MAX_QUEUED', DEFAULT_MAX_QUEUED))
+        self.retention = retention if retention is not None else float(
+            os.environ.get('APILAMA_JOBS_RETENTION', DEFAULT_RETENTION))
+        self.output_limit = int(os.environ.get('APILAMA_JOBS_OUTPUT_LIMIT', DEFAULT_OUTPUT_LIMIT))
+        self.default_timeout = float(os.environ.get('APILAMA_JOBS_TIMEOUT', DEFAULT_TIMEOUT))
+
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._queue = deque()
+        self._running = {}  # tenant -> running jobs
+        self._threads = []
+        self._threads_pid = None
+
+    def _start(self):
+        # Threads do not survive fork(), a child process starts its own
+        if self._threads_pid == os.getpid():
+            return
+        self._threads = [threading.Thread(target=self._work, name=f'apilama-job-{i}', daemon=True)
+                         for i in range(self.workers)]
+        self._threads_pid = os.getpid()
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, tenant, command, cwd=None, shell=False, timeout=None):
+        """Queue a job.
+
+        Args:
+            tenant (str): The tenant owning the job.
+            command (str or list): The command to run.
+            cwd (str, optional): The working directory.
+            shell (bool, optional): Run the command through the shell.
+            timeout (float, optional): Seconds after which the job is stopped.
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            JobLimitError: If the tenant has too many unfinished jobs.
+        """
+        job = Job(tenant, command, cwd, shell, timeout or self.default_timeout, self.output_limit)
+        with self._cond:
+            self._expire()
+            unfinished = sum(1 for j in self._jobs.values() if j.tenant == tenant and not j.finished)
+            if unfinished >= self.max_queued:
+                raise JobLimitError(f'Too many unfinished jobs (limit {self.max_queued})')
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._start()
+            self._cond.notify_all()
+        logger.info('Queued job %s for tenant %s: %s', job.id, tenant, command)
+        return job
+
+    def _next_job(self):
+        """Take the oldest queued job whose tenant is below its limit."""
+        for job in self._queue:
+            if job.finished:
+                continue
+            if self._running.get(job.tenant, 0) < self.per_tenant:
+                self._queue.remove(job)
+                return job
+        # Drop cancelled jobs from the queue
+        self._queue = deque(job for job in self._queue if not job.finished)
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                self._running[job.tenant] = self._running.get(job.tenant, 0) + 1
+                job.state = RUNNING
+                job.started_at = time.time()
+            try:
+                self.runner(job)
+            except Exception as e:
+                logger.error('Job %s failed to run: %s', job.id, e)
+                job.finish(FAILED, error=str(e))
+            finally:
+                with self._cond:
+                    self._running[job.tenant] -= 1
+                    if not self._running[job.tenant]:
+                        del self._running[job.tenant]
+                    self._cond.notify_all()
+
+    def _expire(self):
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id, tenant):
+        """Get a job of a tenant.
+
+        Returns:
+            Job or None: The job, or None if it does not exist or belongs to
+            another tenant.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.tenant == tenant else None
+
+    def list(self, tenant):
+        """Get the jobs of a tenant, newest first."""
+        with self._cond:
+            self._expire()
+            jobs = [job for job in self._jobs.values() if job.tenant == tenant]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def stats(self):
+        """Get the pool occupancy."""
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'per_tenant': self.per_tenant,
+                'running': sum(self._running.values()),
+                'queued': sum(1 for job in self._queue if not job.finished),
+                'jobs': len(self._jobs),
+                'running_by_tenant': dict(self._running)
+            }
+
+
+_managers = {}
+
+
+def get_job_manager(name='shellama', runner=run_local):
+    """Get a named job manager, creating it on first use.
+
+    Args:
+        name (str, optional): The name of the manager.
+        runner (callable, optional): The runner used when the manager is created.
+
+    Returns:
+        JobManager: The manager.
+    """
+    manager = _managers.get(name)
+    if manager is None:
+        manager = _managers.setdefault(name, JobManager(runner))
+    return manager
+
+
+def get_jobs_stats():
+    """Get the occupancy of all job managers."""
+    return {name: manager.stats() for name, manager in _managers.items()}
+
+
+register_metrics_provider('jobs', get_jobs_stats)
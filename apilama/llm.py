@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Text Generation
+
+This module provides the client for the text generation backend behind the
+PyLLM routes.
+
+The backend is any server speaking the OpenAI compatible ``/v1/completions``
+API (Ollama, vLLM, llama.cpp, ...), configured through ``GETLLM_API_URL``.
+Without it the routes answer with placeholder text, as they always did.
+
+Streamed completions are relayed token by token: the upstream body is only
+read when the client is ready for the next token, and closing the stream
+closes the upstream connection, which stops the generation.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from apilama.batching import MicroBatcher
+from apilama.cache import LRUCache, SingleFlight
+from apilama.logger import logger
+from apilama.metrics import register_metrics_provider
+from apilama.upstream import get_client
+
+DEFAULT_MODEL = 'default'
+DEFAULT_MAX_TOKENS = 100
+DEFAULT_TEMPERATURE = 0.7
+
+# Generation cache defaults
+DEFAULT_CACHE_ENTRIES = 1024
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+DEFAULT_CACHE_TTL = 300.0
+
+# Micro-batching defaults: off (one prompt per upstream call). Batches send
+# a list of prompts, which not every backend accepts (Ollama does not)
+DEFAULT_BATCH_MAX_SIZE = 1
+DEFAULT_BATCH_MAX_WAIT_MS = 5.0
+
+# Read timeout for completions: the time to the whole answer, or between two
+# streamed tokens
+DEFAULT_GENERATE_TIMEOUT = 120.0
+
+
+class LLMError(Exception):
+    """The generation backend failed."""
+
+
+def parse_generate_request(data):
+    """Read the generation parameters of a request.
+
+    The parameters are read from the request body, or from its ``options``
+    object.
+
+    Args:
+        data (dict): The JSON body of the request.
+
+    Returns:
+        dict: ``prompt``, ``system_prompt``, ``model``, ``max_tokens`` and
+        ``temperature``.
+
+    Raises:
+        ValueError: If a parameter has an invalid value.
+    """
+    options = data.get('options') or {}
+
+    def option(key, default):
+        return data.get(key, options.get(key, default))
+
+    try:
+        return {
+            'prompt': str(data['prompt']),
+            'system_prompt': option('system_prompt', None),
+            'model': str(option('model', DEFAULT_MODEL)),
+            'max_tokens': int(option('max_tokens', DEFAULT_MAX_TOKENS)),
+            'temperature': float(option('temperature', DEFAULT_TEMPERATURE))
+        }
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid generation parameter: {str(e)}')
+
+
+def cache_key(params):
+    """Build the cache key of a generation request.
+
+    Requests differing only in the way their parameters were given (top
+    level or ``options``, ``0`` or ``0.0``) get the same key.
+
+    Args:
+        params (dict): The parameters from ``parse_generate_request()``.
+
+    Returns:
+        str: The key.
+    """
+    normalized = {
+        'model': params['model'],
+        'prompt': params['prompt'],
+        'system_prompt': params.get('system_prompt') or '',
+        'max_tokens': params['max_tokens'],
+        'temperature': params['temperature']
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _placeholder_text(prompt):
+    return f'Generated text based on: {prompt[:50]}...' if len(prompt) > 50 else f'Generated text based on: {prompt}'
+
+
+def _full_prompt(params):
+    if params.get('system_prompt'):
+        return f"{params['system_prompt']}\n\n{params['prompt']}"
+    return params['prompt']
+
+
+def _estimate_tokens(prompt, text):
+    return len(prompt.split()) + len(text.split())
+
+
+class LLMBackend:
+    """Client for the completions API of the generation backend."""
+
+    def __init__(self, client=None, timeout=None, cache=None, batch_max_size=None, batch_max_wait=None):
+        """Create the backend client.
+
+        Args:
+            client (UpstreamClient, optional): The client of the backend.
+                Defaults to the shared client for ``GETLLM_API_URL``; without
+                one placeholder text is returned.
+            timeout (float, optional): Read timeout of a completion in seconds.
+            cache (LRUCache, optional): The cache of generated completions.
+                Defaults to a cache sized by the ``GETLLM_CACHE_*`` variables.
+            batch_max_size (int, optional): Maximum number of prompts sent in
+                one upstream call; 1, the default, disables batching. Needs a
+                backend accepting a list of prompts.
+            batch_max_wait (float, optional): Maximum seconds a prompt waits
+                for others to join its batch.
+        """
+        if client is None and os.environ.get('GETLLM_API_URL'):
+            client = get_client('getllm', os.environ['GETLLM_API_URL'])
+        self.client = client
+        self.base_url = client.base_url if client is not None else None
+        self.timeout = timeout if timeout is not None else float(
+            os.environ.get('GETLLM_GENERATE_TIMEOUT', DEFAULT_GENERATE_TIMEOUT))
+        self.cache = cache if cache is not None else LRUCache(
+            int(os.environ.get('GETLLM_CACHE_ENTRIES', DEFAULT_CACHE_ENTRIES)),
+            int(os.environ.get('GETLLM_CACHE_BYTES', DEFAULT_CACHE_BYTES)),
+            float(os.environ.get('GETLLM_CACHE_TTL', DEFAULT_CACHE_TTL)))
+        self._flight = SingleFlight()
+        self.batcher = MicroBatcher(
+            self._complete_batch,
+            batch_max_size or int(os.environ.get('GETLLM_BATCH_MAX_SIZE', DEFAULT_BATCH_MAX_SIZE)),
+            batch_max_wait if batch_max_wait is not None else float(
+                os.environ.get('GETLLM_BATCH_MAX_WAIT_MS', DEFAULT_BATCH_MAX_WAIT_MS)) / 1000)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.streams = 0
+        self.streams_completed = 0
+        self.streams_failed = 0
+        self.streams_disconnected = 0
+        self.errors = 0
+        self._ttft_count = 0
+        self._ttft_total = 0.0
+        self.last_ttft = None
+
+    @property
+    def configured(self):
+        return self.client is not None
+
+    def _payload(self, params, stream, prompts=None):
+        return {
+            'model': params['model'],
+            'prompt': prompts if prompts is not None else _full_prompt(params),
+            'max_tokens': params['max_tokens'],
+            'temperature': params['temperature'],
+            'stream': stream
+        }
+
+    def _post(self, payload, stream):
+        try:
+            response = self.client.post('/v1/completions', json=payload, timeout=self.timeout, stream=stream)
+        except Exception as e:
+            self._count_error()
+            raise LLMError(f'Generation backend is not reachable: {str(e)}')
+        if response.status_code != 200:
+            response.close()
+            self._count_error()
+            raise LLMError(f'Generation backend returned status code {response.status_code}')
+        return response
+
+    def _count_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def generate(self, params, cache=None):
+        """Generate a completion.
+
+        Cacheable requests are answered from the cache, and concurrent
+        identical requests share a single upstream call.
+
+        Args:
+            params (dict): The parameters from ``parse_generate_request()``.
+            cache (bool, optional): Whether to use the cache. Defaults to
+                caching deterministic requests (temperature 0) only.
+
+        Returns:
+            dict: The generated ``text``, the ``model``, ``tokens_used`` and
+            whether the result is ``cached``.
+
+        Raises:
+            LLMError: If the backend failed.
+        """
+        with self._lock:
+            self.requests += 1
+        if not self.use_cache(params, cache):
+            return dict(self._generate(params), cached=False)
+
+        key = cache_key(params)
+        result = self.cache.get(key)
+        if result is not None:
+            return dict(result, cached=True)
+        return dict(self._flight.do(key, self._generate_cached, key, params), cached=False)
+
+    def use_cache(self, params, cache=None):
+        """Check whether a request may be answered from the cache."""
+        return cache if cache is not None else params['temperature'] == 0
+
+    def cached(self, params, cache=None):
+        """Look a request up in the cache without generating anything.
+
+        Returns:
+            dict or None: The cached result, like ``generate()`` returns it.
+        """
+        if not self.use_cache(params, cache):
+            return None
+        result = self.cache.get(cache_key(params))
+        return dict(result, cached=True) if result is not None else None
+
+    def store(self, params, text):
+        """Cache a completion received as a stream.
+
+        Args:
+            params (dict): The parameters of the request.
+            text (str): The complete generated text.
+        """
+        key = cache_key(params)
+        result = {'text': text, 'model': params['model'],
+                  'tokens_used': _estimate_tokens(params['prompt'], text)}
+        self.cache.put(key, result, len(text.encode('utf-8')) + len(key))
+
+    def _generate_cached(self, key, params):
+        result = self._generate(params)
+        self.cache.put(key, result, len(result['text'].encode('utf-8')) + len(key))
+        return result
+
+    def _generate(self, params):
+        if not self.configured:
+            text = _placeholder_text(params['prompt'])
+            return {'text': text, 'model': params['model'],
+                    'tokens_used': len(params['prompt'].split()) + 20}  # Approximate token count
+        if self.batcher.max_size > 1:
+            key = (params['model'], params['max_tokens'], params['temperature'])
+            return self.batcher.submit(key, params)
+        return self._complete_batch(None, [params])[0]
+
+    def _complete_batch(self, key, batch):
+        """Send the prompts of a batch in one completions call.
+
+        Prompts of a batch share the model, ``max_tokens`` and temperature.
+        A single prompt is sent as a string, so backends without batch
+        support keep working when there is nothing to batch.
+
+        Returns:
+            list: The result of each prompt, or an ``LLMError`` for prompts
+            the backend returned no completion for.
+        """
+        prompts = [_full_prompt(params) for params in batch]
+        payload = self._payload(batch[0], False, prompts if len(prompts) > 1 else prompts[0])
+        result = self._post(payload, False).json()
+
+        texts = {}
+        for position, choice in enumerate(result.get('choices') or []):
+            if isinstance(choice, dict) and 'text' in choice:
+                texts[choice.get('index', position)] = choice['text']
+        usage = result.get('usage') or {}
+        results = []
+        for index, params in enumerate(batch):
+            if index not in texts:
+                self._count_error()
+                results.append(LLMError('Generation backend returned no completion'))
+                continue
+            text = texts[index]
+            tokens_used = _estimate_tokens(params['prompt'], text)
+            if len(batch) == 1:
+                tokens_used = usage.get('total_tokens', tokens_used)
+            results.append({'text': text, 'model': result.get('model', params['model']),
+                            'tokens_used': tokens_used})
+        return results
+
+    def stream(self, params):
+        """Start a streamed completion.
+
+        The upstream request is sent before this returns, so a failing
+        backend is reported before the client response starts.
+
+        Args:
+            params (dict): The parameters from ``parse_generate_request()``.
+
+        Returns:
+            generator: Yields the generated text piece by piece. Closing it
+            closes the upstream connection.
+
+        Raises:
+            LLMError: If the backend failed.
+        """
+        with self._lock:
+            self.requests += 1
+        if not self.configured:
+            words = _placeholder_text(params['prompt']).split(' ')
+            return iter([words[0]] + [' ' + word for word in words[1:]])
+        return self._relay(self._post(self._payload(params, True), True))
+
+    def _relay(self, response):
+        try:
+            # chunk_size=None hands over each chunk of a chunked body as it arrives
+            for line in response.iter_lines(chunk_size=None):
+                if not line.startswith(b'data:'):
+                    continue
+                data = line[5:].strip()
+                if data == b'[DONE]':
+                    return
+                try:
+                    text = json.loads(data)['choices'][0].get('text', '')
+                except (ValueError, KeyError, IndexError, TypeError):
+                    logger.warning('Ignoring malformed completion event: %r', data[:100])
+                    continue
+                if text:
+                    yield text
+        finally:
+            response.close()
+
+    def record_stream(self, ttft, completed, failed=False):
+        """Record the outcome of a stream sent to a client.
+
+        Args:
+            ttft (float or None): Seconds from the request to the first token.
+            completed (bool): Whether the client received the whole stream.
+            failed (bool, optional): Whether the backend failed mid-stream.
+        """
+        with self._lock:
+            self.streams += 1
+            if completed:
+                self.streams_completed += 1
+            elif failed:
+                self.streams_failed += 1
+            else:
+                self.streams_disconnected += 1
+            if ttft is not None:
+                self._ttft_count += 1
+                self._ttft_total += ttft
+                self.last_ttft = ttft
+
+    def stats(self):
+        """Get the request counters and the time to first token."""
+        with self._lock:
+            return {
+                'backend': self.base_url,
+                'requests': self.requests,
+                'errors': self.errors,
+                'streams': self.streams,
+                'streams_completed': self.streams_completed,
+                'streams_failed': self.streams_failed,
+                'streams_disconnected': self.streams_disconnected,
+                'ttft_avg_seconds': round(self._ttft_total / self._ttft_count, 4) if self._ttft_count else None,
+                'ttft_last_seconds': round(self.last_ttft, 4) if self.last_ttft is not None else None,
+                'coalesced': self._flight.shared,
+                'cache': self.cache.stats(),
+                'batching': self.batcher.stats()
+            }
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Get the shared generation backend, creating it on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = LLMBackend()
+        return _backend
+
+
+def get_llm_stats():
+    """Get the stats of the generation backend."""
+    return get_backend().stats()
+
+
+register_metrics_provider('getllm', get_llm_stats)
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Logging Pipeline
+
+This module provides an asynchronous logging pipeline that keeps file,
+console and database writes out of the request path.
+
+The handlers of a logger are moved behind a ``QueueHandler``. Logging a
+record only prepares it and appends it to a bounded ring buffer; a
+background writer thread takes the records off the buffer in batches and
+hands every batch to the real handlers. Handlers with an ``emit_batch``
+method write a whole batch at once and flush once per batch.
+
+When the buffer is full the overflow policy decides what happens:
+
+    drop_oldest  the oldest queued record is dropped to make room
+    block        the caller waits up to a timeout for room, then the new
+                 record is dropped
+"""
+
+import atexit
+import collections
+import logging
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from apilama.metrics import register_metrics_provider
+
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+POLICIES = (DROP_OLDEST, BLOCK)
+
+# Default settings, used when no environment variable overrides them
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_BLOCK_TIMEOUT = 1.0
+
+_pipelines = []
+_pipelines_lock = threading.Lock()
+
+
+def _emit_batch(handler, records):
+    """Hand a batch of records to a handler.
+
+    Args:
+        handler (logging.Handler): The handler.
+        records (list): The records, oldest first.
+    """
+    records = [record for record in records if record.levelno >= handler.level and handler.filter(record)]
+    if not records:
+        return
+    emit_batch = getattr(handler, 'emit_batch', None)
+    handler.acquire()
+    try:
+        if emit_batch is not None:
+            emit_batch(records)
+        else:
+            for record in records:
+                handler.emit(record)
+    finally:
+        handler.release()
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    """Stream handler that flushes once per batch of records."""
+
+    def emit_batch(self, records):
+        """Write a batch of records and flush the stream once.
+
+        Args:
+            records (list): The records, oldest first.
+        """
+        for record in records:
+            try:
+                self.stream.write(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        try:
+            self.flush()
+        except Exception:
+            self.handleError(records[-1])
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """Rotating file handler that flushes once per batch of records.
+
+    The stock handler seeks to the end of the file before every record to
+    decide whether to roll over, which also flushes the stream. This handler
+    looks up the file size once per batch and counts from there.
+
+    With ``delay`` the directory of the file is created when it is opened.
+    """
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+    def emit_batch(self, records):
+        """Write a batch of records, rolling the file over where needed.
+
+        Args:
+            records (list): The records, oldest first.
+        """
+        if self.stream is None:
+            self.stream = self._open()
+        size = self.stream.seek(0, 2)
+        for record in records:
+            try:
+                msg = self.format(record) + self.terminator
+                if self.maxBytes > 0 and size > 0 and size + len(msg) >= self.maxBytes:
+                    self.doRollover()
+                    if self.stream is None:
+                        self.stream = self._open()
+                    size = 0
+                self.stream.write(msg)
+                size += len(msg)
+            except Exception:
+                self.handleError(record)
+        try:
+            self.flush()
+        except Exception:
+            self.handleError(records[-1])
+
+
+class QueueHandler(logging.Handler):
+    """Handler that appends records to the ring buffer of a pipeline."""
+
+    def __init__(self, pipeline, context=None):
+        """Create the handler.
+
+        Args:
+            pipeline (LogPipeline): The pipeline receiving the records.
+            context (callable, optional): Called with every record before it
+                is queued, to attach context only available on the logging
+                thread, such as the current request.
+        """
+        super().__init__()
+        self.pipeline = pipeline
+        self.context = context
+
+    def prepare(self, record):
+        """Make a record safe to be formatted on the writer thread.
+
+        The message is merged with its arguments and an exception is rendered
+        to text, so the record no longer refers to mutable arguments or to
+        the frames of a traceback.
+
+        Args:
+            record (logging.LogRecord): The record.
+
+        Returns:
+            logging.LogRecord: The record.
+        """
+        if self.context is not None:
+            self.context(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.pipeline.put(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
+class LogPipeline:
+    """Bounded ring buffer of log records drained by a writer thread."""
+
+    def __init__(self, handlers=(), queue_size=None, policy=None, batch_size=None, block_timeout=None):
+        """Create the pipeline.
+
+        Args:
+            handlers (iterable, optional): The handlers the records are written to.
+            queue_size (int, optional): Maximum number of queued records.
+            policy (str, optional): Overflow policy, 'drop_oldest' or 'block'.
+            batch_size (int, optional): Maximum number of records per batch.
+            block_timeout (float, optional): Seconds a caller waits for room
+                under the 'block' policy before its record is dropped.
+        """
+        if queue_size is None:
+            queue_size = int(os.environ.get('APILAMA_LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+        if policy is None:
+            policy = os.environ.get('APILAMA_LOG_QUEUE_POLICY', DROP_OLDEST).lower()
+        if batch_size is None:
+            batch_size = int(os.environ.get('APILAMA_LOG_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+        if block_timeout is None:
+            block_timeout = float(os.environ.get('APILAMA_LOG_BLOCK_TIMEOUT', DEFAULT_BLOCK_TIMEOUT))
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown log queue policy: {policy}")
+
+        self.handlers = list(handlers)
+        self.queue_size = max(1, queue_size)
+        self.policy = policy
+        self.batch_size = max(1, batch_size)
+        self.block_timeout = block_timeout
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.batches = 0
+        self.max_depth = 0
+        self._reset()
+
+        with _pipelines_lock:
+            _pipelines.append(self)
+
+    def _reset(self):
+        """Start over with an empty buffer and no writer thread.
+
+        Called on creation and in a forked child, where the writer thread of
+        the parent does not exist and the parent writes its own records.
+        """
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._in_flight = 0
+        self._stopping = False
+        self._thread = None
+        self._pid = os.getpid()
+
+    def add_handler(self, handler):
+        """Add a handler the records are written to.
+
+        Args:
+            handler (logging.Handler): The handler.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        with self._cond:
+            if handler not in self.handlers:
+                self.handlers = self.handlers + [handler]
+
+    def replace_handlers(self, handlers):
+        """Write the following records to other handlers.
+
+        Args:
+            handlers (iterable): The new handlers.
+
+        Returns:
+            list: The previous handlers, for the caller to close.
+        """
+        if self._pid != os.getpid():
+            # The batch in flight, if any, belongs to the writer of the parent
+            self._reset()
+        with self._cond:
+            # Never swap the handlers under a batch being written
+            self._cond.wait_for(lambda: not self._in_flight, 5)
+            old_handlers = self.handlers
+            self.handlers = list(handlers)
+        return [handler for handler in old_handlers if handler not in self.handlers]
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='apilama-log-writer', daemon=True)
+            self._thread.start()
+
+    def put(self, record):
+        """Queue a record, applying the overflow policy when the buffer is full.
+
+        Args:
+            record (logging.LogRecord): A prepared record.
+
+        Returns:
+            bool: Whether the record was queued.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+        with self._cond:
+            if self._stopping:
+                # Shutting down, write inline instead of losing the record
+                self._write([record])
+                return True
+            self._ensure_thread()
+            if len(self._queue) >= self.queue_size:
+                # The writer thread never waits on itself
+                if self.policy == BLOCK and threading.current_thread() is not self._thread:
+                    self.blocked += 1
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._queue) >= self.queue_size and not self._stopping:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    if len(self._queue) >= self.queue_size:
+                        self.dropped += 1
+                        return False
+                else:
+                    self._queue.popleft()
+                    self.dropped += 1
+            self._queue.append(record)
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._cond.notify_all()
+            return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                count = min(len(self._queue), self.batch_size)
+                batch = [self._queue.popleft() for _ in range(count)]
+                self._in_flight = count
+                # Room was made for blocked callers
+                self._cond.notify_all()
+            self._write(batch)
+            with self._cond:
+                self._in_flight = 0
+                self.written += count
+                self.batches += 1
+                self._cond.notify_all()
+
+    def _write(self, batch):
+        for handler in self.handlers:
+            try:
+                _emit_batch(handler, batch)
+            except Exception:
+                handler.handleError(batch[-1])
+
+    def flush(self, timeout=None):
+        """Wait until every queued record is written.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait.
+
+        Returns:
+            bool: Whether the buffer was drained in time.
+        """
+        if self._pid != os.getpid():
+            return True
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._in_flight, timeout)
+
+    def close(self, timeout=5.0):
+        """Write the queued records and stop the writer thread.
+
+        Records logged afterwards are written inline.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait for the writer.
+        """
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    @property
+    def depth(self):
+        """Number of records waiting in the buffer."""
+        return len(self._queue)
+
+    def stats(self):
+        """Get the queue counters."""
+        with self._cond:
+            return {
+                'policy': self.policy,
+                'queue_size': self.queue_size,
+                'depth': len(self._queue),
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'blocked': self.blocked,
+                'batches': self.batches,
+                'average_batch_size': round(self.written / self.batches, 2) if self.batches else None,
+                'handlers': [type(handler).__name__ for handler in self.handlers]
+            }
+
+
+def async_logging_enabled():
+    """Check whether loggers should write through a pipeline.
+
+    Returns:
+        bool: False if ``APILAMA_LOG_ASYNC`` disables the pipeline.
+    """
+    return os.environ.get('APILAMA_LOG_ASYNC', 'true').lower() in ('true', 'yes', '1')
+
+
+def install(logger, context=None):
+    """Move the handlers of a logger behind a pipeline.
+
+    Calling it again after more handlers were attached to the logger moves
+    those behind the same pipeline.
+
+    Args:
+        logger (logging.Logger): The logger.
+        context (callable, optional): Passed to the ``QueueHandler``.
+
+    Returns:
+        LogPipeline: The pipeline of the logger.
+    """
+    queue_handler = None
+    for handler in logger.handlers:
+        if isinstance(handler, QueueHandler):
+            queue_handler = handler
+            break
+    if queue_handler is None:
+        queue_handler = QueueHandler(LogPipeline(), context)
+
+    for handler in list(logger.handlers):
+        if handler is not queue_handler:
+            logger.removeHandler(handler)
+            queue_handler.pipeline.add_handler(handler)
+    if queue_handler not in logger.handlers:
+        logger.addHandler(queue_handler)
+    return queue_handler.pipeline
+
+
+def get_pipelines():
+    """Get all pipelines created in this process."""
+    with _pipelines_lock:
+        return list(_pipelines)
+
+
+def flush_all(timeout=None):
+    """Wait until the records of every pipeline are written.
+
+    Args:
+        timeout (float, optional): Maximum seconds to wait per pipeline.
+    """
+    for pipeline in get_pipelines():
+        pipeline.flush(timeout)
+
+
+def close_all():
+    """Drain and stop every pipeline; registered to run at exit."""
+    for pipeline in get_pipelines():
+        pipeline.close()
+
+
+def _before_fork():
+    # Fork only while no writer thread is in the middle of a batch: it could
+    # hold the lock of a stream the child writes to as well
+    _pipelines_lock.acquire()
+    for pipeline in _pipelines:
+        if pipeline._pid == os.getpid():
+            pipeline._cond.acquire()
+            pipeline._cond.wait_for(lambda pipeline=pipeline: not pipeline._in_flight, 5)
+
+
+def _after_fork_in_parent():
+    for pipeline in reversed(_pipelines):
+        if pipeline._pid == os.getpid():
+            pipeline._cond.release()
+    _pipelines_lock.release()
+
+
+def _after_fork_in_child():
+    global _pipelines_lock
+    _pipelines_lock = threading.Lock()
+    for pipeline in _pipelines:
+        pipeline._reset()
+
+
+def _metrics():
+    pipelines = get_pipelines()
+    return {
+        'pipelines': [pipeline.stats() for pipeline in pipelines],
+        'depth': sum(pipeline.depth for pipeline in pipelines),
+        'dropped': sum(pipeline.dropped for pipeline in pipelines)
+    }
+
+
+# Runs before the shutdown hook of the logging module closes the handlers
+atexit.register(close_all)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent,
+                        after_in_child=_after_fork_in_child)
+register_metrics_provider('logging', _metrics)
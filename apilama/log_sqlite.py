@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama SQLite Log Sink
+
+This module provides the handler writing log records to the SQLite log
+database (``APILAMA_DB_PATH``).
+
+Records are collected in memory and inserted with a single ``executemany``
+of one prepared statement per transaction, once ``flush_size`` records are
+pending or ``flush_interval`` seconds have passed. The database runs in WAL
+mode, so readers of the log never block the writer. A retention pass
+deletes rows older than ``retention_days`` in small chunks, each in its own
+short transaction.
+
+The table layout is the one of the LogLama SQLite handler, so LogLama tools
+can read the database.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from apilama.metrics import register_metrics_provider
+
+# Default settings, used when no environment variable overrides them
+DEFAULT_FLUSH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_PRUNE_CHUNK = 1000
+DEFAULT_PRUNE_INTERVAL = 3600.0
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        level TEXT NOT NULL,
+        level_no INTEGER NOT NULL,
+        logger_name TEXT NOT NULL,
+        message TEXT,
+        file_path TEXT,
+        line_number INTEGER,
+        function TEXT,
+        module TEXT,
+        process INTEGER,
+        process_name TEXT,
+        thread INTEGER,
+        thread_name TEXT,
+        exception_info TEXT,
+        context TEXT
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs (timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_logs_level ON logs (level_no)',
+    'CREATE INDEX IF NOT EXISTS idx_logs_logger_name ON logs (logger_name)',
+)
+
+INSERT = (
+    'INSERT INTO logs (timestamp, level, level_no, logger_name, message, file_path, line_number, '
+    'function, module, process, process_name, thread, thread_name, exception_info, context) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+)
+
+# Attributes every record has; everything else was passed through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+# Request context attached by ``apilama.logger``
+_REQUEST_ATTRIBUTES = ('url', 'remote_addr', 'method')
+
+_handlers = []
+_handlers_lock = threading.Lock()
+
+
+def _context(record):
+    """Collect the context of a record as a JSON object.
+
+    Args:
+        record (logging.LogRecord): The record.
+
+    Returns:
+        str: The JSON text, or None without context.
+    """
+    context = {}
+    for name, value in vars(record).items():
+        if name in _RECORD_ATTRIBUTES:
+            continue
+        if name == 'context' and isinstance(value, dict):
+            context.update(value)
+        elif name in _REQUEST_ATTRIBUTES and value in ('No URL', 'No IP', 'No Method'):
+            continue
+        else:
+            context[name] = value
+    if not context:
+        return None
+    return json.dumps(context, default=str)
+
+
+def check_schema(path):
+    """Remove a log database with an outdated schema.
+
+    Args:
+        path (str): Path of the log database.
+    """
+    if not os.path.exists(path):
+        return
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            columns = [column[1] for column in conn.execute('PRAGMA table_info(logs)')]
+        finally:
+            conn.close()
+
+        required_columns = ['level', 'level_no', 'logger_name', 'message']
+        missing_columns = [col for col in required_columns if col not in columns]
+        if missing_columns:
+            print(f"Database schema outdated. Missing columns: {missing_columns}")
+            print(f"Recreating database at {path}")
+            os.remove(path)
+    except Exception as e:
+        print(f"Error checking database schema: {e}")
+        print(f"Recreating database at {path}")
+        os.remove(path)
+
+
+class SQLiteLogHandler(logging.Handler):
+    """Logging handler inserting records into SQLite in batches."""
+
+    def __init__(self, path, flush_size=None, flush_interval=None, retention_days=None,
+                 prune_chunk=None, prune_interval=None):
+        """Create the handler.
+
+        The database is opened, and its schema checked, when the first
+        record is written.
+
+        Args:
+            path (str): Path of the database file.
+            flush_size (int, optional): Pending records that trigger an insert.
+            flush_interval (float, optional): Maximum seconds a record stays pending.
+            retention_days (float, optional): Days rows are kept; 0 keeps them forever.
+            prune_chunk (int, optional): Rows deleted per retention transaction.
+            prune_interval (float, optional): Seconds between two retention passes.
+        """
+        super().__init__()
+        if flush_size is None:
+            flush_size = int(os.environ.get('APILAMA_DB_FLUSH_SIZE', DEFAULT_FLUSH_SIZE))
+        if flush_interval is None:
+            flush_interval = float(os.environ.get('APILAMA_DB_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+        if retention_days is None:
+            retention_days = float(os.environ.get('APILAMA_DB_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+        if prune_chunk is None:
+            prune_chunk = int(os.environ.get('APILAMA_DB_PRUNE_CHUNK', DEFAULT_PRUNE_CHUNK))
+        if prune_interval is None:
+            prune_interval = float(os.environ.get('APILAMA_DB_PRUNE_INTERVAL', DEFAULT_PRUNE_INTERVAL))
+
+        self.path = path
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.prune_chunk = max(1, prune_chunk)
+        self.prune_interval = prune_interval
+
+        self.inserted = 0
+        self.flushes = 0
+        self.pruned = 0
+        self.errors = 0
+        self._pending = []
+        self._oldest_pending = None
+        self._last_prune = 0.0
+        self._closed = False
+        self._conn = None
+        self._pid = None
+        self._thread = None
+        self._stop = threading.Event()
+
+        with _handlers_lock:
+            _handlers.append(self)
+
+    def _connect(self):
+        """Open the connection of this process and prepare the database."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self._pid is None:
+            check_schema(self.path)
+        # Used by the logging thread and the flusher, always under the handler lock
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            conn.execute(statement)
+        self._conn = conn
+        self._pid = os.getpid()
+        self._thread = None
+        self._pending = []
+        self._oldest_pending = None
+
+    def _ensure_process(self):
+        if self._pid != os.getpid():
+            # First record, or a forked child that must not use the
+            # connection of its parent
+            self._connect()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='apilama-log-sqlite', daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def row(record):
+        """Convert a record to the values of the insert statement.
+
+        Args:
+            record (logging.LogRecord): The record.
+
+        Returns:
+            tuple: The column values.
+        """
+        exception_info = record.exc_text
+        if record.exc_info and not exception_info:
+            exception_info = logging.Formatter().formatException(record.exc_info)
+        return (
+            datetime.fromtimestamp(record.created).isoformat(),
+            record.levelname,
+            record.levelno,
+            record.name,
+            record.getMessage(),
+            record.pathname,
+            record.lineno,
+            record.funcName,
+            record.module,
+            record.process,
+            record.processName,
+            record.thread,
+            record.threadName,
+            exception_info,
+            _context(record),
+        )
+
+    def emit(self, record):
+        self.emit_batch([record])
+
+    def emit_batch(self, records):
+        """Queue a batch of records for the next insert.
+
+        Args:
+            records (list): The records, oldest first.
+        """
+        if self._closed:
+            return
+        self._ensure_process()
+        for record in records:
+            try:
+                self._pending.append(self.row(record))
+            except Exception:
+                self.handleError(record)
+        if self._oldest_pending is None and self._pending:
+            self._oldest_pending = time.monotonic()
+        if len(self._pending) >= self.flush_size:
+            self._flush_pending()
+
+    def _flush_pending(self):
+        """Insert the pending rows in one transaction; called under the handler lock."""
+        if not self._pending or self._conn is None:
+            return
+        rows = self._pending
+        self._pending = []
+        self._oldest_pending = None
+        try:
+            with self._conn:
+                self._conn.execute('BEGIN IMMEDIATE')
+                self._conn.executemany(INSERT, rows)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"Cannot write {len(rows)} log records to {self.path}: {e}")
+            return
+        self.inserted += len(rows)
+        self.flushes += 1
+
+    def flush(self):
+        """Insert every pending record now."""
+        self.acquire()
+        try:
+            if self._pid == os.getpid():
+                self._flush_pending()
+        finally:
+            self.release()
+
+    def prune(self, now=None):
+        """Delete the rows older than the retention period.
+
+        The rows are deleted ``prune_chunk`` at a time, each chunk in its own
+        transaction, and the handler lock is released between chunks so
+        records keep being written.
+
+        Args:
+            now (datetime, optional): The current time.
+
+        Returns:
+            int: The number of deleted rows.
+        """
+        if self.retention_days <= 0:
+            return 0
+        cutoff = ((now or datetime.now()) - timedelta(days=self.retention_days)).isoformat()
+        deleted = 0
+        self.acquire()
+        try:
+            if self._conn is None or self._pid != os.getpid():
+                return 0
+            # Ids grow with time, so everything up to the newest expired id goes
+            last_id = self._conn.execute('SELECT MAX(id) FROM logs WHERE timestamp < ?', (cutoff,)).fetchone()[0]
+        finally:
+            self.release()
+        if last_id is None:
+            return 0
+
+        while True:
+            self.acquire()
+            try:
+                if self._conn is None:
+                    break
+                with self._conn:
+                    cursor = self._conn.execute(
+                        'DELETE FROM logs WHERE id IN (SELECT id FROM logs WHERE id <= ? ORDER BY id LIMIT ?)',
+                        (last_id, self.prune_chunk)
+                    )
+                count = cursor.rowcount
+            except sqlite3.Error as e:
+                self.errors += 1
+                print(f"Cannot prune log records in {self.path}: {e}")
+                break
+            finally:
+                self.release()
+            deleted += count
+            if count < self.prune_chunk:
+                break
+            # Let waiting writers in between two chunks
+            time.sleep(0)
+        self.pruned += deleted
+        return deleted
+
+    def _run(self):
+        """Flush pending records on time and run the retention passes."""
+        stop = self._stop
+        tick = max(0.05, min(self.flush_interval, 1.0))
+        while not stop.wait(tick):
+            self.acquire()
+            try:
+                if self._oldest_pending is not None and \
+                        time.monotonic() - self._oldest_pending >= self.flush_interval:
+                    self._flush_pending()
+            finally:
+                self.release()
+            if self.retention_days > 0 and time.monotonic() - self._last_prune >= self.prune_interval:
+                self._last_prune = time.monotonic()
+                self.prune()
+
+    def close(self):
+        """Insert the pending records and close the database."""
+        self.acquire()
+        try:
+            if not self._closed and self._conn is not None and self._pid == os.getpid():
+                self._flush_pending()
+                self._conn.close()
+            self._closed = True
+            self._conn = None
+            self._stop.set()
+        finally:
+            self.release()
+        with _handlers_lock:
+            if self in _handlers:
+                _handlers.remove(self)
+        super().close()
+
+    def stats(self):
+        """Get the write counters."""
+        return {
+            'path': self.path,
+            'pending': len(self._pending),
+            'inserted': self.inserted,
+            'flushes': self.flushes,
+            'average_flush_size': round(self.inserted / self.flushes, 2) if self.flushes else None,
+            'pruned': self.pruned,
+            'errors': self.errors,
+            'retention_days': self.retention_days
+        }
+
+
+def _metrics():
+    with _handlers_lock:
+        handlers = list(_handlers)
+    return {'databases': [handler.stats() for handler in handlers]}
+
+
+register_metrics_provider('log_database', _metrics)
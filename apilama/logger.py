@@ -5,64 +5,297 @@
 APILama Logger
 
 This module provides logging functionality for the APILama service.
+
+All of APILama logs through the single handler chain of the 'apilama'
+logger: console, rotating file and, when enabled, the SQLite log database.
+``configure`` (re)builds the chain; ``apilama.logging_config.init_logging``
+calls it with the ``APILAMA_*`` logging settings. Loggers of submodules
+(``apilama.files``, the Flask app logger, ...) only propagate to it.
+
+Unless ``APILAMA_LOG_ASYNC`` is false, the handlers sit behind an
+``apilama.log_pipeline`` queue, so logging from a request only queues the
+record and the writes happen on a background thread.
+
+The URL, client address and method of a request are read once per request
+by the hook ``init_app`` registers, and attached to every record logged
+while the request is handled.
 """
 
+import contextvars
+import itertools
 import os
 import logging
-from logging.handlers import RotatingFileHandler
 from flask import request, has_request_context
 
+from apilama import log_pipeline
+
+# Emit one of every N per-request debug messages (request/response lines and
+# the like), so enabling DEBUG in production does not flood the log
+HOT_PATH_SAMPLE = int(os.environ.get('APILAMA_LOG_HOT_PATH_SAMPLE', 1))
+
+# Default settings, used when no environment variable overrides them
+DEFAULT_LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
+DEFAULT_MAX_BYTES = 10485760  # 10 MB
+DEFAULT_BACKUP_COUNT = 10
+
+LOG_FORMAT = '[%(asctime)s] [%(levelname)s] [%(remote_addr)s] [%(method)s] [%(url)s] - %(message)s'
+
+_NO_REQUEST = ('No URL', 'No IP', 'No Method')
+
+# (url, remote_addr, method) of the request handled by the current thread
+_request_context = contextvars.ContextVar('apilama_request_context', default=None)
+
+
+def capture_request_context():
+    """Read the request context of the current request once.
+
+    Registered as a ``before_request`` hook by ``init_app``.
+    """
+    _request_context.set((request.url, request.remote_addr, request.method))
+
+
+def clear_request_context(exc=None):
+    """Forget the request context at the end of a request.
+
+    Registered as a ``teardown_request`` hook by ``init_app``.
+    """
+    _request_context.set(None)
+
+
+def add_request_context(record):
+    """Attach the URL, client address and method of the current request to a record.
+
+    Args:
+        record (logging.LogRecord): The record.
+    """
+    context = _request_context.get()
+    if context is None:
+        if has_request_context():
+            # A request of an app without the init_app hooks
+            context = (request.url, request.remote_addr, request.method)
+        else:
+            context = _NO_REQUEST
+    record.url, record.remote_addr, record.method = context
+
+
 # Create a custom formatter that includes request information when available
 class RequestFormatter(logging.Formatter):
     def format(self, record):
-        if has_request_context():
-            record.url = request.url
-            record.remote_addr = request.remote_addr
-            record.method = request.method
-        else:
-            record.url = 'No URL'
-            record.remote_addr = 'No IP'
-            record.method = 'No Method'
+        # Records from the pipeline got their context when they were logged
+        if not hasattr(record, 'url'):
+            add_request_context(record)
         return super().format(record)
 
+
 # Create a logger
 logger = logging.getLogger('apilama')
 logger.setLevel(logging.INFO)
 
-# Create a formatter
-formatter = RequestFormatter(
-    '[%(asctime)s] [%(levelname)s] [%(remote_addr)s] [%(method)s] [%(url)s] - %(message)s'
-)
 
-# Create a console handler
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
+def _enabled(value):
+    return str(value).lower() in ('true', 'yes', '1')
+
+
+def configure(level=None, log_dir=None, database=None, db_path=None, json_format=None, console=True):
+    """Build the handler chain of the 'apilama' logger.
+
+    The handlers of a previous call are flushed and closed, so calling it
+    again replaces the chain instead of adding a second one.
+
+    Args:
+        level (str, optional): Logging level. Defaults to ``APILAMA_LOG_LEVEL`` or INFO.
+        log_dir (str, optional): Directory of ``apilama.log``. Defaults to
+            ``APILAMA_LOG_DIR`` or the ``logs`` directory of the project.
+        database (bool, optional): Write records to the SQLite log database.
+            Defaults to ``APILAMA_DB_LOGGING``.
+        db_path (str, optional): Path of the log database. Defaults to
+            ``APILAMA_DB_PATH`` or ``apilama.db`` in the log directory.
+        json_format (bool, optional): Format records as JSON when LogLama
+            is available. Defaults to ``APILAMA_JSON_LOGS``.
+        console (bool, optional): Log to stderr as well. Defaults to True.
+
+    Returns:
+        list: The handlers of the chain.
+    """
+    if level is None:
+        level = os.environ.get('APILAMA_LOG_LEVEL', 'INFO')
+    if log_dir is None:
+        log_dir = os.environ.get('APILAMA_LOG_DIR', DEFAULT_LOG_DIR)
+    if database is None:
+        database = _enabled(os.environ.get('APILAMA_DB_LOGGING', 'true'))
+    if db_path is None:
+        db_path = os.environ.get('APILAMA_DB_PATH', os.path.join(log_dir, 'apilama.db'))
+    if json_format is None:
+        json_format = _enabled(os.environ.get('APILAMA_JSON_LOGS', 'true'))
+
+    formatter = RequestFormatter(LOG_FORMAT)
+    if json_format:
+        try:
+            from loglama.formatters import JSONFormatter
+            formatter = JSONFormatter()
+        except ImportError:
+            pass
+
+    handlers = []
+    if console:
+        console_handler = log_pipeline.BatchStreamHandler()
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
 
-# Create a file handler
-log_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
-os.makedirs(log_dir, exist_ok=True)
-file_handler = RotatingFileHandler(
-    os.path.join(log_dir, 'apilama.log'),
-    maxBytes=10485760,  # 10 MB
-    backupCount=10
-)
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+    # Opened, and its directory created, with the first record
+    file_handler = log_pipeline.BatchRotatingFileHandler(
+        os.path.join(log_dir, 'apilama.log'),
+        maxBytes=int(os.environ.get('APILAMA_LOG_MAX_BYTES', DEFAULT_MAX_BYTES)),
+        backupCount=int(os.environ.get('APILAMA_LOG_BACKUP_COUNT', DEFAULT_BACKUP_COUNT)),
+        delay=True
+    )
+    file_handler.setFormatter(formatter)
+    handlers.append(file_handler)
+
+    if database:
+        from apilama.log_sqlite import SQLiteLogHandler
+        handlers.append(SQLiteLogHandler(db_path))
+
+    old_handlers = [handler for handler in logger.handlers if not isinstance(handler, log_pipeline.QueueHandler)]
+    queue_handlers = [handler for handler in logger.handlers if isinstance(handler, log_pipeline.QueueHandler)]
+    for handler in old_handlers:
+        logger.removeHandler(handler)
+
+    if log_pipeline.async_logging_enabled():
+        if queue_handlers:
+            pipeline = queue_handlers[0].pipeline
+            pipeline.flush(5)
+            old_handlers.extend(pipeline.replace_handlers(handlers))
+        else:
+            for handler in handlers:
+                logger.addHandler(handler)
+            log_pipeline.install(logger, context=add_request_context)
+    else:
+        for handler in queue_handlers:
+            handler.pipeline.close()
+            old_handlers.extend(handler.pipeline.replace_handlers([]))
+            logger.removeHandler(handler)
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    for handler in old_handlers:
+        handler.close()
+
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    return handlers
+
+
+# Console and file logging until the application configures the chain
+configure(database=False)
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Logger with lazily built structured context and sampling.
+
+    Messages take ``%``-style arguments, which the logging module only
+    merges when a record is emitted. Two keyword arguments are added to the
+    logging methods:
+
+        context  a dict, or a callable returning one, stored as the
+                 ``context`` of the record; a callable is only called when
+                 the level is enabled
+        sample   emit only one of every ``sample`` calls with the same message
+
+    Nothing is built for a disabled level beyond the call itself.
+    """
+
+    def __init__(self, logger):
+        super().__init__(logger, None)
+        self._samples = {}
+
+    def _sampled(self, msg, sample):
+        counter = self._samples.get(msg)
+        if counter is None:
+            counter = self._samples.setdefault(msg, itertools.count())
+        return next(counter) % sample == 0
+
+    def _emit(self, level, msg, args, context, sample, kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        if sample and sample > 1 and not self._sampled(msg, sample):
+            return
+        if context is not None:
+            extra = dict(kwargs.get('extra') or ())
+            extra['context'] = context() if callable(context) else context
+            kwargs['extra'] = extra
+        # Attribute the record to the caller rather than to this class
+        kwargs['stacklevel'] = kwargs.get('stacklevel', 1) + _STACKLEVEL_OFFSET
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def log(self, level, msg, *args, context=None, sample=None, **kwargs):
+        """Log a message with context, if the level is enabled.
+
+        Args:
+            level (int): The logging level.
+            msg (str): The message, with ``%``-style placeholders.
+            *args: The placeholder values.
+            context (dict or callable, optional): The structured context.
+            sample (int, optional): Emit one of every ``sample`` calls.
+            **kwargs: Passed on to the logger, e.g. ``exc_info``.
+        """
+        self._emit(level, msg, args, context, sample, kwargs)
+
+    def debug(self, msg, *args, context=None, sample=None, **kwargs):
+        self._emit(logging.DEBUG, msg, args, context, sample, kwargs)
+
+    def info(self, msg, *args, context=None, sample=None, **kwargs):
+        self._emit(logging.INFO, msg, args, context, sample, kwargs)
+
+    def warning(self, msg, *args, context=None, sample=None, **kwargs):
+        self._emit(logging.WARNING, msg, args, context, sample, kwargs)
+
+    def error(self, msg, *args, context=None, sample=None, **kwargs):
+        self._emit(logging.ERROR, msg, args, context, sample, kwargs)
+
+    def exception(self, msg, *args, context=None, sample=None, exc_info=True, **kwargs):
+        kwargs['exc_info'] = exc_info
+        self._emit(logging.ERROR, msg, args, context, sample, kwargs)
+
+    def critical(self, msg, *args, context=None, sample=None, **kwargs):
+        self._emit(logging.CRITICAL, msg, args, context, sample, kwargs)
+
+
+# Frames of StructuredLogger between the caller and Logger.log
+_STACKLEVEL_OFFSET = 2
+
+
+def get_logger(name='apilama'):
+    """Get a structured logger.
+
+    Args:
+        name (str, optional): Name of the logger. Defaults to 'apilama'.
+
+    Returns:
+        StructuredLogger: The logger.
+    """
+    return StructuredLogger(logging.getLogger(name))
 
 
 def init_app(app):
     """Initialize the logger for a Flask application.
     
+    The app logger propagates to the 'apilama' chain instead of getting
+    handlers of its own, and the request context is captured once per
+    request.
+    
     Args:
         app (Flask): The Flask application to initialize the logger for.
     """
-    # Set the Flask app logger to use our logger
-    app.logger.handlers = logger.handlers
-    app.logger.setLevel(logger.level)
+    app.logger.handlers = []
+    app.logger.setLevel(logging.NOTSET)
+    app.logger.propagate = True
     
-    # Log when the app is initialized
-    logger.info('APILama logger initialized')
+    app.before_request(capture_request_context)
+    app.teardown_request(clear_request_context)
+
+
+_api_logger = get_logger('apilama.api')
+_files_logger = get_logger('apilama.files')
 
 
 def log_api_call(endpoint, success=True, error=None):
@@ -74,9 +307,9 @@ def log_api_call(endpoint, success=True, error=None):
         error (str, optional): The error message if the API call failed. Defaults to None.
     """
     if success:
-        logger.info(f'API call to {endpoint} successful')
+        _api_logger.info('API call to %s successful', endpoint)
     else:
-        logger.error(f'API call to {endpoint} failed: {error}')
+        _api_logger.error('API call to %s failed: %s', endpoint, error)
 
 
 def log_file_operation(operation, filename=None, success=True, error=None):
@@ -90,9 +323,12 @@ def log_file_operation(operation, filename=None, success=True, error=None):
     """
     # Handle case where only operation is provided
     if filename is None:
-        filename = 'all_files'
-        logger.info(f"File {operation} (using default parameters)")
+        _files_logger.info("File %s (using default parameters)", operation)
     elif success:
-        logger.info(f"File {operation}: {filename}")
+        _files_logger.info("File %s: %s", operation, filename)
     else:
-        logger.error(f"File {operation} failed: {filename} - {error}")
+        _files_logger.error("File %s failed: %s - %s", operation, filename, error, context=lambda: {
+            'operation': operation,
+            'filename': filename,
+            'error': error
+        })
@@ -4,228 +4,174 @@
 """
 APILama Logging Configuration
 
-This module configures logging for APILama using the LogLama package.
-It ensures that environment variables are loaded before any other libraries.
+This module configures logging for APILama. It loads the environment with
+the LogLama package when that is available, and builds the single handler
+chain of ``apilama.logger`` from the ``APILAMA_*`` logging settings.
+
+Importing this module does no work: ``load_environment`` reads the .env
+file with python-dotenv, and LogLama is looked up and imported only by
+``init_logging``, which ``create_app`` calls.
 """
 
 import os
 import sys
+import threading
 from pathlib import Path
 
-# Add the loglama package to the path if it's not already installed
-# The correct path should be: /home/tom/github/py-lama/loglama
-loglama_path = Path(__file__).parent.parent.parent / 'loglama'
-if loglama_path.exists() and str(loglama_path) not in sys.path:
-    sys.path.insert(0, str(loglama_path))
-    print(f"Added LogLama path: {loglama_path}")
-else:
-    # Try an alternative path calculation
-    alt_loglama_path = Path('/home/tom/github/py-lama/loglama')
-    if alt_loglama_path.exists() and str(alt_loglama_path) not in sys.path:
-        sys.path.insert(0, str(alt_loglama_path))
-        print(f"Added alternative LogLama path: {alt_loglama_path}")
-
-# Import LogLama components
-try:
-    from loglama.config.env_loader import load_env, get_env
-    from loglama.utils import configure_logging
-    from loglama.utils.context import LogContext, capture_context
-    from loglama.formatters import ColoredFormatter, JSONFormatter
-    from loglama.handlers import SQLiteHandler, EnhancedRotatingFileHandler
-    LOGLAMA_AVAILABLE = True
-except ImportError as e:
-    print(f"LogLama import error: {e}")
-    LOGLAMA_AVAILABLE = False
-
-
-def init_logging():
+from apilama import logger as apilama_logger
+from apilama.logger import get_logger, log_api_call, log_file_operation
+
+# None until init_logging looked for LogLama
+LOGLAMA_AVAILABLE = None
+
+_loglama_context = None
+_init_lock = threading.Lock()
+_initialized = False
+_environment_loaded = False
+
+
+def load_environment():
+    """Load the variables of the .env file into the environment, once.
+
+    Uses python-dotenv, which is cheap to import, so the settings read by
+    modules at import time see the .env values. Variables already set in
+    the environment win.
+
+    Returns:
+        bool: Whether python-dotenv is available.
     """
-    Initialize logging for APILama using LogLama.
-    
-    This function should be called at the very beginning of the application
-    before any other imports or configurations are done.
+    global _environment_loaded
+    try:
+        from dotenv import find_dotenv, load_dotenv
+    except ImportError:
+        return False
+    if not _environment_loaded:
+        _environment_loaded = True
+        load_dotenv(find_dotenv(usecwd=True))
+    return True
+
+
+def import_loglama():
+    """Import the LogLama components used by APILama, once.
+
+    Returns:
+        bool: Whether LogLama is available.
+    """
+    global LOGLAMA_AVAILABLE, _loglama_context
+    if LOGLAMA_AVAILABLE is not None:
+        return LOGLAMA_AVAILABLE
+
+    # Add the loglama package to the path if it's not already installed
+    # The correct path should be: /home/tom/github/py-lama/loglama
+    loglama_path = Path(__file__).parent.parent.parent / 'loglama'
+    if loglama_path.exists() and str(loglama_path) not in sys.path:
+        sys.path.insert(0, str(loglama_path))
+        print(f"Added LogLama path: {loglama_path}")
+    else:
+        # Try an alternative path calculation
+        alt_loglama_path = Path('/home/tom/github/py-lama/loglama')
+        if alt_loglama_path.exists() and str(alt_loglama_path) not in sys.path:
+            sys.path.insert(0, str(alt_loglama_path))
+            print(f"Added alternative LogLama path: {alt_loglama_path}")
+
+    try:
+        from loglama.utils.context import LogContext as loglama_context
+        _loglama_context = loglama_context
+        LOGLAMA_AVAILABLE = True
+    except ImportError as e:
+        print(f"LogLama import error: {e}")
+        LOGLAMA_AVAILABLE = False
+    return LOGLAMA_AVAILABLE
+
+
+def init_logging(force=False):
+    """
+    Initialize logging for APILama.
+
+    Loads the .env files, with LogLama when it is available, and builds the
+    handler chain of the 'apilama' logger from the ``APILAMA_*`` logging settings.
+    The log database is opened, and its schema checked, by the background
+    writer on the first record.
+
+    Args:
+        force (bool, optional): Rebuild the handler chain even if logging
+            was already initialized in this process. Defaults to False.
+
+    Returns:
+        bool: Whether LogLama is available.
     """
-    if not LOGLAMA_AVAILABLE:
+    global _initialized
+    with _init_lock:
+        if _initialized and not force:
+            return LOGLAMA_AVAILABLE
+        _initialized = True
+
+    load_environment()
+    if import_loglama():
+        # Load environment variables from .env files
+        from loglama.config.env_loader import load_env
+        load_env(verbose=True)
+    else:
         print("LogLama package not available. Using default logging configuration.")
-        return False
-    
-    # Load environment variables from .env files
-    load_env(verbose=True)
-    
+
     # Get logging configuration from environment variables
-    log_level = get_env('APILAMA_LOG_LEVEL', 'INFO')
-    log_dir = get_env('APILAMA_LOG_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs'))
-    db_enabled = get_env('APILAMA_DB_LOGGING', 'true').lower() in ('true', 'yes', '1')
-    db_path = get_env('APILAMA_DB_PATH', os.path.join(log_dir, 'apilama.db'))
-    json_format = get_env('APILAMA_JSON_LOGS', 'true').lower() in ('true', 'yes', '1')  # Default to JSON format for better integration
-    structured_logging = get_env('APILAMA_STRUCTURED_LOGGING', 'true').lower() in ('true', 'yes', '1')
-    
-    # Ensure log directory exists
-    os.makedirs(log_dir, exist_ok=True)
-    
-    # Check if the database exists and handle schema changes
-    if db_enabled and os.path.exists(db_path):
-        try:
-            # Try to connect to the database to check if it has the correct schema
-            import sqlite3
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute(f"PRAGMA table_info(logs)")
-            columns = [column[1] for column in cursor.fetchall()]
-            conn.close()
-            
-            # Check if the required columns exist
-            required_columns = ['level', 'level_no', 'logger_name', 'message']
-            missing_columns = [col for col in required_columns if col not in columns]
-            
-            if missing_columns:
-                print(f"Database schema outdated. Missing columns: {missing_columns}")
-                print(f"Recreating database at {db_path}")
-                os.remove(db_path)
-                print("Old database removed. A new one will be created automatically.")
-        except Exception as e:
-            print(f"Error checking database schema: {e}")
-            print(f"Recreating database at {db_path}")
-            os.remove(db_path)
-            print("Old database removed. A new one will be created automatically.")
-    
-    # Configure logging
-    logger = configure_logging(
-        name='apilama',
-        level=log_level,
-        console=True,
-        file=True,
-        file_path=os.path.join(log_dir, 'apilama.log'),
-        database=db_enabled,
-        db_path=db_path,
-        json=json_format,  # Use JSON format for better integration with LogLama
-        context_filter=True,
-        structured=structured_logging  # Use structured logging for better integration
-    )
-    
+    log_dir = os.environ.get('APILAMA_LOG_DIR', apilama_logger.DEFAULT_LOG_DIR)
+    db_enabled = os.environ.get('APILAMA_DB_LOGGING', 'true').lower() in ('true', 'yes', '1')
+    db_path = os.environ.get('APILAMA_DB_PATH', os.path.join(log_dir, 'apilama.db'))
+
+    apilama_logger.configure(log_dir=log_dir, database=db_enabled, db_path=db_path)
+
     # Add standard context information that will be included in all logs
     LogContext.set_context(
         component='apilama',
         service='apilama',
-        version=get_env('APILAMA_VERSION', '1.0.0')
+        version=os.environ.get('APILAMA_VERSION', '1.0.0')
     )
-    
+
     # Log initialization
-    logger.info('APILama logging initialized with LogLama')
-    return True
+    apilama_logger.logger.info('APILama logging initialized')
+    return LOGLAMA_AVAILABLE
 
 
-def get_logger(name=None):
-    """
-    Get a logger instance.
-    
-    Args:
-        name (str, optional): Name of the logger. Defaults to 'apilama'.
-        
-    Returns:
-        Logger: A configured logger instance.
+def log_request_context(func):
     """
-    if not name:
-        name = 'apilama'
-    
-    if LOGLAMA_AVAILABLE:
-        from loglama import get_logger as loglama_get_logger
-        return loglama_get_logger(name)
-    else:
-        import logging
-        return logging.getLogger(name)
+    Decorator kept for compatibility.
 
+    The request context is captured once per request by the hook of
+    ``apilama.logger.init_app`` and attached to every record, so the
+    decorated function is returned unchanged.
 
-def log_request_context(func):
-    """
-    Decorator to add request context to logs.
-    
     Args:
         func: The function to decorate.
-        
+
     Returns:
-        The decorated function.
+        The function.
     """
-    from functools import wraps
-    from flask import request
-    
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        if LOGLAMA_AVAILABLE and hasattr(request, 'remote_addr'):
-            context = {
-                'ip': request.remote_addr,
-                'method': request.method,
-                'url': request.url,
-                'endpoint': request.endpoint,
-                'user_agent': request.user_agent.string if request.user_agent else 'Unknown'
-            }
-            with LogContext(**context):
-                return func(*args, **kwargs)
-        return func(*args, **kwargs)
-    
-    return wrapper
-
-
-def log_api_call(endpoint, success=True, error=None):
-    """
-    Log an API call.
-    
-    Args:
-        endpoint (str): The API endpoint that was called.
-        success (bool, optional): Whether the API call was successful. Defaults to True.
-        error (str, optional): The error message if the API call failed. Defaults to None.
-    """
-    logger = get_logger('apilama.api')
-    
-    if success:
-        logger.info(f'API call to {endpoint} successful')
-    else:
-        logger.error(f'API call to {endpoint} failed: {error}')
+    return func
 
 
-def log_file_operation(operation, filename=None, success=True, error=None):
-    """
-    Log a file operation.
-    
-    Args:
-        operation (str): The file operation that was performed (e.g., 'read', 'write', 'list').
-        filename (str, optional): The name of the file that was operated on. Defaults to None.
-        success (bool, optional): Whether the file operation was successful. Defaults to True.
-        error (str, optional): The error message if the file operation failed. Defaults to None.
+class LogContext:
+    """Add fields to the LogLama log context within a ``with`` block.
+
+    Does nothing unless ``init_logging`` loaded LogLama; it never imports
+    LogLama itself.
     """
-    logger = get_logger('apilama.files')
-    
-    # Handle case where only operation is provided
-    if filename is None:
-        filename = 'all_files'
-        logger.info(f"File {operation} (using default parameters)")
-    elif success:
-        logger.info(f"File {operation}: {filename}")
-    else:
-        logger.error(f"File {operation} failed: {filename} - {error}", extra={
-            'context': {
-                'operation': operation,
-                'filename': filename,
-                'error': error
-            }
-        })
-
-
-# Export LogContext for backward compatibility
-if LOGLAMA_AVAILABLE:
-    from loglama.utils.context import LogContext
-else:
-    # Define a simple LogContext class for backward compatibility
-    class LogContext:
-        @staticmethod
-        def set_context(**kwargs):
-            pass
-            
-        def __init__(self, **kwargs):
-            self.context = kwargs
-            
-        def __enter__(self):
-            return self
-            
-        def __exit__(self, exc_type, exc_val, exc_tb):
-            pass
+
+    @staticmethod
+    def set_context(**kwargs):
+        if _loglama_context is not None:
+            _loglama_context.set_context(**kwargs)
+
+    def __init__(self, **kwargs):
+        self.context = kwargs
+        self._context = None
+
+    def __enter__(self):
+        if _loglama_context is not None:
+            self._context = _loglama_context(**self.context)
+            self._context.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._context is not None:
+            return self._context.__exit__(exc_type, exc_val, exc_tb)
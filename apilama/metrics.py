@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Metrics
+
+This module keeps a registry of metrics providers. Subsystems register a
+function that returns their current statistics, and the metrics endpoint
+collects them on demand.
+"""
+
+import threading
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def register_metrics_provider(name, provider):
+    """Register a metrics provider.
+
+    Args:
+        name (str): The name under which the metrics are reported.
+        provider (callable): A function without arguments returning a
+            JSON-serializable dict.
+    """
+    with _providers_lock:
+        _providers[name] = provider
+
+
+def get_metrics_providers():
+    """Get the names of all registered metrics providers.
+
+    Returns:
+        list: The sorted provider names.
+    """
+    with _providers_lock:
+        return sorted(_providers)
+
+
+def collect_metrics(name=None):
+    """Collect the metrics of one or all providers.
+
+    Args:
+        name (str, optional): The provider to collect. Defaults to all providers.
+
+    Returns:
+        dict: The metrics keyed by provider name.
+
+    Raises:
+        KeyError: If ``name`` is given and no such provider is registered.
+    """
+    with _providers_lock:
+        if name is not None:
+            providers = {name: _providers[name]}
+        else:
+            providers = dict(_providers)
+
+    metrics = {}
+    for provider_name, provider in providers.items():
+        try:
+            metrics[provider_name] = provider()
+        except Exception as e:
+            metrics[provider_name] = {'error': str(e)}
+    return metrics
@@ -1,10 +1,17 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, send_file, current_app
 import os
-import glob
+from datetime import datetime, timezone
 from pathlib import Path
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
 
 # Import LogLama utilities
 from apilama.logging_config import get_logger, log_file_operation, log_request_context, LogContext
+from apilama.logger import HOT_PATH_SAMPLE
+from apilama.dirindex import get_directory_index, invalidate_directory
+from apilama.fileio import atomic_write, ensure_recovered, write_batch
+from apilama.git_engine import invalidate_status
+from apilama.committer import queue_commit
 
 file_routes = Blueprint('file_routes', __name__)
 
@@ -17,50 +24,116 @@ def get_markdown_dir():
     markdown_dir = os.environ.get('MARKDOWN_DIR', '~/github/py-lama/weblama/markdown')
     # Expand the tilde to the home directory
     markdown_dir = os.path.expanduser(markdown_dir)
-    logger.info(f"Using markdown directory: {markdown_dir}", extra={
-        'context': {'markdown_dir': markdown_dir}
-    })
+    logger.debug("Using markdown directory: %s", markdown_dir, sample=HOT_PATH_SAMPLE)
     return markdown_dir
 
 
 @file_routes.route('/api/files', methods=['GET'])
 @log_request_context
 def get_files():
-    """List all markdown files in the markdown directory."""
+    """List all markdown files in the markdown directory.
+
+    The listing is served from an in-memory directory index and carries an
+    ETag, so polling clients get a 304 while the directory is unchanged.
+    """
     try:
         with LogContext(operation='list_files'):
             markdown_dir = get_markdown_dir()
-            
-            if not os.path.exists(markdown_dir):
-                logger.info(f"Creating markdown directory: {markdown_dir}")
-                os.makedirs(markdown_dir, exist_ok=True)
-                
-            # Get all markdown files
-            markdown_files = []
-            for file_path in glob.glob(os.path.join(markdown_dir, '*.md')):
-                file_name = os.path.basename(file_path)
-                file_size = os.path.getsize(file_path)
-                last_modified = os.path.getmtime(file_path)
-                markdown_files.append({
-                    'name': file_name,
-                    'path': file_path,
-                    'size': file_size,
-                    'last_modified': last_modified
-                })
-            
+            snapshot = get_directory_index(markdown_dir, '*.md').snapshot()
+
             # Log the operation
             log_file_operation('list', 'all_markdown_files', True)
-            logger.info(f"Listed {len(markdown_files)} markdown files", extra={
-                'context': {'file_count': len(markdown_files)}
-            })
-            
-            return jsonify({
-                'status': 'success',
-                'files': markdown_files
+            logger.info("Listed %s markdown files", len(snapshot.files), context=lambda: {
+                'file_count': len(snapshot.files)
             })
+
+            response = Response(snapshot.body, mimetype='application/json')
+            response.set_etag(snapshot.etag)
+            return response.make_conditional(request)
     except Exception as e:
         log_file_operation('list', 'all_markdown_files', False, str(e))
-        logger.error(f"Error listing files: {str(e)}", exc_info=True)
+        logger.error("Error listing files: %s", e, exc_info=True)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+def file_validators(stat_result):
+    """Build the cache validators of a file from its stat result.
+
+    Args:
+        stat_result (os.stat_result): The stat result of the file.
+
+    Returns:
+        tuple: The strong ETag and the Last-Modified time of the file.
+    """
+    etag = f'{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}'
+    last_modified = datetime.fromtimestamp(stat_result.st_mtime, timezone.utc)
+    return etag, last_modified
+
+
+def read_markdown_file(filename):
+    """Answer a request for the content of a markdown file.
+
+    The file is opened and stat-ed first; when the client already holds the
+    current version (If-None-Match / If-Modified-Since) a 304 is returned
+    without reading the file.
+
+    Args:
+        filename (str): The file name relative to the markdown directory.
+
+    Returns:
+        The Flask response.
+    """
+    try:
+        with LogContext(operation='read_file', filename=filename):
+            markdown_dir = get_markdown_dir()
+            file_path = safe_join(markdown_dir, filename)
+
+            try:
+                if file_path is None:
+                    # The path escapes the markdown directory
+                    raise FileNotFoundError(filename)
+                f = open(file_path, 'r')
+            except (FileNotFoundError, IsADirectoryError):
+                logger.warning("File not found: %s", filename, context=lambda: {
+                    'file_path': file_path
+                })
+                return jsonify({
+                    'status': 'error',
+                    'message': f'File {filename} not found'
+                }), 404
+
+            with f:
+                # Validators come from the open descriptor, so they always
+                # describe the content that is read below
+                stat_result = os.fstat(f.fileno())
+                etag, last_modified = file_validators(stat_result)
+
+                if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                    response = Response(status=304)
+                else:
+                    content = f.read()
+
+                    # Log the operation
+                    log_file_operation('read', filename, True)
+                    logger.info("Read file %s", filename, context=lambda: {
+                        'file_size': stat_result.st_size, 'file_path': file_path
+                    })
+
+                    response = jsonify({
+                        'status': 'success',
+                        'content': content
+                    })
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+    except Exception as e:
+        log_file_operation('read', filename, False, str(e))
+        logger.error("Error reading file: %s", e, exc_info=True)
         return jsonify({
             'status': 'error',
             'message': str(e)
@@ -71,154 +144,282 @@ def get_files():
 @log_request_context
 def get_file():
     """Get the content of a markdown file."""
+    filename = request.args.get('filename')
+    if not filename:
+        logger.warning("Get file request missing filename parameter")
+        return jsonify({
+            'status': 'error',
+            'message': 'Filename is required'
+        }), 400
+
+    return read_markdown_file(filename)
+
+
+@file_routes.route('/api/file/raw', methods=['GET'])
+@log_request_context
+def get_raw_file():
+    """Download a file from the markdown directory as raw bytes.
+
+    The file is handed to the WSGI server as a file object, which lets it use
+    sendfile, and Range requests are answered with partial content.
+    """
+    filename = request.args.get('filename')
+    if not filename:
+        logger.warning("Raw file request missing filename parameter")
+        return jsonify({
+            'status': 'error',
+            'message': 'Filename is required'
+        }), 400
+
     try:
-        filename = request.args.get('filename')
-        if not filename:
-            logger.warning("Get file request missing filename parameter")
-            return jsonify({
-                'status': 'error',
-                'message': 'Filename is required'
-            }), 400
-        
-        with LogContext(operation='read_file', filename=filename):
+        with LogContext(operation='download_file', filename=filename):
             markdown_dir = get_markdown_dir()
-            file_path = os.path.join(markdown_dir, filename)
-            
-            if not os.path.exists(file_path):
-                logger.warning(f"File not found: {filename}", extra={
-                    'context': {'file_path': file_path}
+            file_path = safe_join(markdown_dir, filename)
+            if file_path is None or not os.path.isfile(file_path):
+                logger.warning("File not found: %s", filename, context=lambda: {
+                    'file_path': file_path
                 })
                 return jsonify({
                     'status': 'error',
                     'message': f'File {filename} not found'
                 }), 404
-                
-            with open(file_path, 'r') as f:
-                content = f.read()
-                
-            # Log the operation
-            log_file_operation('read', filename, True)
-            file_size = os.path.getsize(file_path)
-            logger.info(f"Read file {filename}", extra={
-                'context': {'file_size': file_size, 'file_path': file_path}
-            })
-            
-            return jsonify({
-                'status': 'success',
-                'content': content
-            })
+
+            etag, _ = file_validators(os.stat(file_path))
+            download = request.args.get('download', 'false').lower() == 'true'
+            response = send_file(file_path, etag=etag, conditional=True,
+                                 as_attachment=download, max_age=None)
+            response.cache_control.no_cache = True
+
+            log_file_operation('download', filename, True)
+            return response
     except Exception as e:
-        log_file_operation('read', filename, False, str(e))
-        logger.error(f"Error reading file: {str(e)}", exc_info=True)
+        log_file_operation('download', filename, False, str(e))
+        logger.error("Error sending file: %s", e, exc_info=True)
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
 
 
-@file_routes.route('/api/file', methods=['POST'])
-@log_request_context
-def save_file():
-    """Save content to a markdown file."""
+def write_markdown_file(filename, content):
+    """Answer a request to save a markdown file.
+
+    The file is written atomically, the directory index and git status are
+    invalidated and a commit is queued.
+
+    Args:
+        filename (str): The file name relative to the markdown directory.
+        content (str): The new content of the file.
+
+    Returns:
+        The Flask response.
+    """
     try:
-        data = request.get_json()
-        filename = data.get('filename')
-        content = data.get('content')
-        
-        if not filename or content is None:
-            logger.warning("Save file request missing required parameters")
-            return jsonify({
-                'status': 'error',
-                'message': 'Filename and content are required'
-            }), 400
-        
         with LogContext(operation='write_file', filename=filename):
             markdown_dir = get_markdown_dir()
+            file_path = safe_join(markdown_dir, filename)
+            if file_path is None:
+                logger.warning("Invalid file name: %s", filename)
+                return jsonify({
+                    'status': 'error',
+                    'message': f'Invalid file name: {filename}'
+                }), 400
+
             if not os.path.exists(markdown_dir):
-                logger.info(f"Creating markdown directory: {markdown_dir}")
+                logger.info("Creating markdown directory: %s", markdown_dir)
                 os.makedirs(markdown_dir, exist_ok=True)
+            ensure_recovered(markdown_dir)
                 
-            file_path = os.path.join(markdown_dir, filename)
             is_new = not os.path.exists(file_path)
             
-            with open(file_path, 'w') as f:
-                f.write(content)
+            atomic_write(file_path, content)
+            invalidate_directory(os.path.dirname(file_path))
+            invalidate_status(markdown_dir)
+            commit_queued = queue_commit(markdown_dir, [file_path])
                 
             # Log the operation
             operation = 'create' if is_new else 'update'
             log_file_operation(operation, filename, True)
             content_size = len(content)
-            logger.info(f"{operation.capitalize()}d file {filename}", extra={
-                'context': {
-                    'file_path': file_path,
-                    'content_size': content_size,
-                    'is_new_file': is_new
-                }
+            logger.info("Created file %s" if is_new else "Updated file %s", filename, context=lambda: {
+                'file_path': file_path,
+                'content_size': content_size,
+                'is_new_file': is_new
             })
             
             return jsonify({
                 'status': 'success',
-                'message': f'File {filename} saved successfully'
+                'message': f'File {filename} saved successfully',
+                'commit_queued': commit_queued
             })
     except Exception as e:
         log_file_operation('write', filename, False, str(e))
-        logger.error(f"Error saving file: {str(e)}", exc_info=True)
+        logger.error("Error saving file: %s", e, exc_info=True)
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
 
 
-@file_routes.route('/api/file', methods=['DELETE'])
+@file_routes.route('/api/file', methods=['POST'])
 @log_request_context
-def delete_file():
-    """Delete a markdown file."""
+def save_file():
+    """Save content to a markdown file."""
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename')
+    content = data.get('content')
+    
+    if not filename or content is None:
+        logger.warning("Save file request missing required parameters")
+        return jsonify({
+            'status': 'error',
+            'message': 'Filename and content are required'
+        }), 400
+    
+    return write_markdown_file(filename, content)
+
+
+@file_routes.route('/api/files/batch', methods=['POST'])
+@log_request_context
+def save_files_batch():
+    """Save several markdown files in one request.
+
+    Expects JSON ``{"files": [{"filename": ..., "content": ...}], "atomic": false}``.
+    Each file is replaced atomically; with ``atomic`` the whole batch is
+    staged and either all files or none are updated after a crash.
+    """
     try:
-        filename = request.args.get('filename')
-        if not filename:
-            logger.warning("Delete file request missing filename parameter")
+        data = request.get_json(silent=True) or {}
+        files = data.get('files')
+        staged = bool(data.get('atomic', False))
+
+        if not isinstance(files, list) or not files:
+            logger.warning("Batch save request missing files")
             return jsonify({
                 'status': 'error',
-                'message': 'Filename is required'
+                'message': 'A non-empty list of files is required'
             }), 400
-        
+
+        with LogContext(operation='write_files_batch', file_count=len(files)):
+            markdown_dir = get_markdown_dir()
+            if not os.path.exists(markdown_dir):
+                logger.info("Creating markdown directory: %s", markdown_dir)
+                os.makedirs(markdown_dir, exist_ok=True)
+            ensure_recovered(markdown_dir)
+
+            writes = {}
+            for item in files:
+                filename = item.get('filename') if isinstance(item, dict) else None
+                content = item.get('content') if isinstance(item, dict) else None
+                file_path = safe_join(markdown_dir, filename) if filename else None
+                if file_path is None or not isinstance(content, str):
+                    return jsonify({
+                        'status': 'error',
+                        'message': f'Invalid batch entry: {filename or item!r}'
+                    }), 400
+                # The last entry wins when a file is listed twice
+                writes[file_path] = (filename, content)
+
+            for file_path in writes:
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+            created = set(write_batch(markdown_dir, [(path, content) for path, (_, content) in writes.items()],
+                                      staged=staged))
+            for directory in {os.path.dirname(path) for path in writes}:
+                invalidate_directory(directory)
+            invalidate_status(markdown_dir)
+            commit_queued = queue_commit(markdown_dir, list(writes))
+
+            results = []
+            for file_path, (filename, content) in writes.items():
+                is_new = file_path in created
+                log_file_operation('create' if is_new else 'update', filename, True)
+                results.append({'filename': filename, 'created': is_new, 'size': len(content)})
+
+            logger.info("Saved %s files in one batch", len(results), context=lambda: {
+                'file_count': len(results), 'atomic': staged
+            })
+
+            return jsonify({
+                'status': 'success',
+                'message': f'{len(results)} files saved successfully',
+                'files': results,
+                'commit_queued': commit_queued
+            })
+    except Exception as e:
+        log_file_operation('write', 'batch', False, str(e))
+        logger.error("Error saving files: %s", e, exc_info=True)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+def remove_markdown_file(filename):
+    """Answer a request to delete a markdown file.
+
+    Args:
+        filename (str): The file name relative to the markdown directory.
+
+    Returns:
+        The Flask response.
+    """
+    try:
         with LogContext(operation='delete_file', filename=filename):
             markdown_dir = get_markdown_dir()
-            file_path = os.path.join(markdown_dir, filename)
+            file_path = safe_join(markdown_dir, filename)
             
-            if not os.path.exists(file_path):
-                logger.warning(f"File not found for deletion: {filename}", extra={
-                    'context': {'file_path': file_path}
+            try:
+                if file_path is None:
+                    # The path escapes the markdown directory
+                    raise FileNotFoundError(filename)
+                stat_result = os.stat(file_path)
+            except FileNotFoundError:
+                logger.warning("File not found for deletion: %s", filename, context=lambda: {
+                    'file_path': file_path
                 })
                 return jsonify({
                     'status': 'error',
                     'message': f'File {filename} not found'
                 }), 404
             
-            # Get file info before deletion for logging
-            file_size = os.path.getsize(file_path)
-            file_mtime = os.path.getmtime(file_path)
-            
             os.remove(file_path)
+            invalidate_directory(os.path.dirname(file_path))
+            invalidate_status(markdown_dir)
+            commit_queued = queue_commit(markdown_dir, [file_path])
             
             # Log the operation
             log_file_operation('delete', filename, True)
-            logger.info(f"Deleted file {filename}", extra={
-                'context': {
-                    'file_path': file_path,
-                    'file_size': file_size,
-                    'last_modified': file_mtime
-                }
+            logger.info("Deleted file %s", filename, context=lambda: {
+                'file_path': file_path,
+                'file_size': stat_result.st_size,
+                'last_modified': stat_result.st_mtime
             })
             
             return jsonify({
                 'status': 'success',
-                'message': f'File {filename} deleted successfully'
+                'message': f'File {filename} deleted successfully',
+                'commit_queued': commit_queued
             })
     except Exception as e:
         log_file_operation('delete', filename, False, str(e))
-        logger.error(f"Error deleting file: {str(e)}", exc_info=True)
+        logger.error("Error deleting file: %s", e, exc_info=True)
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
+
+
+@file_routes.route('/api/file', methods=['DELETE'])
+@log_request_context
+def delete_file():
+    """Delete a markdown file."""
+    filename = request.args.get('filename')
+    if not filename:
+        logger.warning("Delete file request missing filename parameter")
+        return jsonify({
+            'status': 'error',
+            'message': 'Filename is required'
+        }), 400
+    
+    return remove_markdown_file(filename)
@@ -2,10 +2,16 @@ from flask import Blueprint, jsonify, request, current_app
 import os
 import sys
 import subprocess
-import json
+
+from apilama.fileio import exclude_state
+from apilama.git_engine import get_engine
 
 git_routes = Blueprint('git_routes', __name__)
 
+# Commits per page of /api/git/log without a limit; 0 returns the whole history
+DEFAULT_LOG_LIMIT = int(os.environ.get('APILAMA_GIT_LOG_LIMIT', 0))
+MAX_LOG_LIMIT = 1000
+
 
 def run_git_command(command, cwd=None):
     """Run a git command and return the result."""
@@ -46,30 +52,17 @@ def git_status():
                 'message': 'Not a git repository'
             }), 400
 
-        result = run_git_command(['git', 'status', '--porcelain'], cwd=markdown_dir)
-        if result['status'] == 'error':
-            return jsonify(result), 500
-
-        # Parse the status output
-        files = []
-        for line in result['output'].split('\n'):
-            if line.strip():
-                status = line[:2].strip()
-                filename = line[3:].strip()
-                files.append({
-                    'status': status,
-                    'filename': filename
-                })
+        files = get_engine(markdown_dir).cached_status()
 
         # Log the operation
-        current_app.logger.info(f"Git status: {len(files)} files with changes")
+        current_app.logger.info("Git status: %s files with changes", len(files))
 
         return jsonify({
             'status': 'success',
             'files': files
         })
     except Exception as e:
-        current_app.logger.error(f"Error getting git status: {str(e)}")
+        current_app.logger.error("Error getting git status: %s", e)
         return jsonify({
             'status': 'error',
             'message': str(e)
@@ -94,16 +87,17 @@ def git_init():
         result = run_git_command(['git', 'init'], cwd=markdown_dir)
         if result['status'] == 'error':
             return jsonify(result), 500
+        exclude_state(markdown_dir)
 
         # Log the operation
-        current_app.logger.info(f"Git repository initialized in {markdown_dir}")
+        current_app.logger.info("Git repository initialized in %s", markdown_dir)
 
         return jsonify({
             'status': 'success',
             'message': 'Git repository initialized'
         })
     except Exception as e:
-        current_app.logger.error(f"Error initializing git repository: {str(e)}")
+        current_app.logger.error("Error initializing git repository: %s", e)
         return jsonify({
             'status': 'error',
             'message': str(e)
@@ -131,31 +125,24 @@ def git_commit():
                 'message': 'Not a git repository'
             }), 400
 
-        # Add all changes
-        add_result = run_git_command(['git', 'add', '.'], cwd=markdown_dir)
-        if add_result['status'] == 'error':
-            return jsonify(add_result), 500
-
-        # Commit changes
-        commit_result = run_git_command(['git', 'commit', '-m', message], cwd=markdown_dir)
-        if commit_result['status'] == 'error':
-            # If there's nothing to commit, that's not an error
-            if 'nothing to commit' in commit_result['message']:
-                return jsonify({
-                    'status': 'success',
-                    'message': 'Nothing to commit'
-                })
-            return jsonify(commit_result), 500
+        # Stage all changes and commit them
+        commit = get_engine(markdown_dir).commit(message)
+        if commit is None:
+            return jsonify({
+                'status': 'success',
+                'message': 'Nothing to commit'
+            })
 
         # Log the operation
-        current_app.logger.info(f"Git commit: {message}")
+        current_app.logger.info("Git commit: %s", message)
 
         return jsonify({
             'status': 'success',
-            'message': 'Changes committed'
+            'message': 'Changes committed',
+            'commit': commit
         })
     except Exception as e:
-        current_app.logger.error(f"Error committing changes: {str(e)}")
+        current_app.logger.error("Error committing changes: %s", e)
         return jsonify({
             'status': 'error',
             'message': str(e)
@@ -164,8 +151,27 @@ def git_commit():
 
 @git_routes.route('/api/git/log', methods=['GET'])
 def git_log():
-    """Get the git log of the markdown directory."""
+    """Get a page of the git log of the markdown directory.
+
+    Query parameters: ``after`` (cursor, the ``next`` value of the previous
+    page), ``limit`` (commits per page) and ``path`` (only commits changing
+    this file or directory). Without ``limit`` the rest of the history is
+    returned, unless ``APILAMA_GIT_LOG_LIMIT`` sets a default page size.
+    """
     try:
+        if 'limit' in request.args:
+            try:
+                limit = int(request.args['limit'])
+            except ValueError:
+                limit = 0
+            if not 0 < limit <= MAX_LOG_LIMIT:
+                return jsonify({
+                    'status': 'error',
+                    'message': f'limit must be between 1 and {MAX_LOG_LIMIT}'
+                }), 400
+        else:
+            limit = DEFAULT_LOG_LIMIT or None
+
         markdown_dir = os.environ.get('MARKDOWN_DIR', './markdown')
         if not os.path.exists(markdown_dir):
             return jsonify({
@@ -180,33 +186,25 @@ def git_log():
                 'message': 'Not a git repository'
             }), 400
 
-        # Get the log in JSON format
-        result = run_git_command(
-            ['git', 'log', '--pretty=format:{"hash":"%h","author":"%an","date":"%ad","message":"%s"}', '--date=iso'],
-            cwd=markdown_dir
-        )
-        if result['status'] == 'error':
-            return jsonify(result), 500
-
-        # Parse the log output
-        commits = []
-        for line in result['output'].split('\n'):
-            if line.strip():
-                try:
-                    commit = json.loads(line)
-                    commits.append(commit)
-                except json.JSONDecodeError:
-                    pass
+        try:
+            commits, next_cursor = get_engine(markdown_dir).log(
+                after=request.args.get('after'), limit=limit, path=request.args.get('path'))
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
 
         # Log the operation
-        current_app.logger.info(f"Git log: {len(commits)} commits")
+        current_app.logger.info("Git log: %s commits", len(commits))
 
         return jsonify({
             'status': 'success',
-            'commits': commits
+            'commits': commits,
+            'next': next_cursor
         })
     except Exception as e:
-        current_app.logger.error(f"Error getting git log: {str(e)}")
+        current_app.logger.error("Error getting git log: %s", e)
         return jsonify({
             'status': 'error',
             'message': str(e)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Metrics API Routes
+
+This module provides Flask routes exposing the runtime metrics of APILama,
+such as the upstream connection pool occupancy.
+"""
+
+from flask import Blueprint, jsonify
+
+from apilama.metrics import collect_metrics, get_metrics_providers
+
+# Create a blueprint for metrics routes
+metrics_routes = Blueprint('metrics_routes', __name__)
+
+
+@metrics_routes.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Get the metrics of all registered providers.
+
+    Returns:
+        JSON response with the metrics keyed by provider name
+    """
+    return jsonify({
+        'status': 'success',
+        'metrics': collect_metrics()
+    })
+
+
+@metrics_routes.route('/api/metrics/<name>', methods=['GET'])
+def get_provider_metrics(name):
+    """Get the metrics of a single provider.
+
+    Args:
+        name: The name of the metrics provider, e.g. 'upstream'.
+
+    Returns:
+        JSON response with the metrics of the provider
+    """
+    if name not in get_metrics_providers():
+        return jsonify({
+            'status': 'error',
+            'message': f'Unknown metrics provider: {name}'
+        }), 404
+
+    return jsonify({
+        'status': 'success',
+        'metrics': collect_metrics(name)[name]
+    })
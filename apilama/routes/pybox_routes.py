@@ -7,8 +7,11 @@ BEXY API Routes
 This module provides Flask routes for interacting with the BEXY service.
 """
 
-from flask import Blueprint, request, jsonify, current_app
+import json
+import os
+from flask import Blueprint, Response, request, jsonify, current_app
 from apilama.logger import logger
+from apilama.sandbox import DEFAULT_BATCH_MAX_ITEMS, SandboxError, run_batch, run_snippet
 
 # Create a blueprint for BEXY routes
 bexy_routes = Blueprint('bexy_routes', __name__)
@@ -47,14 +50,85 @@ def execute_code():
         }), 400
     
     code = data['code']
-    logger.info(f'Executing code with BEXY')
+    logger.info('Executing code with BEXY')
     
-    # TODO: Implement actual code execution with BEXY
-    # This is a placeholder for the actual implementation
-    result = {
-        'status': 'success',
-        'output': f'Executed code in sandbox: {code[:50]}...' if len(code) > 50 else f'Executed code in sandbox: {code}',
-        'execution_time': 0.1
-    }
+    try:
+        result = run_snippet(code, data)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except SandboxError as e:
+        logger.error('Sandbox execution failed: %s', e)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
     
     return jsonify(result)
+
+
+@bexy_routes.route('/api/bexy/execute/batch', methods=['POST'])
+def execute_batch():
+    """Execute many snippets in parallel.
+    
+    The body holds ``items``, a list of execute requests (or plain code
+    strings), and optionally ``timeout`` for the whole batch and
+    ``item_timeout`` for items without their own timeout.
+    
+    Returns:
+        Newline-delimited JSON: one line per item as soon as it finishes,
+        with its ``index`` (and ``id`` if the item had one), then a summary
+        line with ``"done": true``
+    """
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    
+    if not isinstance(items, list) or not items:
+        logger.error('Invalid request: No items provided')
+        return jsonify({
+            'status': 'error',
+            'message': 'No items provided'
+        }), 400
+    
+    max_items = int(os.environ.get('APILAMA_SANDBOX_BATCH_MAX_ITEMS', DEFAULT_BATCH_MAX_ITEMS))
+    if len(items) > max_items:
+        return jsonify({
+            'status': 'error',
+            'message': f'Too many items (limit {max_items})'
+        }), 400
+    
+    items = [{'code': item} if isinstance(item, str) else item for item in items]
+    if not all(isinstance(item, dict) and 'code' in item for item in items):
+        return jsonify({
+            'status': 'error',
+            'message': 'Every item needs code'
+        }), 400
+    
+    try:
+        timeout = float(data['timeout']) if data.get('timeout') is not None else None
+        item_timeout = float(data['item_timeout']) if data.get('item_timeout') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid timeout'
+        }), 400
+    
+    logger.info('Executing a batch of %s snippets with BEXY', len(items))
+    
+    def generate():
+        counts = {'success': 0, 'error': 0, 'timed_out': 0}
+        for index, result in run_batch(items, timeout, item_timeout):
+            line = {'index': index}
+            if 'id' in items[index]:
+                line['id'] = items[index]['id']
+            line.update(result)
+            counts[result['status']] += 1
+            if result.get('timed_out'):
+                counts['timed_out'] += 1
+            yield json.dumps(line) + '\n'
+        yield json.dumps({'done': True, 'total': len(items), **counts}) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -9,6 +9,7 @@ This module provides Flask routes for interacting with the PyLama service.
 
 from flask import Blueprint, request, jsonify, current_app
 from apilama.logger import logger
+from apilama.sandbox import SandboxError, run_snippet
 
 # Create a blueprint for PyLama routes
 devlama_routes = Blueprint('devlama_routes', __name__)
@@ -47,14 +48,21 @@ def execute_code():
         }), 400
     
     code = data['code']
-    logger.info(f'Executing code with PyLama')
+    logger.info('Executing code with PyLama')
     
-    # TODO: Implement actual code execution with PyLama
-    # This is a placeholder for the actual implementation
-    result = {
-        'status': 'success',
-        'output': f'Executed code: {code[:50]}...' if len(code) > 50 else f'Executed code: {code}',
-        'execution_time': 0.1
-    }
+    try:
+        # Results are only cached when the request asks for it
+        result = run_snippet(code, data, cache=False)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except SandboxError as e:
+        logger.error('Sandbox execution failed: %s', e)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
     
     return jsonify(result)
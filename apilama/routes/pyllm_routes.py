@@ -7,8 +7,11 @@ PyLLM API Routes
 This module provides Flask routes for interacting with the PyLLM service.
 """
 
-from flask import Blueprint, request, jsonify, current_app
+import json
+import time
+from flask import Blueprint, Response, request, jsonify, current_app
 from apilama.logger import logger
+from apilama.llm import LLMError, get_backend, parse_generate_request
 
 # Create a blueprint for PyLLM routes
 getllm_routes = Blueprint('getllm_routes', __name__)
@@ -30,14 +33,104 @@ def health_check():
     })
 
 
+def wants_event_stream(data):
+    """Choose between Server-Sent Events and newline-delimited JSON.
+
+    Args:
+        data (dict): The JSON body of the request; its ``format`` field
+            ('sse' or 'ndjson') takes precedence over the Accept header.
+
+    Returns:
+        bool: Whether to stream Server-Sent Events.
+    """
+    output_format = data.get('format')
+    if output_format is None:
+        best = request.accept_mimetypes.best_match(['application/x-ndjson', 'text/event-stream'])
+        return best == 'text/event-stream'
+    return output_format == 'sse'
+
+
+def stream_generation(backend, params, sse, cache=None):
+    """Relay a streamed completion to the client.
+
+    Each token is sent as soon as the backend produced it. The next token is
+    only read from the backend once the previous one was handed to the
+    server, so a slow client slows the upstream read down instead of
+    buffering tokens; when the client goes away the server closes the
+    response and the upstream connection is closed with it.
+
+    Args:
+        backend (LLMBackend): The generation backend.
+        params (dict): The generation parameters.
+        sse (bool): Send Server-Sent Events instead of newline-delimited JSON.
+        cache (bool, optional): Whether a cached completion may be sent, in
+            a single token, and a complete stream may be cached.
+
+    Returns:
+        Response: The streaming response, or a JSON error if the backend
+        could not start the completion.
+    """
+    started = time.monotonic()
+    hit = backend.cached(params, cache)
+    try:
+        tokens = iter([hit['text']]) if hit is not None else backend.stream(params)
+    except LLMError as e:
+        logger.error('Streaming generation failed: %s', e)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 502
+
+    def encode(event, data):
+        if sse:
+            return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+        return json.dumps(data) + '\n'
+
+    def generate():
+        ttft = None
+        completed = failed = False
+        texts = []
+        try:
+            try:
+                for text in tokens:
+                    if ttft is None:
+                        ttft = time.monotonic() - started
+                    texts.append(text)
+                    yield encode('token', {'text': text})
+            except Exception as e:
+                logger.error('Streaming generation failed: %s', e)
+                failed = True
+                yield encode('error', {'status': 'error', 'message': str(e)})
+                return
+            if hit is None and backend.use_cache(params, cache):
+                backend.store(params, ''.join(texts))
+            yield encode('done', {'done': True, 'model': params['model'], 'chunks': len(texts),
+                                  'cached': hit is not None})
+            completed = True
+        finally:
+            if hasattr(tokens, 'close'):
+                tokens.close()
+            backend.record_stream(ttft, completed, failed)
+
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @getllm_routes.route('/api/getllm/generate', methods=['POST'])
 def generate_text():
     """Generate text using PyLLM.
     
+    With ``"stream": true`` the tokens are streamed as they are generated,
+    as Server-Sent Events or newline-delimited JSON (see ``wants_event_stream``).
+    
+    Deterministic requests (temperature 0) are answered from the generation
+    cache; ``"cache": true`` or ``false`` enables or disables it for any request.
+    
     Returns:
-        JSON response with the generated text
+        JSON response with the generated text, or the streamed tokens
     """
-    data = request.get_json()
+    data = request.get_json(silent=True)
     
     if not data or 'prompt' not in data:
         logger.error('Invalid request: No prompt provided')
@@ -46,20 +139,40 @@ def generate_text():
             'message': 'No prompt provided'
         }), 400
     
-    prompt = data['prompt']
-    model = data.get('model', 'default')
-    max_tokens = data.get('max_tokens', 100)
-    temperature = data.get('temperature', 0.7)
+    try:
+        params = parse_generate_request(data)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
     
-    logger.info(f'Generating text with PyLLM using model {model}')
+    logger.info("Generating text with PyLLM using model %s", params['model'])
     
-    # TODO: Implement actual text generation with PyLLM
-    # This is a placeholder for the actual implementation
-    result = {
-        'status': 'success',
-        'text': f'Generated text based on: {prompt[:50]}...' if len(prompt) > 50 else f'Generated text based on: {prompt}',
-        'model': model,
-        'tokens_used': len(prompt.split()) + 20  # Approximate token count
-    }
+    cache = data.get('cache')
+    if cache is not None and not isinstance(cache, bool):
+        return jsonify({
+            'status': 'error',
+            'message': 'cache must be true or false'
+        }), 400
+    
+    backend = get_backend()
+    if data.get('stream'):
+        return stream_generation(backend, params, wants_event_stream(data), cache)
+    
+    try:
+        result = backend.generate(params, cache)
+    except LLMError as e:
+        logger.error('Generation failed: %s', e)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 502
     
-    return jsonify(result)
+    return jsonify({
+        'status': 'success',
+        'text': result['text'],
+        'model': result['model'],
+        'tokens_used': result['tokens_used'],
+        'cached': result['cached']
+    })
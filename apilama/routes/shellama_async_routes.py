@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SheLLama Async API Routes
+
+This module provides the async counterparts of the SheLLama proxy routes in
+``shellama_routes``. They are served by the ASGI application in async mode
+and await upstream I/O instead of blocking a worker thread. Requests are
+validated and responses shaped by the ``*_call`` builders and the
+``ShellamaCall`` of ``shellama_routes``, so both flavours answer alike.
+"""
+
+from apilama.asgi import JSONResponse, StreamingResponse
+from apilama.logger import logger
+from apilama.routes import shellama_routes
+from apilama.upstream import get_async_client, STREAM_CHUNK_SIZE
+
+
+def _client():
+    client = get_async_client('shellama', shellama_routes.SHELLAMA_API_URL)
+    if client.health is None:
+        # Live async traffic feeds the same circuit breaker as the Flask routes
+        client.health = shellama_routes.shellama_monitor
+    return client
+
+
+async def forward(build_call, request):
+    """Answer a request by forwarding it to SheLLama.
+
+    Async version of ``shellama_routes.forward``.
+
+    Args:
+        build_call (callable): One of the ``shellama_routes.*_call`` builders.
+        request (AsyncRequest): The client request.
+
+    Returns:
+        JSONResponse or StreamingResponse: The response for the client.
+    """
+    if not shellama_routes.shellama_monitor.allow_request():
+        return JSONResponse(*shellama_routes.UNAVAILABLE)
+    try:
+        call = build_call(request.args, request.get_json)
+    except shellama_routes.InvalidRequest as e:
+        return JSONResponse(*shellama_routes.invalid_request(e))
+
+    try:
+        response = await _client().request(call.method, call.path, timeout=call.timeout,
+                                           stream=call.stream, **call.kwargs)
+        if call.stream:
+            if response.status_code == 200:
+                headers = {name: response.headers[name] for name in shellama_routes.PASSTHROUGH_HEADERS
+                           if name in response.headers}
+                headers.update(call.stream_headers())
+                return StreamingResponse(response.aiter_raw(STREAM_CHUNK_SIZE), response.status_code,
+                                         headers, on_close=response.aclose)
+            await response.aclose()
+
+        if response.status_code == 200:
+            return JSONResponse(call.success(response.json()))
+        return JSONResponse(*call.failure(response.status_code))
+    except Exception as e:
+        return JSONResponse(*call.error(e))
+
+
+def _route(build_call):
+    """Build the async handler of a proxy route."""
+    async def handler(request):
+        return await forward(build_call, request)
+    handler.__name__ = build_call.__name__.replace('_call', '')
+    return handler
+
+
+async def health_check(request):
+    """Async version of ``shellama_routes.health_check``."""
+    logger.info('SheLLama health check')
+
+    payload, status_code = shellama_routes.get_health_response()
+    return JSONResponse(payload, status_code)
+
+
+# (method, path, handler) table consumed by ``apilama.asgi.create_asgi_app``
+shellama_async_routes = [
+    ('GET', '/api/shellama/health', health_check),
+    ('GET', '/api/shellama/files', _route(shellama_routes.files_call)),
+    ('GET', '/api/shellama/file', _route(shellama_routes.file_content_call)),
+    ('POST', '/api/shellama/file', _route(shellama_routes.create_file_call)),
+    ('DELETE', '/api/shellama/file', _route(shellama_routes.delete_file_call)),
+    ('GET', '/api/shellama/directory', _route(shellama_routes.directories_call)),
+    ('POST', '/api/shellama/directory', _route(shellama_routes.create_directory_call)),
+    ('DELETE', '/api/shellama/directory', _route(shellama_routes.delete_directory_call)),
+    ('POST', '/api/shellama/shell', _route(shellama_routes.shell_call)),
+]
@@ -9,10 +9,13 @@ It proxies requests to the SheLLama REST API service.
 """
 
 import os
-import requests
 import json
-from flask import Blueprint, request, jsonify, current_app
+from urllib.parse import quote
+from flask import Blueprint, Response, request, jsonify, current_app
 from apilama.logger import logger
+from apilama.upstream import get_client, STREAM_CHUNK_SIZE
+from apilama.health import get_monitor
+from apilama import jobs
 
 # Create a blueprint for SheLLama routes
 shellama_routes = Blueprint('shellama_routes', __name__)
@@ -20,58 +23,344 @@ shellama_routes = Blueprint('shellama_routes', __name__)
 # Get SheLLama service URL from environment variable or use default
 SHELLAMA_API_URL = os.environ.get('SHELLAMA_API_URL', 'http://localhost:8002')
 
-# Function to check if SheLLama service is available
+# Shared, pooled client for all requests to the SheLLama service
+shellama_client = get_client('shellama', SHELLAMA_API_URL)
+
+# Background health monitor and circuit breaker for the SheLLama service
+shellama_monitor = get_monitor('shellama', shellama_client)
+
+
 def is_shellama_available():
-    try:
-        response = requests.get(f"{SHELLAMA_API_URL}/health", timeout=2)
-        return response.status_code == 200
-    except Exception as e:
-        logger.error(f"Error connecting to SheLLama service: {str(e)}")
-        return False
+    """Check whether the SheLLama service is available.
+
+    Reads the cached state of the health monitor and never blocks on a probe.
+    """
+    return shellama_monitor.is_available()
+
+
+# Upstream headers relayed unchanged by streaming passthrough responses
+PASSTHROUGH_HEADERS = ('Content-Type', 'Content-Length', 'Content-Encoding')
+
 
-# Check if SheLLama service is available
-SHELLAMA_AVAILABLE = is_shellama_available()
+def stream_upstream_response(response, headers=None):
+    """Relay an upstream response body to the client in bounded chunks.
+    
+    The body is passed through as raw bytes, without decoding, parsing or
+    re-serializing it, so memory stays bounded by the chunk size whatever
+    the size of the body. The upstream connection is released once the body
+    is sent or the client goes away.
+    
+    Args:
+        response (requests.Response): An upstream response requested with ``stream=True``.
+        headers (dict, optional): Extra headers for the client response.
+        
+    Returns:
+        Response: The streaming Flask response.
+    """
+    def generate():
+        try:
+            for chunk in response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+                yield chunk
+        finally:
+            response.close()
+    
+    response_headers = {name: response.headers[name] for name in PASSTHROUGH_HEADERS
+                        if name in response.headers}
+    response_headers.update(headers or {})
+    return Response(generate(), status=response.status_code, headers=response_headers,
+                    direct_passthrough=True)
+
+
+def get_health_response():
+    """Build the health check response from the cached monitor state.
+    
+    Returns:
+        tuple: The response payload and the HTTP status code.
+    """
+    health = shellama_monitor.status()
+    
+    if health['available'] and health['healthy']:
+        return {
+            'status': 'ok',
+            'service': 'shellama',
+            'available': True,
+            'circuit': health['circuit'],
+            'checked_at': health['checked_at'],
+            'details': health['details']
+        }, 200
+    
+    if health['error']:
+        message = health['error']
+    elif health['healthy'] is None:
+        message = 'SheLLama service has not been checked yet'
+    else:
+        message = 'SheLLama service circuit is open'
+    return {
+        'status': 'error',
+        'service': 'shellama',
+        'available': False,
+        'circuit': health['circuit'],
+        'checked_at': health['checked_at'],
+        'message': message
+    }, 502
 
 
 @shellama_routes.route('/api/shellama/health', methods=['GET'])
 def health_check():
     """Health check endpoint for SheLLama service.
     
+    Returns the cached state of the health monitor instead of probing the
+    SheLLama service on every request.
+    
     Returns:
         JSON response with the status of the SheLLama service
     """
     logger.info('SheLLama health check')
     
+    payload, status_code = get_health_response()
+    return jsonify(payload), status_code
+
+
+class InvalidRequest(ValueError):
+    """The client request cannot be forwarded to SheLLama."""
+
+
+class ShellamaCall:
+    """A request to forward to SheLLama and how its answer maps to ours.
+
+    The ``*_call`` builders below turn a client request into a call. They are
+    shared by the Flask routes of this module and the async routes of
+    ``shellama_async_routes``, so both validate requests, talk to SheLLama and
+    shape responses the same way; only the I/O differs.
+    """
+
+    def __init__(self, method, path, error_context, params=None, json=None, timeout=10,
+                 not_found=None, on_success=None, stream_name=None):
+        """Create the call.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path on the SheLLama service.
+            error_context (tuple): Message and arguments prefixing the log
+                message when the call fails, e.g. ``('Error reading file %s', name)``.
+            params (dict, optional): The query parameters.
+            json (dict, optional): The JSON body.
+            timeout (float, optional): Read timeout in seconds.
+            not_found (str, optional): Message returned when SheLLama answers 404.
+                Without it a 404 is reported as a 502 like any other status.
+            on_success (callable, optional): Post-processes the SheLLama payload.
+            stream_name (str, optional): Relay the body unparsed, announcing
+                this file name in ``X-File-Name``.
+        """
+        self.method = method
+        self.path = path
+        self.error_context = error_context
+        self.timeout = timeout
+        self.not_found = not_found
+        self.on_success = on_success
+        self.stream_name = stream_name
+        self.kwargs = {}
+        if params is not None:
+            self.kwargs['params'] = params
+        if json is not None:
+            self.kwargs['json'] = json
+
+    @property
+    def stream(self):
+        return self.stream_name is not None
+
+    def stream_headers(self):
+        """Get the extra headers of a relayed body."""
+        return {
+            'X-File-Name': quote(os.path.basename(self.stream_name)),
+            'Access-Control-Expose-Headers': 'X-File-Name'
+        }
+
+    def success(self, payload):
+        """Shape the payload of a successful SheLLama response."""
+        return self.on_success(payload) if self.on_success is not None else payload
+
+    def failure(self, status_code):
+        """Map a SheLLama error status to our response.
+
+        Returns:
+            tuple: The response payload and the HTTP status code.
+        """
+        if status_code == 404 and self.not_found is not None:
+            logger.error(self.not_found)
+            return {'status': 'error', 'message': self.not_found}, 404
+        error_message = f"SheLLama service returned status code {status_code}"
+        logger.error(error_message)
+        return {'status': 'error', 'message': error_message}, 502
+
+    def error(self, error):
+        """Map a failed call, e.g. a connection error, to our response.
+
+        Returns:
+            tuple: The response payload and the HTTP status code.
+        """
+        message, *args = self.error_context
+        logger.error(message + ': %s', *args, error)
+        return {'status': 'error', 'message': str(error)}, 500
+
+
+# Response when the circuit breaker keeps requests away from SheLLama
+UNAVAILABLE = ({'status': 'error', 'message': 'SheLLama service is not available'}, 503)
+
+
+def invalid_request(error):
+    """Build the response to a request failing validation."""
+    logger.error('Invalid request: %s', error)
+    return {'status': 'error', 'message': str(error)}, 400
+
+
+def files_call(args, get_json):
+    directory = args.get('directory', '.')
+    pattern = args.get('pattern', '*.*')
+    logger.info('Listing files in directory: %s with pattern: %s', directory, pattern)
+    return ShellamaCall('GET', '/files', ('Error listing files',),
+                        params={'directory': directory, 'pattern': pattern})
+
+
+def file_content_call(args, get_json):
+    filename = args.get('filename')
+    if not filename:
+        raise InvalidRequest('No filename provided')
+    stream = args.get('stream', 'false').lower() == 'true'
+    logger.info('Getting content of file: %s', filename)
+
+    def add_name(payload):
+        if 'name' not in payload and payload.get('status') == 'success':
+            payload['name'] = os.path.basename(filename)
+        return payload
+
+    return ShellamaCall('GET', '/file', ('Error reading file %s', filename), params={'filename': filename},
+                        not_found=f'File not found: {filename}', on_success=add_name,
+                        stream_name=filename if stream else None)
+
+
+def create_file_call(args, get_json):
+    data = get_json()
+    if not data:
+        raise InvalidRequest('No JSON data provided')
+    # Handle both 'path' and 'filename' for backward compatibility
+    filename = data.get('filename') or data.get('path')
+    content = data.get('content')
+    if not filename or content is None:
+        raise InvalidRequest('Missing required fields (filename/path, content)')
+    logger.info('Creating/updating file: %s', filename)
+
+    def add_path(payload):
+        # Add path for backward compatibility if not present
+        if 'path' not in payload and payload.get('status') == 'success':
+            payload['path'] = filename
+        return payload
+
+    return ShellamaCall('POST', '/file', ('Error writing file %s', filename),
+                        json={'filename': filename, 'content': content}, on_success=add_path)
+
+
+def delete_file_call(args, get_json):
+    filename = args.get('filename')
+    if not filename:
+        raise InvalidRequest('No filename provided')
+    logger.info('Deleting file: %s', filename)
+    return ShellamaCall('DELETE', '/file', ('Error deleting file %s', filename), params={'filename': filename},
+                        not_found=f'File not found: {filename}')
+
+
+def directories_call(args, get_json):
+    directory = args.get('directory', '.')
+    logger.info('Listing directories in: %s', directory)
+    return ShellamaCall('GET', '/directories', ('Error listing directories in %s', directory),
+                        params={'directory': directory}, not_found=f'Directory not found: {directory}')
+
+
+def create_directory_call(args, get_json):
+    data = get_json()
+    if not data:
+        raise InvalidRequest('No JSON data provided')
+    # Get path from either 'path' or 'directory' field
+    path = data.get('path') or data.get('directory')
+    if not path:
+        raise InvalidRequest('Missing required field (path or directory)')
+    logger.info('Creating directory: %s', path)
+
+    def add_path(payload):
+        if 'path' not in payload and payload.get('status') == 'success':
+            payload['path'] = path
+        return payload
+
+    return ShellamaCall('POST', '/directory', ('Error creating directory %s', path),
+                        json={'directory': path}, on_success=add_path)
+
+
+def delete_directory_call(args, get_json):
+    directory = args.get('directory')
+    recursive = args.get('recursive', 'false').lower() == 'true'
+    if not directory:
+        raise InvalidRequest('No directory provided')
+    logger.info('Deleting directory: %s (recursive=%s)', directory, recursive)
+    return ShellamaCall('DELETE', '/directory', ('Error deleting directory %s', directory),
+                        params={'directory': directory, 'recursive': str(recursive).lower()},
+                        not_found=f'Directory not found: {directory}')
+
+
+def shell_call(args, get_json):
+    data = get_json()
+    if not data or 'command' not in data:
+        raise InvalidRequest('Missing required field (command)')
+    command = data['command']
+    logger.info('Executing shell command: %s', command)
+
+    request_data = {
+        'command': command,
+        'shell': data.get('shell', False)
+    }
+    # Add optional parameters if they exist
+    if data.get('cwd') is not None:
+        request_data['cwd'] = data['cwd']
+    if data.get('timeout') is not None:
+        request_data['timeout'] = data['timeout']
+
+    # Longer timeout for shell commands
+    return ShellamaCall('POST', '/shell', ('Error executing shell command %s', command),
+                        json=request_data, timeout=30)
+
+
+def forward(build_call):
+    """Answer the current request by forwarding it to SheLLama.
+
+    Args:
+        build_call (callable): One of the ``*_call`` builders.
+
+    Returns:
+        The Flask response.
+    """
+    if not shellama_monitor.allow_request():
+        payload, status_code = UNAVAILABLE
+        return jsonify(payload), status_code
     try:
-        # Forward the request to the SheLLama service
-        response = requests.get(f"{SHELLAMA_API_URL}/health", timeout=5)
-        
+        call = build_call(request.args, request.get_json)
+    except InvalidRequest as e:
+        payload, status_code = invalid_request(e)
+        return jsonify(payload), status_code
+
+    try:
+        response = shellama_client.request(call.method, call.path, timeout=call.timeout,
+                                           stream=call.stream, **call.kwargs)
+        if call.stream:
+            if response.status_code == 200:
+                return stream_upstream_response(response, call.stream_headers())
+            # Error bodies are not relayed, release the connection right away
+            response.close()
+
         if response.status_code == 200:
-            # Return the SheLLama service response
-            shellama_response = response.json()
-            return jsonify({
-                'status': 'ok',
-                'service': 'shellama',
-                'available': True,
-                'details': shellama_response
-            })
-        else:
-            # Return error if SheLLama service returns non-200 status code
-            return jsonify({
-                'status': 'error',
-                'service': 'shellama',
-                'available': False,
-                'message': f"SheLLama service returned status code {response.status_code}"
-            }), 502
+            return jsonify(call.success(response.json()))
+        payload, status_code = call.failure(response.status_code)
     except Exception as e:
-        # Return error if SheLLama service is unavailable
-        logger.error(f"Error connecting to SheLLama service: {str(e)}")
-        return jsonify({
-            'status': 'error',
-            'service': 'shellama',
-            'available': False,
-            'message': f"Error connecting to SheLLama service: {str(e)}"
-        }), 502
+        payload, status_code = call.error(e)
+    return jsonify(payload), status_code
 
 
 @shellama_routes.route('/api/shellama/files', methods=['GET'])
@@ -81,109 +370,22 @@ def get_files():
     Returns:
         JSON response with a list of files
     """
-    # Check if SheLLama is available
-    if not SHELLAMA_AVAILABLE:
-        return jsonify({
-            'status': 'error',
-            'message': 'SheLLama service is not available'
-        }), 503
-    
-    # Get the directory path and pattern from the query parameters
-    directory = request.args.get('directory', '.')
-    pattern = request.args.get('pattern', '*.*')
-    
-    logger.info(f'Listing files in directory: {directory} with pattern: {pattern}')
-    
-    try:
-        # Forward the request to the SheLLama service
-        response = requests.get(
-            f"{SHELLAMA_API_URL}/files",
-            params={'directory': directory, 'pattern': pattern},
-            timeout=10
-        )
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Return the SheLLama service response
-            return jsonify(response.json())
-        else:
-            # Return error if SheLLama service returns non-200 status code
-            error_message = f"SheLLama service returned status code {response.status_code}"
-            logger.error(error_message)
-            return jsonify({
-                'status': 'error',
-                'message': error_message
-            }), 502
-    except Exception as e:
-        logger.error(f'Error listing files: {str(e)}')
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return forward(files_call)
 
 
 @shellama_routes.route('/api/shellama/file', methods=['GET'])
 def get_file_content():
     """Get the content of a file.
     
+    With ``stream=true`` the SheLLama response body is piped through to the
+    client in chunks instead of being parsed and re-serialized, and the file
+    name is sent in the ``X-File-Name`` header (percent-encoded) instead of
+    being injected into the body.
+    
     Returns:
         JSON response with the file content
     """
-    # Check if SheLLama is available
-    if not SHELLAMA_AVAILABLE:
-        return jsonify({
-            'status': 'error',
-            'message': 'SheLLama service is not available'
-        }), 503
-    
-    # Get the filename from the query parameters
-    filename = request.args.get('filename')
-    
-    if not filename:
-        logger.error('Invalid request: No filename provided')
-        return jsonify({
-            'status': 'error',
-            'message': 'No filename provided'
-        }), 400
-    
-    logger.info(f'Getting content of file: {filename}')
-    
-    try:
-        # Forward the request to the SheLLama service
-        response = requests.get(
-            f"{SHELLAMA_API_URL}/file",
-            params={'filename': filename},
-            timeout=10
-        )
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Return the SheLLama service response with the filename added
-            shellama_response = response.json()
-            if 'name' not in shellama_response and shellama_response.get('status') == 'success':
-                shellama_response['name'] = os.path.basename(filename)
-            return jsonify(shellama_response)
-        elif response.status_code == 404:
-            # File not found
-            logger.error(f'File not found: {filename}')
-            return jsonify({
-                'status': 'error',
-                'message': f'File not found: {filename}'
-            }), 404
-        else:
-            # Return error if SheLLama service returns other non-200 status code
-            error_message = f"SheLLama service returned status code {response.status_code}"
-            logger.error(error_message)
-            return jsonify({
-                'status': 'error',
-                'message': error_message
-            }), 502
-    except Exception as e:
-        logger.error(f'Error reading file {filename}: {str(e)}')
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return forward(file_content_call)
 
 
 @shellama_routes.route('/api/shellama/file', methods=['POST'])
@@ -193,69 +395,7 @@ def create_file():
     Returns:
         JSON response with the result
     """
-    # Check if SheLLama is available
-    if not SHELLAMA_AVAILABLE:
-        return jsonify({
-            'status': 'error',
-            'message': 'SheLLama service is not available'
-        }), 503
-    
-    data = request.get_json()
-    
-    # Adapt to both API formats - support both 'path' and 'filename' fields for compatibility
-    if not data:
-        logger.error('Invalid request: No JSON data provided')
-        return jsonify({
-            'status': 'error',
-            'message': 'No JSON data provided'
-        }), 400
-    
-    # Handle both 'path' and 'filename' for backward compatibility
-    filename = data.get('filename') or data.get('path')
-    content = data.get('content')
-    
-    if not filename or content is None:
-        logger.error('Invalid request: Missing required fields')
-        return jsonify({
-            'status': 'error',
-            'message': 'Missing required fields (filename/path, content)'
-        }), 400
-    
-    logger.info(f'Creating/updating file: {filename}')
-    
-    try:
-        # Forward the request to the SheLLama service
-        response = requests.post(
-            f"{SHELLAMA_API_URL}/file",
-            json={
-                'filename': filename,
-                'content': content
-            },
-            timeout=10
-        )
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Return the SheLLama service response
-            shellama_response = response.json()
-            # Add path for backward compatibility if not present
-            if 'path' not in shellama_response and shellama_response.get('status') == 'success':
-                shellama_response['path'] = filename
-            return jsonify(shellama_response)
-        else:
-            # Return error if SheLLama service returns non-200 status code
-            error_message = f"SheLLama service returned status code {response.status_code}"
-            logger.error(error_message)
-            return jsonify({
-                'status': 'error',
-                'message': error_message
-            }), 502
-    except Exception as e:
-        logger.error(f'Error writing file {filename}: {str(e)}')
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return forward(create_file_call)
 
 
 @shellama_routes.route('/api/shellama/file', methods=['DELETE'])
@@ -265,58 +405,7 @@ def delete_file():
     Returns:
         JSON response with the result
     """
-    # Check if SheLLama is available
-    if not SHELLAMA_AVAILABLE:
-        return jsonify({
-            'status': 'error',
-            'message': 'SheLLama service is not available'
-        }), 503
-    
-    # Get the filename from the query parameters
-    filename = request.args.get('filename')
-    
-    if not filename:
-        logger.error('Invalid request: No filename provided')
-        return jsonify({
-            'status': 'error',
-            'message': 'No filename provided'
-        }), 400
-    
-    logger.info(f'Deleting file: {filename}')
-    
-    try:
-        # Forward the request to the SheLLama service
-        response = requests.delete(
-            f"{SHELLAMA_API_URL}/file",
-            params={'filename': filename},
-            timeout=10
-        )
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Return the SheLLama service response
-            return jsonify(response.json())
-        elif response.status_code == 404:
-            # File not found
-            logger.error(f'File not found: {filename}')
-            return jsonify({
-                'status': 'error',
-                'message': f'File not found: {filename}'
-            }), 404
-        else:
-            # Return error if SheLLama service returns other non-200 status code
-            error_message = f"SheLLama service returned status code {response.status_code}"
-            logger.error(error_message)
-            return jsonify({
-                'status': 'error',
-                'message': error_message
-            }), 502
-    except Exception as e:
-        logger.error(f'Error deleting file {filename}: {str(e)}')
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return forward(delete_file_call)
 
 
 @shellama_routes.route('/api/shellama/directory', methods=['GET'])
@@ -326,51 +415,7 @@ def get_directories():
     Returns:
         JSON response with a list of directories
     """
-    # Check if SheLLama is available
-    if not SHELLAMA_AVAILABLE:
-        return jsonify({
-            'status': 'error',
-            'message': 'SheLLama service is not available'
-        }), 503
-    
-    # Get the directory path from the query parameters
-    directory = request.args.get('directory', '.')
-    
-    logger.info(f'Listing directories in: {directory}')
-    
-    try:
-        # Forward the request to the SheLLama service
-        response = requests.get(
-            f"{SHELLAMA_API_URL}/directories",
-            params={'directory': directory},
-            timeout=10
-        )
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Return the SheLLama service response
-            return jsonify(response.json())
-        elif response.status_code == 404:
-            # Directory not found
-            logger.error(f'Directory not found: {directory}')
-            return jsonify({
-                'status': 'error',
-                'message': f'Directory not found: {directory}'
-            }), 404
-        else:
-            # Return error if SheLLama service returns other non-200 status code
-            error_message = f"SheLLama service returned status code {response.status_code}"
-            logger.error(error_message)
-            return jsonify({
-                'status': 'error',
-                'message': error_message
-            }), 502
-    except Exception as e:
-        logger.error(f'Error listing directories in {directory}: {str(e)}')
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return forward(directories_call)
 
 
 @shellama_routes.route('/api/shellama/directory', methods=['POST'])
@@ -380,65 +425,7 @@ def create_directory():
     Returns:
         JSON response with the result
     """
-    # Check if SheLLama is available
-    if not SHELLAMA_AVAILABLE:
-        return jsonify({
-            'status': 'error',
-            'message': 'SheLLama service is not available'
-        }), 503
-    
-    data = request.get_json()
-    
-    # Handle both 'path' and 'directory' for backward compatibility
-    if not data:
-        logger.error('Invalid request: No JSON data provided')
-        return jsonify({
-            'status': 'error',
-            'message': 'No JSON data provided'
-        }), 400
-    
-    # Get path from either 'path' or 'directory' field
-    path = data.get('path') or data.get('directory')
-    
-    if not path:
-        logger.error('Invalid request: Missing required fields')
-        return jsonify({
-            'status': 'error',
-            'message': 'Missing required field (path or directory)'
-        }), 400
-    
-    logger.info(f'Creating directory: {path}')
-    
-    try:
-        # Forward the request to the SheLLama service
-        response = requests.post(
-            f"{SHELLAMA_API_URL}/directory",
-            json={'directory': path},
-            timeout=10
-        )
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Return the SheLLama service response
-            shellama_response = response.json()
-            # Add path for backward compatibility if not present
-            if 'path' not in shellama_response and shellama_response.get('status') == 'success':
-                shellama_response['path'] = path
-            return jsonify(shellama_response)
-        else:
-            # Return error if SheLLama service returns non-200 status code
-            error_message = f"SheLLama service returned status code {response.status_code}"
-            logger.error(error_message)
-            return jsonify({
-                'status': 'error',
-                'message': error_message
-            }), 502
-    except Exception as e:
-        logger.error(f'Error creating directory {path}: {str(e)}')
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return forward(create_directory_call)
 
 
 @shellama_routes.route('/api/shellama/directory', methods=['DELETE'])
@@ -448,62 +435,7 @@ def delete_directory():
     Returns:
         JSON response with the result
     """
-    # Check if SheLLama is available
-    if not SHELLAMA_AVAILABLE:
-        return jsonify({
-            'status': 'error',
-            'message': 'SheLLama service is not available'
-        }), 503
-    
-    # Get the directory path and recursive flag from the query parameters
-    directory = request.args.get('directory')
-    recursive = request.args.get('recursive', 'false').lower() == 'true'
-    
-    if not directory:
-        logger.error('Invalid request: No directory provided')
-        return jsonify({
-            'status': 'error',
-            'message': 'No directory provided'
-        }), 400
-    
-    logger.info(f'Deleting directory: {directory} (recursive={recursive})')
-    
-    try:
-        # Forward the request to the SheLLama service
-        response = requests.delete(
-            f"{SHELLAMA_API_URL}/directory",
-            params={
-                'directory': directory,
-                'recursive': str(recursive).lower()
-            },
-            timeout=10
-        )
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Return the SheLLama service response
-            return jsonify(response.json())
-        elif response.status_code == 404:
-            # Directory not found
-            logger.error(f'Directory not found: {directory}')
-            return jsonify({
-                'status': 'error',
-                'message': f'Directory not found: {directory}'
-            }), 404
-        else:
-            # Return error if SheLLama service returns other non-200 status code
-            error_message = f"SheLLama service returned status code {response.status_code}"
-            logger.error(error_message)
-            return jsonify({
-                'status': 'error',
-                'message': error_message
-            }), 502
-    except Exception as e:
-        logger.error(f'Error deleting directory {directory}: {str(e)}')
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    return forward(delete_directory_call)
 
 
 @shellama_routes.route('/api/shellama/shell', methods=['POST'])
@@ -513,63 +445,256 @@ def execute_shell_command():
     Returns:
         JSON response with the command execution result
     """
-    # Check if SheLLama is available
-    if not SHELLAMA_AVAILABLE:
+    return forward(shell_call)
+
+
+# Seconds between keep-alive comments on an idle job stream
+JOB_STREAM_HEARTBEAT = 15.0
+
+# Extra seconds the SheLLama request may take beyond the job timeout
+JOB_REQUEST_GRACE = 30.0
+
+
+def run_job_on_shellama(job):
+    """Run a job through the SheLLama ``/shell`` endpoint.
+
+    SheLLama answers once the command has finished, so the output arrives as
+    a whole; a cancelled job drops the result when it comes back.
+    """
+    request_data = {'command': job.command, 'shell': job.shell, 'timeout': job.timeout}
+    if job.cwd is not None:
+        request_data['cwd'] = job.cwd
+    response = shellama_client.post('/shell', json=request_data,
+                                    timeout=job.timeout + JOB_REQUEST_GRACE)
+    if job.cancel_requested:
+        job.finish(jobs.CANCELLED)
+        return
+    if response.status_code != 200:
+        job.finish(jobs.FAILED, error=f'SheLLama service returned status code {response.status_code}')
+        return
+
+    result = response.json()
+    job.append_output('stdout', result.get('stdout') or result.get('output') or '')
+    job.append_output('stderr', result.get('stderr') or '')
+    exit_code = result.get('exit_code', result.get('returncode'))
+    if exit_code is None:
+        exit_code = 0 if result.get('status') == 'success' else 1
+    job.finish(jobs.SUCCEEDED if exit_code == 0 else jobs.FAILED, exit_code, result.get('error'))
+
+
+def get_job_manager():
+    """Get the job manager of the SheLLama routes.
+
+    ``APILAMA_JOBS_EXECUTOR=local`` runs the jobs as processes of APILama,
+    with incremental output and cancellation, instead of through SheLLama.
+    """
+    if os.environ.get('APILAMA_JOBS_EXECUTOR', 'shellama').lower() == 'local':
+        return jobs.get_job_manager('shellama-local', jobs.run_local)
+    return jobs.get_job_manager('shellama', run_job_on_shellama)
+
+
+def get_tenant():
+    """Identify the tenant of the request for job ownership and limits.
+
+    The tenant is the client address. The ``X-Tenant-Id`` header is only
+    honoured with ``APILAMA_TRUST_TENANT_HEADER=true``, for deployments behind
+    a proxy that authenticates clients and sets the header itself; otherwise
+    any client could escape its limits by changing the header.
+    """
+    if os.environ.get('APILAMA_TRUST_TENANT_HEADER', 'false').lower() == 'true':
+        tenant = request.headers.get('X-Tenant-Id')
+        if tenant:
+            return tenant
+    return request.remote_addr or 'default'
+
+
+def job_not_found(job_id):
+    return jsonify({
+        'status': 'error',
+        'message': f'Job not found: {job_id}'
+    }), 404
+
+
+@shellama_routes.route('/api/shellama/jobs', methods=['POST'])
+def submit_job():
+    """Start a shell command as a background job.
+    
+    With the default SheLLama executor the output arrives only when the
+    command has finished; ``APILAMA_JOBS_EXECUTOR=local`` streams it.
+    
+    Returns:
+        JSON response with the queued job
+    """
+    local = os.environ.get('APILAMA_JOBS_EXECUTOR', 'shellama').lower() == 'local'
+    if not local and not shellama_monitor.allow_request():
         return jsonify({
             'status': 'error',
             'message': 'SheLLama service is not available'
         }), 503
     
-    data = request.get_json()
+    data = request.get_json(silent=True)
     
-    if not data or 'command' not in data:
+    if not data or not data.get('command'):
         logger.error('Invalid request: Missing required fields')
         return jsonify({
             'status': 'error',
             'message': 'Missing required field (command)'
         }), 400
     
-    command = data['command']
-    cwd = data.get('cwd')
-    timeout = data.get('timeout')
-    use_shell = data.get('shell', False)
-    
-    logger.info(f'Executing shell command: {command}')
+    try:
+        timeout = float(data['timeout']) if data.get('timeout') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid timeout'
+        }), 400
     
     try:
-        # Forward the request to the SheLLama service
-        request_data = {
-            'command': command,
-            'shell': use_shell
-        }
-        
-        # Add optional parameters if they exist
-        if cwd is not None:
-            request_data['cwd'] = cwd
-        if timeout is not None:
-            request_data['timeout'] = timeout
-        
-        response = requests.post(
-            f"{SHELLAMA_API_URL}/shell",
-            json=request_data,
-            timeout=30  # Longer timeout for shell commands
-        )
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Return the SheLLama service response
-            return jsonify(response.json())
-        else:
-            # Return error if SheLLama service returns non-200 status code
-            error_message = f"SheLLama service returned status code {response.status_code}"
-            logger.error(error_message)
-            return jsonify({
-                'status': 'error',
-                'message': error_message
-            }), 502
-    except Exception as e:
-        logger.error(f'Error executing shell command {command}: {str(e)}')
+        job = get_job_manager().submit(get_tenant(), data['command'], cwd=data.get('cwd'),
+                                       shell=bool(data.get('shell', False)), timeout=timeout)
+    except jobs.JobLimitError as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
-        }), 500
+        }), 429
+    
+    return jsonify({
+        'status': 'success',
+        'job': job.to_dict()
+    }), 202, {'Location': f'/api/shellama/jobs/{job.id}'}
+
+
+@shellama_routes.route('/api/shellama/jobs', methods=['GET'])
+def list_jobs():
+    """List the jobs of the tenant, newest first.
+    
+    Returns:
+        JSON response with the jobs
+    """
+    return jsonify({
+        'status': 'success',
+        'jobs': [job.to_dict() for job in get_job_manager().list(get_tenant())]
+    })
+
+
+@shellama_routes.route('/api/shellama/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the state of a job.
+    
+    Returns:
+        JSON response with the job
+    """
+    job = get_job_manager().get(job_id, get_tenant())
+    if job is None:
+        return job_not_found(job_id)
+    return jsonify({
+        'status': 'success',
+        'job': job.to_dict()
+    })
+
+
+@shellama_routes.route('/api/shellama/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a job.
+    
+    A queued job is cancelled at once. A running local job is stopped with
+    its process group. SheLLama cannot stop a command it is running, so a job
+    on the SheLLama executor only gets ``cancel_requested`` and stays
+    ``running`` until the remote command has finished; it is then reported
+    ``cancelled`` and its output is dropped.
+    
+    Returns:
+        JSON response with the job
+    """
+    job = get_job_manager().get(job_id, get_tenant())
+    if job is None:
+        return job_not_found(job_id)
+    job.cancel()
+    logger.info('Cancelled job %s', job_id)
+    return jsonify({
+        'status': 'success',
+        'job': job.to_dict()
+    })
+
+
+@shellama_routes.route('/api/shellama/jobs/<job_id>/output', methods=['GET'])
+def get_job_output(job_id):
+    """Get the output of a job.
+    
+    Query Parameters:
+        since (int, optional): First output chunk to return, the ``next`` value
+            of the previous call.
+    
+    Returns:
+        JSON response with the output chunks kept since the position
+    """
+    job = get_job_manager().get(job_id, get_tenant())
+    if job is None:
+        return job_not_found(job_id)
+    since = request.args.get('since', 0, type=int)
+    chunks, next_seq, truncated = job.read_output(since)
+    return jsonify({
+        'status': 'success',
+        'state': job.state,
+        'output': chunks,
+        'next': next_seq,
+        'truncated': truncated
+    })
+
+
+@shellama_routes.route('/api/shellama/jobs/<job_id>/stream', methods=['GET'])
+def stream_job_output(job_id):
+    """Follow the output of a job until it finishes.
+    
+    Sends Server-Sent Events (``output`` events with the chunk number as id,
+    then an ``end`` event) if the client accepts ``text/event-stream`` or asks
+    for ``format=sse``, and newline-delimited JSON otherwise. A reconnecting
+    SSE client resumes after its ``Last-Event-ID``. With the SheLLama
+    executor the whole output comes in one piece when the command finishes.
+    
+    Returns:
+        Streaming response with the output
+    """
+    job = get_job_manager().get(job_id, get_tenant())
+    if job is None:
+        return job_not_found(job_id)
+    
+    output_format = request.args.get('format')
+    if output_format is None:
+        best = request.accept_mimetypes.best_match(['application/x-ndjson', 'text/event-stream'])
+        output_format = 'sse' if best == 'text/event-stream' else 'ndjson'
+    since = request.args.get('since', 0, type=int)
+    if 'Last-Event-ID' in request.headers:
+        try:
+            since = int(request.headers['Last-Event-ID']) + 1
+        except ValueError:
+            pass
+    sse = output_format == 'sse'
+    
+    def encode(event, data, event_id=None):
+        if not sse:
+            return json.dumps(data) + '\n'
+        prefix = f'id: {event_id}\n' if event_id is not None else ''
+        return f'{prefix}event: {event}\ndata: {json.dumps(data)}\n\n'
+    
+    def generate():
+        position = since
+        while True:
+            # All output is in before the job is marked as finished
+            finished = job.finished
+            chunks, next_seq, truncated = job.read_output(position, wait=None if finished else JOB_STREAM_HEARTBEAT)
+            if truncated:
+                yield encode('truncated', {'truncated': True, 'next': chunks[0]['seq'] if chunks else next_seq})
+            for chunk in chunks:
+                yield encode('output', chunk, chunk['seq'])
+            position = next_seq
+            if finished:
+                yield encode('end', {'end': job.to_dict()})
+                return
+            if not chunks and not job.finished:
+                # Keeps proxies from closing an idle stream
+                yield ':\n\n' if sse else '\n'
+    
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -42,9 +42,9 @@ def get_markdown_files():
     """
     log_api_call('get_markdown_files', 'weblama')
     
-    # This endpoint will now delegate to the SheLLama service
-    # via the shellama_routes module
-    from apilama.routes.shellama_routes import get_files
+    # Served from the local directory index, which avoids a round trip to
+    # SheLLama and answers unchanged listings with a 304
+    from apilama.routes.file_routes import get_files
     return get_files()
 
 
@@ -61,10 +61,10 @@ def get_markdown_content(filename):
     """
     log_api_call('get_markdown_content', filename)
     
-    # This endpoint will now delegate to the SheLLama service
-    # via the shellama_routes module
-    from apilama.routes.shellama_routes import get_file_content
-    return get_file_content(filename)
+    # Served locally with ETag / Last-Modified validation, so editors polling
+    # an unchanged file get a 304 without the file being read
+    from apilama.routes.file_routes import read_markdown_file
+    return read_markdown_file(filename)
 
 
 @weblama_routes.route('/api/weblama/markdown/<path:filename>', methods=['POST'])
@@ -80,10 +80,18 @@ def save_markdown_content(filename):
     """
     log_api_call('save_markdown_content', filename)
     
-    # This endpoint will now delegate to the SheLLama service
-    # via the shellama_routes module
-    from apilama.routes.shellama_routes import create_file
-    return create_file()
+    # Written to the local directory the reads are served from, so a save is
+    # seen by the next listing and content request
+    data = request.get_json(silent=True) or {}
+    content = data.get('content')
+    if content is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Content is required'
+        }), 400
+    
+    from apilama.routes.file_routes import write_markdown_file
+    return write_markdown_file(filename, content)
 
 
 @weblama_routes.route('/api/weblama/markdown/<path:filename>', methods=['DELETE'])
@@ -99,7 +107,6 @@ def delete_markdown_file(filename):
     """
     log_api_call('delete_markdown_file', filename)
     
-    # This endpoint will now delegate to the SheLLama service
-    # via the shellama_routes module
-    from apilama.routes.shellama_routes import delete_file
-    return delete_file()
+    # Deleted from the local directory the reads are served from
+    from apilama.routes.file_routes import remove_markdown_file
+    return remove_markdown_file(filename)
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Sandbox
+
+This module provides the execution engine behind the BEXY and PyLama
+execute routes.
+
+Python snippets run in single-use worker processes with resource limits on
+CPU time, memory, open files and output size, and a wall-clock timeout. A
+pool keeps a few workers started ahead of time, so a request does not wait
+for an interpreter to start; a background thread replaces every worker that
+is handed out.
+
+The limits guard the gateway against runaway snippets. They are not an
+isolation boundary: the code runs as the APILama user.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from apilama.cache import DiskLRUCache
+from apilama.logger import logger
+from apilama.metrics import register_metrics_provider
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sandbox_worker.py')
+
+# Default settings, used when no environment variable overrides them
+DEFAULT_POOL_SIZE = 4
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_CPU_SECONDS = 10
+DEFAULT_MEMORY_MB = 256
+DEFAULT_MAX_FILES = 64
+DEFAULT_OUTPUT_LIMIT = 1024 * 1024
+# One private directory per user, see DiskLRUCache
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), f'apilama-sandbox-cache-{os.geteuid()}')
+DEFAULT_CACHE_MB = 64
+DEFAULT_BATCH_MAX_ITEMS = 1000
+
+# Environment of the workers; nothing from the APILama environment leaks in
+WORKER_ENV = {'PATH': '/usr/local/bin:/usr/bin:/bin', 'LANG': 'C.UTF-8', 'PYTHONIOENCODING': 'utf-8'}
+
+
+class SandboxError(Exception):
+    """A worker could not be started."""
+
+
+class _Worker:
+    """A started worker process waiting for its code."""
+
+    def __init__(self, python):
+        self.workdir = tempfile.mkdtemp(prefix='apilama-sandbox-')
+        self.stdout = tempfile.TemporaryFile(dir=self.workdir)
+        self.stderr = tempfile.TemporaryFile(dir=self.workdir)
+        status_read, status_write = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                [python, '-I', WORKER_PATH, str(status_write)],
+                stdin=subprocess.PIPE, stdout=self.stdout, stderr=self.stderr,
+                cwd=self.workdir, env=WORKER_ENV, pass_fds=(status_write,),
+                start_new_session=True)
+        except OSError as e:
+            os.close(status_read)
+            self.cleanup()
+            raise SandboxError(f'Could not start a sandbox worker: {str(e)}')
+        finally:
+            os.close(status_write)
+        self.status = os.fdopen(status_read, 'rb')
+        self.started_at = time.monotonic()
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+
+    def read_output(self, stream, limit):
+        stream.seek(0)
+        data = stream.read(limit + 1)
+        return data[:limit].decode('utf-8', errors='replace'), len(data) > limit
+
+    def cleanup(self):
+        for name in ('stdout', 'stderr', 'status'):
+            stream = getattr(self, name, None)
+            if stream is not None:
+                stream.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class SandboxPool:
+    """Pool of pre-warmed, single-use sandbox workers."""
+
+    def __init__(self, size=None, python=None, timeout=None, cpu_seconds=None, memory_mb=None,
+                 max_files=None, output_limit=None):
+        """Create the pool.
+
+        Args:
+            size (int, optional): Number of workers kept warm; 0 starts a
+                worker per request.
+            python (str, optional): The interpreter of the workers.
+            timeout (float, optional): Maximum wall-clock seconds of a run.
+            cpu_seconds (int, optional): CPU time limit of a run.
+            memory_mb (int, optional): Address space limit of a worker.
+            max_files (int, optional): Open file limit of a worker.
+            output_limit (int, optional): Bytes kept of stdout and of stderr.
+        """
+        def setting(value, key, default):
+            if value is not None:
+                return value
+            return type(default)(os.environ.get(f'APILAMA_SANDBOX_{key}', default))
+
+        self.size = setting(size, 'POOL_SIZE', DEFAULT_POOL_SIZE)
+        self.python = python or os.environ.get('APILAMA_SANDBOX_PYTHON') or sys.executable
+        self.timeout = setting(timeout, 'TIMEOUT', DEFAULT_TIMEOUT)
+        self.cpu_seconds = setting(cpu_seconds, 'CPU_SECONDS', DEFAULT_CPU_SECONDS)
+        self.memory_mb = setting(memory_mb, 'MEMORY_MB', DEFAULT_MEMORY_MB)
+        self.max_files = setting(max_files, 'MAX_FILES', DEFAULT_MAX_FILES)
+        self.output_limit = setting(output_limit, 'OUTPUT_LIMIT', DEFAULT_OUTPUT_LIMIT)
+
+        self._interpreter = None
+
+        self._cond = threading.Condition()
+        self._warm = deque()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+        self.runs = 0
+        self.warm_starts = 0
+        self.cold_starts = 0
+        self.timeouts = 0
+        self.spawn_errors = 0
+
+    def _check_process(self):
+        # Workers and the refill thread belong to the process that started them
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._warm = deque()
+        self._thread = None
+
+    def _start_refill(self):
+        if self.size <= 0 or self._closed:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._refill, name='apilama-sandbox', daemon=True)
+            self._thread.start()
+        self._cond.notify_all()
+
+    def _refill(self):
+        pid = os.getpid()
+        while True:
+            with self._cond:
+                while len(self._warm) >= self.size and not self._closed and self._pid == pid:
+                    self._cond.wait()
+                if self._closed or self._pid != pid:
+                    return
+            try:
+                worker = _Worker(self.python)
+            except SandboxError as e:
+                logger.error(str(e))
+                with self._cond:
+                    self.spawn_errors += 1
+                time.sleep(1)
+                continue
+            with self._cond:
+                if self._closed or self._pid != pid:
+                    worker.kill()
+                    worker.cleanup()
+                    return
+                self._warm.append(worker)
+                self._cond.notify_all()
+
+    def warm_up(self):
+        """Start filling the pool without waiting for a request."""
+        with self._cond:
+            self._check_process()
+            self._start_refill()
+
+    def _acquire(self):
+        with self._cond:
+            self._check_process()
+            worker = None
+            while self._warm:
+                candidate = self._warm.popleft()
+                if candidate.alive():
+                    worker = candidate
+                    break
+                candidate.cleanup()
+            if worker is not None:
+                self.warm_starts += 1
+            else:
+                self.cold_starts += 1
+            self._start_refill()
+        return worker or _Worker(self.python)
+
+    def limits(self):
+        """Get the resource limits passed to the workers."""
+        return {
+            'cpu_seconds': self.cpu_seconds,
+            'memory_bytes': self.memory_mb * 1024 * 1024,
+            'max_files': self.max_files,
+            # One byte more than is kept tells that the output was cut
+            'output_bytes': self.output_limit + 1
+        }
+
+    @property
+    def interpreter(self):
+        """The path and version of the interpreter running the code."""
+        if self._interpreter is None:
+            if self.python == sys.executable:
+                version = sys.version
+            else:
+                try:
+                    version = subprocess.run([self.python, '-I', '-c', 'import sys; print(sys.version)'],
+                                             capture_output=True, text=True, timeout=10).stdout.strip()
+                except (OSError, subprocess.TimeoutExpired) as e:
+                    raise SandboxError(f'Could not run {self.python}: {str(e)}')
+            self._interpreter = f'{self.python} {version}'
+        return self._interpreter
+
+    def result_key(self, code, input=None):
+        """Build the content address of the result of a run.
+
+        The key covers everything the result depends on besides the code
+        itself: its input, the interpreter and the resource limits.
+
+        Returns:
+            str: The hex digest.
+        """
+        content = json.dumps({'code': code, 'input': input or '', 'interpreter': self.interpreter,
+                              'limits': self.limits()}, sort_keys=True)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def run(self, code, timeout=None, input=None):
+        """Run a Python snippet in a sandbox worker.
+
+        Args:
+            code (str): The Python code.
+            timeout (float, optional): Wall-clock timeout in seconds, at most
+                the timeout of the pool.
+            input (str, optional): The standard input of the code.
+
+        Returns:
+            dict: ``stdout``, ``stderr``, ``exit_code``, ``execution_time``
+            (seconds the code ran, measured in the worker), ``timed_out`` and
+            ``truncated``.
+
+        Raises:
+            SandboxError: If no worker could be started.
+        """
+        timeout = min(timeout, self.timeout) if timeout else self.timeout
+        worker = self._acquire()
+        started = time.monotonic()
+        timed_out = False
+        try:
+            request = {'code': code, 'input': input, 'limits': self.limits()}
+            try:
+                worker.process.stdin.write(json.dumps(request).encode('utf-8'))
+                worker.process.stdin.close()
+            except BrokenPipeError:
+                pass
+            try:
+                worker.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                timed_out = True
+            # Also stops processes the code started
+            worker.kill()
+            wall_time = time.monotonic() - started
+
+            try:
+                status = json.loads(worker.status.read() or b'{}')
+            except ValueError:
+                status = {}
+            stdout, stdout_truncated = worker.read_output(worker.stdout, self.output_limit)
+            stderr, stderr_truncated = worker.read_output(worker.stderr, self.output_limit)
+        finally:
+            worker.cleanup()
+
+        with self._cond:
+            self.runs += 1
+            if timed_out:
+                self.timeouts += 1
+        return {
+            'stdout': stdout,
+            'stderr': stderr,
+            'exit_code': None if timed_out else worker.process.returncode,
+            'execution_time': round(status.get('execution_time', wall_time), 6),
+            'timed_out': timed_out,
+            'truncated': stdout_truncated or stderr_truncated
+        }
+
+    def close(self):
+        """Stop the warm workers."""
+        with self._cond:
+            self._closed = True
+            workers = list(self._warm) if self._pid == os.getpid() else []
+            self._warm.clear()
+            self._cond.notify_all()
+        for worker in workers:
+            worker.kill()
+            worker.cleanup()
+
+    def stats(self):
+        """Get the pool occupancy and run counters."""
+        with self._cond:
+            return {
+                'pool_size': self.size,
+                'warm': len(self._warm) if self._pid == os.getpid() else 0,
+                'runs': self.runs,
+                'warm_starts': self.warm_starts,
+                'cold_starts': self.cold_starts,
+                'timeouts': self.timeouts,
+                'spawn_errors': self.spawn_errors,
+                'limits': self.limits(),
+                'timeout': self.timeout
+            }
+
+
+_pool = None
+_result_cache = None
+_batch_executor = None
+_batch_executor_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox():
+    """Get the shared sandbox pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool()
+        return _pool
+
+
+def get_result_cache():
+    """Get the shared on-disk cache of run results.
+
+    Returns:
+        DiskLRUCache or None: The cache, or None if it is disabled with
+        ``APILAMA_SANDBOX_CACHE_MB=0``.
+    """
+    global _result_cache
+    with _pool_lock:
+        if _result_cache is None:
+            max_mb = float(os.environ.get('APILAMA_SANDBOX_CACHE_MB', DEFAULT_CACHE_MB))
+            if max_mb <= 0:
+                return None
+            directory = os.environ.get('APILAMA_SANDBOX_CACHE_DIR', DEFAULT_CACHE_DIR)
+            _result_cache = DiskLRUCache(directory, int(max_mb * 1024 * 1024))
+        return _result_cache
+
+
+def run_snippet(code, options, cache=True):
+    """Run the code of an execute request in the shared sandbox pool.
+
+    Args:
+        code (str): The Python code.
+        options (dict): The request body; ``timeout`` (seconds), ``input``
+            (standard input) and ``cache`` (a JSON boolean, whether a cached
+            result may be returned and the result stored) are used.
+        cache (bool, optional): Whether results are cached when the request
+            does not say. Defaults to True.
+
+    Returns:
+        dict: The response payload: the run result from ``SandboxPool.run()``,
+        with ``output`` holding stdout and ``cached`` telling whether the
+        result comes from the cache.
+
+    Raises:
+        ValueError: If an option has an invalid value.
+        SandboxError: If no worker could be started.
+    """
+    if not isinstance(code, str):
+        raise ValueError('Code must be a string')
+    timeout = options.get('timeout')
+    if timeout is not None:
+        try:
+            timeout = float(timeout)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid timeout')
+    input = options.get('input')
+    if input is not None and not isinstance(input, str):
+        raise ValueError('Input must be a string')
+
+    use_cache = options.get('cache', cache)
+    if not isinstance(use_cache, bool):
+        raise ValueError('cache must be true or false')
+
+    pool = get_sandbox()
+    cache = get_result_cache() if use_cache else None
+    if cache is not None:
+        key = pool.result_key(code, input)
+        data = cache.get(key)
+        if data is not None:
+            try:
+                result = json.loads(data)
+                return dict(result, status='success', output=result['stdout'], cached=True)
+            except (ValueError, KeyError):
+                pass
+
+    result = pool.run(code, timeout=timeout, input=input)
+    # A run stopped by the timeout says nothing about the result of the code
+    if cache is not None and not result['timed_out']:
+        cache.put(key, json.dumps(result).encode('utf-8'))
+    return dict(result, status='success', output=result['stdout'], cached=False)
+
+
+def get_batch_executor():
+    """Get the executor running the items of all batches.
+
+    Its size (``APILAMA_SANDBOX_BATCH_WORKERS``, by default the number of
+    CPUs) bounds the snippets running at the same time for all batches
+    together, so concurrent batches share the cores instead of
+    oversubscribing them.
+    """
+    global _batch_executor, _batch_executor_pid
+    with _pool_lock:
+        # Executor threads do not survive fork(), a child process starts its own
+        if _batch_executor is None or _batch_executor_pid != os.getpid():
+            workers = int(os.environ.get('APILAMA_SANDBOX_BATCH_WORKERS', 0)) or os.cpu_count() or 1
+            _batch_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='apilama-batch')
+            _batch_executor_pid = os.getpid()
+        return _batch_executor
+
+
+def run_batch(items, timeout=None, item_timeout=None):
+    """Run the snippets of a batch in parallel.
+
+    Args:
+        items (list): Execute request bodies, as accepted by ``run_snippet()``.
+        timeout (float, optional): Seconds for the whole batch. Items still
+            queued at the deadline are not run, and running items get at most
+            the time left.
+        item_timeout (float, optional): Default timeout of an item without
+            its own.
+
+    Yields:
+        tuple: The index of an item and its response payload, in the order
+        the items finish.
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    executor = get_batch_executor()
+
+    def run_item(item):
+        options = dict(item)
+        if options.get('timeout') is None and item_timeout is not None:
+            options['timeout'] = item_timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return {'status': 'error', 'message': 'Batch timeout exceeded before the item started',
+                        'timed_out': True}
+            try:
+                item_limit = float(options['timeout']) if options.get('timeout') is not None else remaining
+            except (TypeError, ValueError):
+                item_limit = remaining
+            options['timeout'] = min(item_limit, remaining)
+        try:
+            return run_snippet(item.get('code'), options)
+        except (ValueError, SandboxError) as e:
+            return {'status': 'error', 'message': str(e)}
+        except Exception as e:
+            logger.error('Batch item failed: %s', e)
+            return {'status': 'error', 'message': str(e)}
+
+    futures = {executor.submit(run_item, item): index for index, item in enumerate(items)}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.cancelled():
+                    continue
+                yield futures[future], future.result()
+    finally:
+        # The client went away: drop the items that have not started
+        for future in pending:
+            future.cancel()
+
+
+def close_sandbox():
+    """Stop the workers of the shared sandbox pool."""
+    with _pool_lock:
+        pool = _pool
+    if pool is not None:
+        pool.close()
+
+
+def get_sandbox_stats():
+    """Get the stats of the shared sandbox pool and its result cache."""
+    with _pool_lock:
+        pool = _pool
+        cache = _result_cache
+    stats = pool.stats() if pool is not None else {}
+    if cache is not None:
+        stats['result_cache'] = cache.stats()
+    return stats
+
+
+atexit.register(close_sandbox)
+register_metrics_provider('sandbox', get_sandbox_stats)
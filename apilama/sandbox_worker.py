@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Sandbox Worker
+
+This module is the program run by the pre-warmed sandbox workers of
+``apilama.sandbox``. It is started with ``python -I`` and imports nothing
+from APILama.
+
+The worker starts, then blocks reading a JSON request from stdin. Once the
+request arrives it applies the resource limits, runs the code once and
+writes ``{"execution_time": ...}`` to the status file descriptor given as
+its only argument. The output of the code goes to the stdout and stderr the
+worker was started with.
+"""
+
+import io
+import json
+import os
+import signal
+import sys
+import time
+import traceback
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+
+def apply_limits(limits):
+    """Apply the resource limits of a request to this process.
+
+    Args:
+        limits (dict): ``cpu_seconds``, ``memory_bytes``, ``max_files`` and
+            ``output_bytes``; missing or zero values are not limited.
+    """
+    if not RESOURCE_AVAILABLE:
+        return
+
+    def limit(name, value):
+        try:
+            resource.setrlimit(name, (value, value))
+        except (ValueError, OSError):
+            pass
+
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    if limits.get('cpu_seconds'):
+        # Counted from now on, not from the start of the interpreter
+        used = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(used.ru_utime + used.ru_stime + limits['cpu_seconds']) + 1
+        try:
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 1))
+        except (ValueError, OSError):
+            pass
+    if limits.get('memory_bytes'):
+        limit(resource.RLIMIT_AS, limits['memory_bytes'])
+    if limits.get('max_files'):
+        limit(resource.RLIMIT_NOFILE, limits['max_files'])
+    if limits.get('output_bytes'):
+        # Writes beyond the limit fail with EFBIG instead of killing the process
+        signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+        limit(resource.RLIMIT_FSIZE, limits['output_bytes'])
+
+
+def main():
+    status_fd = int(sys.argv[1])
+    os.set_inheritable(status_fd, False)
+
+    data = sys.stdin.buffer.read()
+    if not data:
+        # APILama went away before handing out this worker
+        return 0
+    request = json.loads(data)
+
+    # The code reads its input, not the request pipe
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    sys.stdin = io.StringIO(request.get('input') or '')
+
+    apply_limits(request.get('limits') or {})
+
+    exit_code = 0
+    namespace = {'__name__': '__main__', '__builtins__': __builtins__}
+    started = time.perf_counter()
+    try:
+        exec(compile(request['code'], '<sandbox>', 'exec'), namespace)
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    execution_time = time.perf_counter() - started
+
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    try:
+        os.write(status_fd, json.dumps({'execution_time': execution_time}).encode('utf-8'))
+    except OSError:
+        pass
+    return exit_code
+
+
+if __name__ == '__main__':
+    # Skip interpreter cleanup, the process is thrown away anyway
+    os._exit(main())
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Production Server
+
+This module provides a pre-forking production launcher for APILama
+(``apilama --server prefork``).
+
+The master process binds the listening socket once and forks N workers that
+all accept connections from it. Each worker builds its own application with
+the ``create_app()`` factory and serves up to ``threads`` connections at a
+time, one per thread, so throughput scales with the number of cores and a
+streaming response (job output, LLM tokens, batch results) only ties up a
+thread for as long as it lasts, not the whole worker. A worker with all its
+threads busy stops accepting and leaves new connections to the others; with
+every thread of every worker busy, new connections wait in the backlog.
+
+Workers are recycled after a number of requests or when their resident memory
+exceeds a limit; the master replaces them while the other workers keep
+serving. SIGTERM/SIGINT drain all workers gracefully, SIGHUP replaces all
+workers with fresh ones without closing the socket.
+
+Whole-file responses (``send_file``) are written to the client socket with
+``os.sendfile()``, so file downloads never pass through the Python heap.
+"""
+
+import importlib
+import os
+import random
+import resource
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+from werkzeug.wsgi import FileWrapper
+
+from apilama.logger import logger
+
+DEFAULT_APP_FACTORY = 'apilama.app:create_app'
+DEFAULT_GRACEFUL_TIMEOUT = 30.0
+DEFAULT_THREADS = 8
+
+# Seconds between two checks of the worker stop conditions
+POLL_INTERVAL = 0.5
+
+
+def get_rss_bytes():
+    """Get the resident set size of the current process.
+
+    Returns:
+        int: The resident memory in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        # Peak RSS in kilobytes on Linux, the closest portable approximation
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_app_factory(path):
+    """Import an application factory from a 'module:function' path."""
+    module_name, _, function_name = path.partition(':')
+    module = importlib.import_module(module_name)
+    return getattr(module, function_name or 'create_app')
+
+
+class _RequestCounter:
+    """WSGI middleware counting the requests served by a worker."""
+
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.count += 1
+        return self.app(environ, start_response)
+
+
+class _SendfileRequestHandler(WSGIRequestHandler):
+    """Request handler exposing the client socket to the sendfile middleware."""
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ['apilama.socket'] = self.connection
+        return environ
+
+
+class _Sendfile:
+    """WSGI middleware sending whole-file responses with os.sendfile().
+
+    The kernel copies the file from the page cache to the client socket
+    instead of the worker reading it in 8 KiB blocks. Partial (Range)
+    responses and all other responses pass through unchanged.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured['headers'] = headers
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.app(environ, capture_start_response)
+        sock = environ.get('apilama.socket')
+        if sock is None or type(app_iter) is not FileWrapper or not hasattr(app_iter.file, 'fileno'):
+            return app_iter
+        length = next((value for name, value in captured.get('headers', ())
+                       if name.lower() == 'content-length'), None)
+        if length is None:
+            return app_iter
+        return self._send(app_iter, sock, int(length))
+
+    @staticmethod
+    def _send(wrapper, sock, length):
+        try:
+            # An empty chunk makes the server write the status line and headers
+            yield b''
+            file_fd = wrapper.file.fileno()
+            sock_fd = sock.fileno()
+            offset = wrapper.file.tell()
+            while length > 0:
+                try:
+                    sent = os.sendfile(sock_fd, file_fd, offset, length)
+                except BlockingIOError:
+                    select.select([], [sock_fd], [])
+                    continue
+                if sent == 0:
+                    raise ConnectionError('File truncated during sendfile')
+                offset += sent
+                length -= sent
+        finally:
+            wrapper.close()
+
+
+class PreforkServer:
+    """Pre-forking WSGI server sharing one listening socket between workers."""
+
+    def __init__(self, app_factory=DEFAULT_APP_FACTORY, host='127.0.0.1', port=8000, workers=None,
+                 max_requests=0, max_requests_jitter=0, max_rss_mb=0,
+                 graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT, backlog=2048, threads=DEFAULT_THREADS):
+        """Create the server.
+
+        Args:
+            app_factory (str or callable): The application factory, or its
+                'module:function' import path, resolved in the workers.
+            host (str, optional): Host to bind to.
+            port (int, optional): Port to listen on.
+            workers (int, optional): Number of workers. Defaults to the CPU count.
+            max_requests (int, optional): Recycle a worker after this many
+                requests. 0 disables recycling by request count.
+            max_requests_jitter (int, optional): Random extra requests added per
+                worker, so workers do not all recycle at the same time.
+            max_rss_mb (int, optional): Recycle a worker once its resident
+                memory exceeds this many megabytes. 0 disables the check.
+            graceful_timeout (float, optional): Seconds workers get to finish
+                in-flight requests before they are killed.
+            backlog (int, optional): Listen backlog of the shared socket.
+            threads (int, optional): Connections served at the same time by
+                each worker, one thread each.
+        """
+        self.app_factory = app_factory
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_rss_mb = max_rss_mb
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.threads = max(1, threads)
+
+        self.socket = None
+        self._workers = {}  # pid -> spawn time
+        self._stopping = False
+        self._reload = False
+
+    # Master
+
+    def bind(self):
+        """Bind the shared listening socket."""
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        # Workers poll the socket, so a connection another worker already took
+        # must not leave them blocked in accept()
+        sock.setblocking(False)
+        self.socket = sock
+        self.port = sock.getsockname()[1]
+        return sock
+
+    def run(self):
+        """Run the master process until it is asked to stop."""
+        if not hasattr(os, 'fork'):
+            raise RuntimeError('The prefork server requires a platform with os.fork()')
+
+        if self.socket is None:
+            self.bind()
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        logger.info('APILama master %s listening on %s:%s with %s workers',
+                    os.getpid(), self.host, self.port, self.workers)
+
+        try:
+            while not self._stopping:
+                self._reap_workers()
+                if self._reload:
+                    self._reload = False
+                    self._reload_workers()
+                self._spawn_missing_workers()
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self._stop_workers(list(self._workers))
+            self.socket.close()
+            logger.info('APILama master %s stopped', os.getpid())
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self._reload = True
+
+    def _spawn_missing_workers(self):
+        while len(self._workers) < self.workers and not self._stopping:
+            pid = os.fork()
+            if pid == 0:
+                exit_code = 0
+                try:
+                    self._run_worker()
+                except BaseException:
+                    logger.exception('APILama worker %s crashed', os.getpid())
+                    exit_code = 1
+                finally:
+                    os._exit(exit_code)
+            self._workers[pid] = time.monotonic()
+
+    def _reap_workers(self):
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._workers.clear()
+                return
+            if pid == 0:
+                return
+            spawned_at = self._workers.pop(pid, None)
+            if spawned_at is None:
+                continue
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                logger.info('APILama worker %s exited, replacing it', pid)
+            else:
+                logger.warning('APILama worker %s died with status %s, replacing it', pid, status)
+                # Avoid a tight respawn loop when workers crash during boot
+                if time.monotonic() - spawned_at < 1.0:
+                    time.sleep(1.0)
+
+    def _reload_workers(self):
+        """Start a fresh set of workers, then drain the old ones."""
+        old_workers = list(self._workers)
+        logger.info('Reloading APILama workers %s', old_workers)
+        self._workers = {}
+        self._spawn_missing_workers()
+        self._stop_workers(old_workers)
+
+    def _stop_workers(self, pids):
+        """Ask workers to drain, and kill them after the graceful timeout."""
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.graceful_timeout
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    remaining.discard(pid)
+                    self._workers.pop(pid, None)
+            if remaining:
+                time.sleep(0.05)
+
+        for pid in remaining:
+            logger.warning('APILama worker %s did not stop in time, killing it', pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self._workers.pop(pid, None)
+
+    # Worker
+
+    def _run_worker(self):
+        stop = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stop.append(signum))
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        factory = self.app_factory
+        if isinstance(factory, str):
+            factory = load_app_factory(factory)
+        app = _RequestCounter(_Sendfile(factory()))
+
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        max_rss = self.max_rss_mb * 1024 * 1024
+
+        server = make_server(self.host, self.port, app, fd=self.socket.fileno(),
+                             request_handler=_SendfileRequestHandler)
+        server.socket.setblocking(False)
+        server.timeout = POLL_INTERVAL
+
+        slots = threading.BoundedSemaphore(self.threads)
+        executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='apilama-request')
+        accepted = []
+
+        def serve(request, client_address):
+            try:
+                server.finish_request(request, client_address)
+            except Exception:
+                server.handle_error(request, client_address)
+            finally:
+                server.shutdown_request(request)
+                slots.release()
+
+        def process_request(request, client_address):
+            accepted.append(client_address)
+            executor.submit(serve, request, client_address)
+
+        server.process_request = process_request
+        logger.info('APILama worker %s started', os.getpid())
+
+        # A stop signal only sets a flag, and the executor is drained before
+        # we exit, so in-flight requests always complete.
+        while not stop:
+            # Only accept a connection with a thread free to serve it, so
+            # the others are left to the other workers
+            if not slots.acquire(timeout=POLL_INTERVAL):
+                continue
+            accepted.clear()
+            server.handle_request()
+            if not accepted:
+                slots.release()
+            if max_requests and app.count >= max_requests:
+                logger.info('APILama worker %s recycling after %s requests', os.getpid(), app.count)
+                break
+            if max_rss and app.count and get_rss_bytes() > max_rss:
+                logger.info('APILama worker %s recycling at %s MB RSS', os.getpid(), get_rss_bytes() // 1048576)
+                break
+
+        executor.shutdown(wait=True)
+        server.server_close()
+
+        # Workers exit with os._exit(), which skips atexit handlers
+        from apilama.committer import flush_all
+        flush_all()
+
+
+def run(host, port, workers=None, max_requests=0, max_requests_jitter=0, max_rss_mb=0,
+        graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT, app_factory=DEFAULT_APP_FACTORY, threads=DEFAULT_THREADS):
+    """Serve APILama with the pre-forking production server.
+
+    Args:
+        host (str): Host to bind to.
+        port (int): Port to listen on.
+        workers (int, optional): Number of workers. Defaults to the CPU count.
+        max_requests (int, optional): Recycle a worker after this many requests.
+        max_requests_jitter (int, optional): Random extra requests per worker.
+        max_rss_mb (int, optional): Recycle a worker above this resident memory.
+        graceful_timeout (float, optional): Seconds allowed for draining workers.
+        app_factory (str, optional): 'module:function' path of the app factory.
+        threads (int, optional): Connections served at the same time per worker.
+    """
+    server = PreforkServer(
+        app_factory=app_factory,
+        host=host,
+        port=port,
+        workers=workers,
+        max_requests=max_requests,
+        max_requests_jitter=max_requests_jitter,
+        max_rss_mb=max_rss_mb,
+        graceful_timeout=graceful_timeout,
+        threads=threads
+    )
+    server.run()
+    sys.exit(0)
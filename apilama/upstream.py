@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+APILama Upstream Client
+
+This module provides pooled, keep-alive HTTP clients for the backend services
+that APILama proxies requests to (SheLLama, BEXY, PyLLM, ...).
+
+Each backend gets one shared client with its own connection pool, so proxied
+calls reuse established TCP connections instead of opening a new one per
+request. Pool size, keep-alive and timeouts are configured through environment
+variables, either globally or per backend:
+
+    APILAMA_UPSTREAM_POOL_SIZE=20            # all backends
+    APILAMA_UPSTREAM_SHELLAMA_POOL_SIZE=50   # SheLLama only
+
+``requests`` is only imported when a client sends its first request, which
+keeps it out of the import time of the routes creating the clients.
+"""
+
+import os
+import threading
+
+from apilama.metrics import register_metrics_provider
+
+# Default settings, used when no environment variable overrides them
+DEFAULT_POOL_SIZE = 20
+DEFAULT_POOL_BLOCK = False
+DEFAULT_KEEPALIVE = True
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10.0
+DEFAULT_MAX_RETRIES = 0
+DEFAULT_ASYNC_POOL_SIZE = 100
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+
+# Size of the chunks relayed when streaming an upstream body to the client
+STREAM_CHUNK_SIZE = int(os.environ.get('APILAMA_STREAM_CHUNK_SIZE', 65536))
+
+
+def get_backend_setting(backend, key, default, prefix='APILAMA_UPSTREAM'):
+    """Read a setting for a backend from the environment.
+
+    The backend specific variable (``<PREFIX>_<BACKEND>_<KEY>``) takes
+    precedence over the global one (``<PREFIX>_<KEY>``).
+
+    Args:
+        backend (str): The name of the backend, e.g. 'shellama'.
+        key (str): The name of the setting, e.g. 'POOL_SIZE'.
+        default: The value to use when the setting is not configured.
+        prefix (str, optional): The prefix of the environment variables.
+
+    Returns:
+        The setting converted to the type of ``default``.
+    """
+    value = os.environ.get(f'{prefix}_{backend.upper()}_{key}')
+    if value is None:
+        value = os.environ.get(f'{prefix}_{key}')
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ('true', '1', 't', 'yes')
+    return type(default)(value)
+
+
+class UpstreamClient:
+    """A pooled, keep-alive HTTP client for a single backend service."""
+
+    def __init__(self, name, base_url, pool_size=None, pool_block=None, keepalive=None,
+                 connect_timeout=None, read_timeout=None, max_retries=None):
+        """Create a client for a backend service.
+
+        Args:
+            name (str): The name of the backend, used for configuration and metrics.
+            base_url (str): The base URL of the backend, e.g. 'http://localhost:8002'.
+            pool_size (int, optional): Maximum number of pooled connections.
+            pool_block (bool, optional): Block when the pool is exhausted instead of
+                opening extra, non-pooled connections.
+            keepalive (bool, optional): Keep connections open between requests.
+            connect_timeout (float, optional): Default connect timeout in seconds.
+            read_timeout (float, optional): Default read timeout in seconds.
+            max_retries (int, optional): Number of retries on connection errors.
+        """
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size if pool_size is not None else get_backend_setting(name, 'POOL_SIZE', DEFAULT_POOL_SIZE)
+        self.pool_block = pool_block if pool_block is not None else get_backend_setting(name, 'POOL_BLOCK', DEFAULT_POOL_BLOCK)
+        self.keepalive = keepalive if keepalive is not None else get_backend_setting(name, 'KEEPALIVE', DEFAULT_KEEPALIVE)
+        self.connect_timeout = (connect_timeout if connect_timeout is not None
+                                else get_backend_setting(name, 'CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT))
+        self.read_timeout = (read_timeout if read_timeout is not None
+                             else get_backend_setting(name, 'READ_TIMEOUT', DEFAULT_READ_TIMEOUT))
+        self.max_retries = max_retries if max_retries is not None else get_backend_setting(name, 'MAX_RETRIES', DEFAULT_MAX_RETRIES)
+
+        # Created with the first request
+        self._adapter = None
+        self._session = None
+
+        # Optional BackendHealthMonitor fed with the outcome of every request
+        self.health = None
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._requests = 0
+        self._errors = 0
+
+    @property
+    def session(self):
+        """The ``requests`` session of the client, created on first use."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    # One adapter per client: the backend lives on a single host, so a
+                    # single pool of ``pool_size`` connections is all we need.
+                    adapter = HTTPAdapter(
+                        pool_connections=1,
+                        pool_maxsize=self.pool_size,
+                        pool_block=self.pool_block,
+                        max_retries=self.max_retries
+                    )
+                    session = requests.Session()
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    if not self.keepalive:
+                        session.headers['Connection'] = 'close'
+                    self._adapter = adapter
+                    self._session = session
+        return self._session
+
+    def url(self, path):
+        """Build the full URL for a path on the backend."""
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, timeout=None, **kwargs):
+        """Send a request to the backend through the connection pool.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path on the backend, e.g. '/files'.
+            timeout (float, optional): Read timeout in seconds. The connect
+                timeout always comes from the client configuration.
+            **kwargs: Any other argument accepted by ``requests.Session.request``.
+
+        Returns:
+            requests.Response: The backend response.
+        """
+        read_timeout = timeout if timeout is not None else self.read_timeout
+        with self._lock:
+            self._in_flight += 1
+            self._requests += 1
+        try:
+            response = self.session.request(
+                method,
+                self.url(path),
+                timeout=(self.connect_timeout, read_timeout),
+                **kwargs
+            )
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            if self.health is not None:
+                self.health.record_failure()
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        if self.health is not None:
+            self.health.record_response(response.status_code)
+        return response
+
+    def get(self, path, **kwargs):
+        """Send a GET request to the backend."""
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        """Send a POST request to the backend."""
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        """Send a DELETE request to the backend."""
+        return self.request('DELETE', path, **kwargs)
+
+    def stats(self):
+        """Get the pool occupancy and request counters of the client.
+
+        Returns:
+            dict: The client configuration, counters and per-pool occupancy.
+        """
+        pools = []
+        pool_manager = self._adapter.poolmanager if self._adapter is not None else None
+        for key in (pool_manager.pools.keys() if pool_manager is not None else ()):
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+            # The urllib3 queue is pre-filled with ``None`` placeholders, so
+            # free slots are ``qsize()`` and live idle connections are the
+            # non-placeholder entries.
+            queued = list(pool.pool.queue) if pool.pool is not None else []
+            free_slots = len(queued)
+            pools.append({
+                'host': pool.host,
+                'port': pool.port,
+                'scheme': pool.scheme,
+                'maxsize': self.pool_size,
+                'in_use': max(self.pool_size - free_slots, 0),
+                'idle': sum(1 for conn in queued if conn is not None),
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests
+            })
+
+        with self._lock:
+            counters = {
+                'in_flight': self._in_flight,
+                'requests': self._requests,
+                'errors': self._errors
+            }
+
+        return {
+            'base_url': self.base_url,
+            'pool_size': self.pool_size,
+            'pool_block': self.pool_block,
+            'keepalive': self.keepalive,
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'pools': pools,
+            **counters
+        }
+
+    def close(self):
+        """Close all pooled connections of the client."""
+        if self._session is not None:
+            self._session.close()
+
+
+class AsyncUpstreamClient:
+    """A pooled, keep-alive asyncio HTTP client for a single backend service.
+
+    Used by the async serving mode (see ``apilama.asgi``), where proxy handlers
+    await upstream I/O on the event loop instead of blocking a worker thread.
+    Requires the optional ``httpx`` package.
+    """
+
+    def __init__(self, name, base_url, pool_size=None, keepalive=None, keepalive_expiry=None,
+                 connect_timeout=None, read_timeout=None, max_retries=None):
+        """Create an async client for a backend service.
+
+        Args:
+            name (str): The name of the backend, used for configuration and metrics.
+            base_url (str): The base URL of the backend.
+            pool_size (int, optional): Maximum number of concurrent connections.
+            keepalive (bool, optional): Keep connections open between requests.
+            keepalive_expiry (float, optional): Seconds an idle connection is kept.
+            connect_timeout (float, optional): Default connect timeout in seconds.
+            read_timeout (float, optional): Default read timeout in seconds.
+            max_retries (int, optional): Number of retries on connection errors.
+        """
+        import httpx
+
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = (pool_size if pool_size is not None
+                          else get_backend_setting(name, 'ASYNC_POOL_SIZE', DEFAULT_ASYNC_POOL_SIZE))
+        self.keepalive = keepalive if keepalive is not None else get_backend_setting(name, 'KEEPALIVE', DEFAULT_KEEPALIVE)
+        self.keepalive_expiry = (keepalive_expiry if keepalive_expiry is not None
+                                 else get_backend_setting(name, 'KEEPALIVE_EXPIRY', DEFAULT_KEEPALIVE_EXPIRY))
+        self.connect_timeout = (connect_timeout if connect_timeout is not None
+                                else get_backend_setting(name, 'CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT))
+        self.read_timeout = (read_timeout if read_timeout is not None
+                             else get_backend_setting(name, 'READ_TIMEOUT', DEFAULT_READ_TIMEOUT))
+        self.max_retries = max_retries if max_retries is not None else get_backend_setting(name, 'MAX_RETRIES', DEFAULT_MAX_RETRIES)
+
+        limits = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size if self.keepalive else 0,
+            keepalive_expiry=self.keepalive_expiry
+        )
+        self._httpx = httpx
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            transport=httpx.AsyncHTTPTransport(limits=limits, retries=self.max_retries),
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        )
+
+        # Optional BackendHealthMonitor fed with the outcome of every request
+        self.health = None
+
+        self._in_flight = 0
+        self._requests = 0
+        self._errors = 0
+
+    async def request(self, method, path, timeout=None, stream=False, **kwargs):
+        """Send a request to the backend through the connection pool.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path on the backend, e.g. '/files'.
+            timeout (float, optional): Read timeout in seconds.
+            stream (bool, optional): Return as soon as the headers arrived and
+                leave the body unread. The caller must ``aclose()`` the response.
+            **kwargs: Any other argument accepted by ``httpx.AsyncClient.build_request``.
+
+        Returns:
+            httpx.Response: The backend response.
+        """
+        if timeout is not None:
+            kwargs['timeout'] = self._httpx.Timeout(timeout, connect=self.connect_timeout)
+        # Counters are only touched from the event loop thread, no lock needed
+        self._in_flight += 1
+        self._requests += 1
+        try:
+            response = await self.client.send(self.client.build_request(method, path, **kwargs), stream=stream)
+        except Exception:
+            self._errors += 1
+            if self.health is not None:
+                self.health.record_failure()
+            raise
+        finally:
+            self._in_flight -= 1
+
+        if self.health is not None:
+            self.health.record_response(response.status_code)
+        return response
+
+    async def get(self, path, **kwargs):
+        """Send a GET request to the backend."""
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        """Send a POST request to the backend."""
+        return await self.request('POST', path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        """Send a DELETE request to the backend."""
+        return await self.request('DELETE', path, **kwargs)
+
+    def stats(self):
+        """Get the pool occupancy and request counters of the client.
+
+        Returns:
+            dict: The client configuration and counters.
+        """
+        try:
+            connections = len(self.client._transport._pool.connections)
+        except AttributeError:
+            connections = None
+        return {
+            'base_url': self.base_url,
+            'pool_size': self.pool_size,
+            'keepalive': self.keepalive,
+            'keepalive_expiry': self.keepalive_expiry,
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'open_connections': connections,
+            'in_flight': self._in_flight,
+            'requests': self._requests,
+            'errors': self._errors
+        }
+
+    async def close(self):
+        """Close all pooled connections of the client."""
+        await self.client.aclose()
+
+
+_clients = {}
+_async_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name, base_url=None):
+    """Get the shared client for a backend, creating it on first use.
+
+    Args:
+        name (str): The name of the backend, e.g. 'shellama'.
+        base_url (str, optional): The base URL of the backend. Defaults to the
+            ``<NAME>_API_URL`` environment variable.
+
+    Returns:
+        UpstreamClient: The shared client for the backend.
+    """
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            if base_url is None:
+                base_url = os.environ.get(f'{name.upper()}_API_URL')
+            if not base_url:
+                raise ValueError(f'No base URL configured for backend {name}')
+            client = UpstreamClient(name, base_url)
+            _clients[name] = client
+        return client
+
+
+def get_async_client(name, base_url=None):
+    """Get the shared async client for a backend, creating it on first use.
+
+    Must be called from the event loop the client will be used on.
+
+    Args:
+        name (str): The name of the backend, e.g. 'shellama'.
+        base_url (str, optional): The base URL of the backend. Defaults to the
+            ``<NAME>_API_URL`` environment variable.
+
+    Returns:
+        AsyncUpstreamClient: The shared async client for the backend.
+    """
+    with _clients_lock:
+        client = _async_clients.get(name)
+        if client is None:
+            if base_url is None:
+                base_url = os.environ.get(f'{name.upper()}_API_URL')
+            if not base_url:
+                raise ValueError(f'No base URL configured for backend {name}')
+            client = AsyncUpstreamClient(name, base_url)
+            _async_clients[name] = client
+        return client
+
+
+def get_pool_stats():
+    """Get the pool statistics of all backend clients.
+
+    Returns:
+        dict: The statistics of each client, keyed by backend name. Async
+        clients are reported as '<name>-async'.
+    """
+    with _clients_lock:
+        clients = dict(_clients)
+        async_clients = dict(_async_clients)
+    stats = {name: client.stats() for name, client in clients.items()}
+    stats.update({f'{name}-async': client.stats() for name, client in async_clients.items()})
+    return stats
+
+
+def close_all():
+    """Close all backend clients and drop them from the registry."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+async def close_all_async():
+    """Close all async backend clients and drop them from the registry."""
+    with _clients_lock:
+        clients = list(_async_clients.values())
+        _async_clients.clear()
+    for client in clients:
+        await client.close()
+
+
+register_metrics_provider('upstream', get_pool_stats)
@@ -28,6 +28,12 @@ setup(
         "python-dotenv>=0.15.0",
         "gitpython>=3.1.0",
     ],
+    extras_require={
+        "async": [
+            "uvicorn>=0.22.0",
+            "httpx>=0.24.0",
+        ],
+    },
     entry_points={
         "console_scripts": [
             "apilama=apilama.cli:main",
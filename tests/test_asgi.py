@@ -0,0 +1,149 @@
+"""
+Tests for the ASGI gateway and the async SheLLama routes
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.asgi import ASYNC_AVAILABLE
+from apilama.health import BackendHealthMonitor
+from apilama.upstream import UpstreamClient
+
+if ASYNC_AVAILABLE:
+    import httpx
+    from apilama.asgi import create_asgi_app
+    from apilama.routes import shellama_async_routes, shellama_routes
+    from apilama.upstream import AsyncUpstreamClient
+
+
+class _FakeShellamaHandler(BaseHTTPRequestHandler):
+    """SheLLama stand-in: /files fails, /file knows a single file"""
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/files':
+            self._send_json({'status': 'error'}, 500)
+        elif url.path == '/file' and parse_qs(url.query).get('filename') == ['notes.md']:
+            self._send_json({'status': 'success', 'content': '# Notes'})
+        else:
+            self._send_json({'status': 'error'}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@unittest.skipUnless(ASYNC_AVAILABLE, 'httpx and uvicorn are not installed')
+class TestAsyncGateway(unittest.TestCase):
+    """Tests for AsyncGateway through httpx.ASGITransport"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_asgi_app({'TESTING': True})
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeShellamaHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+        client = UpstreamClient('shellama-test', self.base_url)
+        self.monitor = BackendHealthMonitor('shellama-test', client, interval=3600)
+        # Keep the background thread from probing during the test
+        self.monitor.start = lambda: None
+        patches = [
+            mock.patch.object(shellama_routes, 'shellama_client', client),
+            mock.patch.object(shellama_routes, 'shellama_monitor', self.monitor),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(client.close)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, method, url, upstream_url=None, **kwargs):
+        """Send a request to the gateway, with SheLLama at upstream_url."""
+        async def send():
+            upstream = AsyncUpstreamClient('shellama-test', upstream_url or self.base_url)
+            try:
+                with mock.patch.object(shellama_async_routes, '_client', lambda: upstream):
+                    transport = httpx.ASGITransport(app=self.app)
+                    async with httpx.AsyncClient(transport=transport, base_url='http://apilama') as client:
+                        response = await client.request(method, url, **kwargs)
+                        await response.aread()
+                        return response
+            finally:
+                await upstream.close()
+        return asyncio.run(send())
+
+    def test_health(self):
+        """The async health route reports the cached monitor state"""
+        response = self.request('GET', '/api/shellama/health')
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.json()['message'], 'SheLLama service has not been checked yet')
+
+        self.monitor._set_probe_result(True, {'status': 'ok'}, None)
+        response = self.request('GET', '/api/shellama/health')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['details'], {'status': 'ok'})
+
+    def test_flask_fallthrough(self):
+        """Routes without an async handler are served by the Flask app"""
+        response = self.request('GET', '/health')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ok', 'service': 'apilama'})
+
+    def test_proxied_success(self):
+        """A SheLLama answer is relayed like the Flask route does"""
+        response = self.request('GET', '/api/shellama/file', params={'filename': 'notes.md'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'success', 'content': '# Notes', 'name': 'notes.md'})
+
+    def test_upstream_error_mapping(self):
+        """Upstream errors map to the same statuses as the Flask routes"""
+        response = self.request('GET', '/api/shellama/file', params={'filename': 'missing.md'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['message'], 'File not found: missing.md')
+
+        response = self.request('GET', '/api/shellama/files')
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.json()['message'], 'SheLLama service returned status code 500')
+
+        response = self.request('GET', '/api/shellama/files', upstream_url='http://127.0.0.1:9')
+        self.assertEqual(response.status_code, 500)
+
+        response = self.request('GET', '/api/shellama/file')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'No filename provided')
+
+    def test_matches_flask_routes(self):
+        """The async and the Flask routes give the same answers"""
+        flask_client = self.app.wsgi.wsgi_app.test_client()
+        for params in ({'filename': 'notes.md'}, {'filename': 'missing.md'}, {}):
+            expected = flask_client.get('/api/shellama/file', query_string=params)
+            response = self.request('GET', '/api/shellama/file', params=params)
+            self.assertEqual(response.status_code, expected.status_code)
+            self.assertEqual(response.json(), expected.get_json())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Tests for the micro-batching scheduler
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.batching import MicroBatcher
+
+
+class TestMicroBatcher(unittest.TestCase):
+    """Tests for combining concurrent calls"""
+
+    def run_concurrently(self, batcher, calls):
+        results = {}
+        errors = {}
+
+        def call(key, item):
+            try:
+                results[item] = batcher.submit(key, item)
+            except Exception as e:
+                errors[item] = e
+
+        threads = [threading.Thread(target=call, args=c) for c in calls]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.005)
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_batches_by_key_and_size(self):
+        """Items with the same key are batched up to the maximum size"""
+        batches = []
+
+        def run_batch(key, items):
+            batches.append((key, list(items)))
+            return [item * 10 for item in items]
+
+        batcher = MicroBatcher(run_batch, max_size=3, max_wait=0.2)
+        results, _ = self.run_concurrently(batcher, [('a', 1), ('a', 2), ('b', 3), ('a', 4), ('a', 5)])
+
+        self.assertEqual(results, {1: 10, 2: 20, 3: 30, 4: 40, 5: 50})
+        self.assertEqual(sorted(batches), [('a', [1, 2, 4]), ('a', [5]), ('b', [3])])
+        self.assertEqual(batcher.stats()['batches'], 3)
+
+    def test_full_batch_does_not_wait(self):
+        """A full batch runs at once and a single item waits at most max_wait"""
+        batcher = MicroBatcher(lambda key, items: items, max_size=1, max_wait=5)
+        started = time.monotonic()
+        self.assertEqual(batcher.submit('a', 1), 1)
+        self.assertLess(time.monotonic() - started, 1)
+
+        batcher = MicroBatcher(lambda key, items: items, max_size=10, max_wait=0.05)
+        started = time.monotonic()
+        self.assertEqual(batcher.submit('a', 1), 1)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_errors_reach_their_callers(self):
+        """A failed batch fails every item, a failed item only its caller"""
+        def run_batch(key, items):
+            if key == 'fail':
+                raise RuntimeError('batch failed')
+            return [ValueError(item) if item == 2 else item for item in items]
+
+        batcher = MicroBatcher(run_batch, max_size=10, max_wait=0.1)
+        results, errors = self.run_concurrently(batcher, [('ok', 1), ('ok', 2), ('fail', 3)])
+        self.assertEqual(results, {1: 1})
+        self.assertIsInstance(errors[2], ValueError)
+        self.assertIsInstance(errors[3], RuntimeError)
+
+
+if __name__ == "__main__":
+    unittest.main()
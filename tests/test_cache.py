@@ -0,0 +1,137 @@
+"""
+Tests for the cache utilities
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.cache import DiskLRUCache, LRUCache, SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Tests for sharing in-flight computations"""
+
+    def test_concurrent_callers_share_one_call(self):
+        """Callers arriving while a computation runs get its result"""
+        flight = SingleFlight()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', compute)))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 10)
+        self.assertEqual((flight.executed, flight.shared), (1, 9))
+
+    def test_errors_are_shared_and_not_kept(self):
+        """An exception reaches every waiter and the next call runs again"""
+        flight = SingleFlight()
+
+        def fail():
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            flight.do('key', fail)
+        self.assertEqual(flight.do('key', lambda: 'ok'), 'ok')
+
+
+class TestLRUCache(unittest.TestCase):
+    """Tests for the bounded LRU cache"""
+
+    def test_least_recently_used_is_evicted(self):
+        """Entry count and byte budget evict the least recently used entries"""
+        cache = LRUCache(max_entries=2, max_bytes=10, ttl=60)
+        cache.put('a', 1, 4)
+        cache.put('b', 2, 4)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3, 4)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+
+        cache.put('d', 4, 8)
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertEqual(cache.get('d'), 4)
+        cache.put('e', 5, 11)
+        self.assertIsNone(cache.get('e'))
+
+    def test_expired_entries_are_not_returned(self):
+        """Entries are dropped once their time to live is over"""
+        cache = LRUCache(max_entries=10, max_bytes=100, ttl=0.05)
+        cache.put('a', 1, 1)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['expirations'], stats['bytes']), (1, 1, 1, 0))
+
+
+class TestDiskLRUCache(unittest.TestCase):
+    """Tests for the on-disk cache"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_entries_survive_a_new_instance(self):
+        """Entries are files shared by every instance on the directory"""
+        DiskLRUCache(self.dir, 1000).put('ab12', b'data')
+        cache = DiskLRUCache(self.dir, 1000)
+        self.assertEqual(cache.get('ab12'), b'data')
+        self.assertIsNone(cache.get('cd34'))
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 1))
+
+    def test_least_recently_read_entries_are_evicted(self):
+        """Beyond the budget, entries not read for the longest time go first"""
+        cache = DiskLRUCache(self.dir, 300)
+        for i, key in enumerate(('aa', 'bb', 'cc')):
+            cache.put(key, b'x' * 80)
+            os.utime(cache._path(key), (i, i))
+        cache.get('aa')
+        cache.put('dd', b'x' * 80)
+        self.assertIsNone(cache.get('bb'))
+        for key in ('aa', 'cc', 'dd'):
+            self.assertIsNotNone(cache.get(key))
+        self.assertEqual(cache.stats()['bytes'], 240)
+
+    def test_directory_is_private(self):
+        """The directory is created, or made, accessible to its owner only"""
+        directory = os.path.join(self.dir, 'cache')
+        DiskLRUCache(directory, 1000).put('ab12', b'data')
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+        os.chmod(directory, 0o777)
+        self.assertEqual(DiskLRUCache(directory, 1000).get('ab12'), b'data')
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+    @unittest.skipUnless(hasattr(os, 'geteuid') and os.geteuid() == 0, 'requires root to change owners')
+    def test_foreign_directory_is_not_used(self):
+        """Entries in a directory owned by another user are never served"""
+        DiskLRUCache(self.dir, 1000).put('ab12', b'planted')
+        os.chown(self.dir, 12345, 12345)
+        cache = DiskLRUCache(self.dir, 1000)
+        self.assertIsNone(cache.get('ab12'))
+        cache.put('cd34', b'data')
+        self.assertFalse(os.path.exists(cache._path('cd34')))
+
+
+if __name__ == "__main__":
+    unittest.main()
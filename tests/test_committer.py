@@ -0,0 +1,98 @@
+"""
+Tests for the write-behind committer
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.committer import WriteBehindCommitter
+
+
+@unittest.skipUnless(shutil.which('git'), 'git is required')
+class TestWriteBehindCommitter(unittest.TestCase):
+    """Tests for coalescing saves into commits"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.git('init', '-q')
+        self.git('config', 'user.name', 'Test')
+        self.git('config', 'user.email', 'test@example.com')
+        self.committer = WriteBehindCommitter(self.dir, window=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def git(self, *args):
+        return subprocess.run(['git', *args], cwd=self.dir, capture_output=True,
+                              text=True, check=True).stdout
+
+    def save(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        self.committer.enqueue([path])
+
+    def test_burst_becomes_one_commit(self):
+        """Saves within a window are committed together"""
+        for i in range(10):
+            self.save(f'{i % 3}.md', str(i))
+        stats = self.committer.stats()
+        self.assertEqual((stats['queue_depth'], stats['saves'], stats['commits']), (3, 10, 0))
+
+        self.assertTrue(self.committer.flush(timeout=10))
+        self.assertEqual(self.git('log', '--format=%s').splitlines(), ['Update 0.md, 1.md, 2.md'])
+        self.assertEqual(self.committer.stats()['commits'], 1)
+
+    def test_only_touched_paths_are_staged(self):
+        """Files changed outside the file API are not committed"""
+        with open(os.path.join(self.dir, 'other.md'), 'w') as f:
+            f.write('not saved through the API')
+        self.save('saved.md', 'saved')
+        self.committer.flush(timeout=10)
+        self.assertEqual(self.git('ls-files').split(), ['saved.md'])
+        self.assertEqual(self.git('status', '--porcelain').strip(), '?? other.md')
+
+    def test_staged_changes_are_not_committed(self):
+        """Changes staged outside the file API stay staged"""
+        with open(os.path.join(self.dir, 'other.md'), 'w') as f:
+            f.write('staged by hand')
+        self.git('add', 'other.md')
+        self.save('saved.md', 'saved')
+        self.committer.flush(timeout=10)
+        self.assertEqual(self.git('ls-files').split(), ['other.md', 'saved.md'])
+        self.assertEqual(self.git('show', '--name-only', '--format=').split(), ['saved.md'])
+        self.assertEqual(self.git('status', '--porcelain').strip(), 'A  other.md')
+
+    def test_delete_only_batch(self):
+        """A batch of deletions is committed"""
+        self.save('gone.md', 'soon gone')
+        self.committer.flush(timeout=10)
+
+        os.unlink(os.path.join(self.dir, 'gone.md'))
+        self.committer.enqueue([os.path.join(self.dir, 'gone.md')])
+        self.assertTrue(self.committer.flush(timeout=10))
+        self.assertEqual(self.git('ls-files'), '')
+        self.assertEqual(self.git('log', '--format=%s').splitlines(), ['Update gone.md', 'Update gone.md'])
+
+    def test_created_and_deleted_within_window(self):
+        """A file that never reached a commit does not block the queue"""
+        self.save('gone.md', 'soon gone')
+        os.unlink(os.path.join(self.dir, 'gone.md'))
+        self.committer.enqueue([os.path.join(self.dir, 'gone.md')])
+        self.assertTrue(self.committer.flush(timeout=10))
+        self.assertEqual(self.committer.stats()['errors'], 0)
+
+        self.save('kept.md', 'kept')
+        self.assertTrue(self.committer.flush(timeout=10))
+        self.assertEqual(self.git('ls-files').split(), ['kept.md'])
+        self.assertEqual(self.committer.stats()['errors'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Tests for the in-memory directory index
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.dirindex import DirectoryIndex
+
+
+class _IndexTests:
+    """Checks shared by the inotify and the mtime fallback mode"""
+    fs_watch = None
+
+    def setUp(self):
+        self._saved = os.environ.get('APILAMA_FS_WATCH')
+        os.environ['APILAMA_FS_WATCH'] = self.fs_watch
+        self.dir = tempfile.mkdtemp()
+        self.index = DirectoryIndex(self.dir, '*.md', ttl=60)
+
+    def tearDown(self):
+        self.index._watcher.stop()
+        shutil.rmtree(self.dir)
+        if self._saved is None:
+            os.environ.pop('APILAMA_FS_WATCH', None)
+        else:
+            os.environ['APILAMA_FS_WATCH'] = self._saved
+
+    def _write(self, name, content='# test'):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(content)
+
+    def _wait_for_change(self, etag):
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            snapshot = self.index.snapshot()
+            if snapshot.etag != etag:
+                return snapshot
+            time.sleep(0.05)
+        return snapshot
+
+    def test_lists_matching_files(self):
+        """Only files matching the pattern are listed"""
+        self._write('a.md')
+        self._write('notes.txt')
+        os.mkdir(os.path.join(self.dir, 'sub.md'))
+        snapshot = self.index.snapshot()
+        self.assertEqual([f['name'] for f in snapshot.files], ['a.md'])
+        self.assertIn(b'"a.md"', snapshot.body)
+
+    def test_batch_state_is_hidden(self):
+        """The lock, journals and temporary files of batch writes are not listed"""
+        self.index.pattern = '*'
+        for name in ('a.md', '.apilama-batch.lock', '.apilama-batch-0123.json', '.a.md.0123.apilama-tmp'):
+            self._write(name)
+        self.assertEqual([f['name'] for f in self.index.snapshot().files], ['a.md'])
+
+    def test_unchanged_directory_is_served_from_memory(self):
+        """A second lookup reuses the snapshot without rescanning"""
+        self._write('a.md')
+        first = self.index.snapshot()
+        self.assertIs(self.index.snapshot(), first)
+        self.assertEqual(self.index.stats()['rebuilds'], 1)
+
+    def test_new_file_changes_etag(self):
+        """Creating a file is picked up and changes the ETag"""
+        self._write('a.md')
+        etag = self.index.snapshot().etag
+        time.sleep(0.01)
+        self._write('b.md')
+        snapshot = self._wait_for_change(etag)
+        self.assertEqual(len(snapshot.files), 2)
+
+    def test_invalidate_forces_rebuild(self):
+        """An explicit invalidation picks up in-place edits"""
+        self._write('a.md')
+        etag = self.index.snapshot().etag
+        self._write('a.md', '# a longer body')
+        self.index.invalidate()
+        self.assertNotEqual(self.index.snapshot().etag, etag)
+
+
+class TestDirectoryIndexInotify(_IndexTests, unittest.TestCase):
+    fs_watch = 'inotify'
+
+
+class TestDirectoryIndexMtime(_IndexTests, unittest.TestCase):
+    fs_watch = 'mtime'
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,274 @@
+"""
+Tests for the markdown file routes
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.app import create_app
+
+
+class FileRoutesTestCase(unittest.TestCase):
+    """Base class running the app against a temporary markdown directory"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self._saved = os.environ.get('MARKDOWN_DIR')
+        os.environ['MARKDOWN_DIR'] = self.dir
+        self.client = create_app({'TESTING': True}).test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        if self._saved is None:
+            os.environ.pop('MARKDOWN_DIR', None)
+        else:
+            os.environ['MARKDOWN_DIR'] = self._saved
+
+    def write(self, name, content='# test'):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(content)
+
+
+class TestConditionalGet(FileRoutesTestCase):
+    """Tests for ETag / Last-Modified validation of file reads"""
+
+    def test_unchanged_file_returns_304(self):
+        """A matching If-None-Match gets an empty 304"""
+        self.write('a.md')
+        response = self.client.get('/api/file?filename=a.md')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['content'], '# test')
+        self.assertIsNotNone(response.headers.get('Last-Modified'))
+
+        etag = response.headers['ETag']
+        for url in ('/api/file?filename=a.md', '/api/weblama/markdown/a.md'):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+
+    def test_changed_file_returns_content(self):
+        """A stale ETag gets the new content and a new ETag"""
+        self.write('a.md')
+        etag = self.client.get('/api/file?filename=a.md').headers['ETag']
+        time.sleep(0.01)
+        self.write('a.md', '# changed')
+        response = self.client.get('/api/file?filename=a.md', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['content'], '# changed')
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_missing_file_returns_404(self):
+        """A missing file is still reported as not found"""
+        response = self.client.get('/api/file?filename=missing.md')
+        self.assertEqual(response.status_code, 404)
+
+    def test_path_outside_directory_is_rejected(self):
+        """Paths escaping the markdown directory are not read"""
+        name = os.path.basename(self.dir) + '-outside.md'
+        outside = os.path.join(os.path.dirname(self.dir), name)
+        with open(outside, 'w') as f:
+            f.write('secret')
+        self.addCleanup(os.remove, outside)
+
+        for url in (f'/api/file?filename=../{name}',
+                    f'/api/weblama/markdown/..%2f{name}',
+                    '/api/weblama/markdown/..%2f..%2f..%2fetc%2fhostname'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404, url)
+            self.assertNotIn(b'secret', response.data)
+
+
+class TestWebLamaRoutes(FileRoutesTestCase):
+    """Tests for the WebLama markdown routes on the local directory"""
+
+    def test_writes_are_seen_by_reads(self):
+        """Saves and deletes reach the directory the reads are served from"""
+        listing = self.client.get('/api/weblama/markdown')
+        etag = listing.headers['ETag']
+
+        response = self.client.post('/api/weblama/markdown/a.md', json={'content': '# saved'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/weblama/markdown', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f['name'] for f in response.json['files']], ['a.md'])
+        self.assertEqual(self.client.get('/api/weblama/markdown/a.md').json['content'], '# saved')
+
+        response = self.client.delete('/api/weblama/markdown/a.md')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/weblama/markdown').json['files'], [])
+        self.assertEqual(self.client.get('/api/weblama/markdown/a.md').status_code, 404)
+
+    def test_write_outside_directory_is_rejected(self):
+        """Saves and deletes do not escape the markdown directory"""
+        name = os.path.basename(self.dir) + '-outside.md'
+        response = self.client.post(f'/api/weblama/markdown/..%2f{name}', json={'content': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.dir), name)))
+        response = self.client.delete(f'/api/weblama/markdown/..%2f{name}')
+        self.assertEqual(response.status_code, 404)
+
+
+class TestRawFile(FileRoutesTestCase):
+    """Tests for the raw file download endpoint"""
+
+    def test_full_and_range_download(self):
+        """The whole file and byte ranges are served as raw bytes"""
+        self.write('a.md', '0123456789')
+        response = self.client.get('/api/file/raw?filename=a.md')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'0123456789')
+
+        response = self.client.get('/api/file/raw?filename=a.md', headers={'Range': 'bytes=2-4'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b'234')
+
+    def test_etag_matches_file_read(self):
+        """The raw download shares its ETag with the JSON file read"""
+        self.write('a.md')
+        etag = self.client.get('/api/file?filename=a.md').headers['ETag']
+        response = self.client.get('/api/file/raw?filename=a.md', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_path_outside_directory_is_rejected(self):
+        """Paths escaping the markdown directory are not served"""
+        response = self.client.get('/api/file/raw?filename=../etc/passwd')
+        self.assertEqual(response.status_code, 404)
+
+
+class TestBatchWrite(FileRoutesTestCase):
+    """Tests for the atomic batch write endpoint"""
+
+    def read(self, name):
+        with open(os.path.join(self.dir, name)) as f:
+            return f.read()
+
+    def listdir(self):
+        """List the markdown directory, without the batch lock file"""
+        from apilama.fileio import LOCK_NAME
+        return sorted(name for name in os.listdir(self.dir) if name != LOCK_NAME)
+
+    def test_batch_writes_all_files(self):
+        """All files of a batch are written and reported"""
+        self.write('a.md', 'old')
+        for atomic in (False, True):
+            response = self.client.post('/api/files/batch', json={'atomic': atomic, 'files': [
+                {'filename': 'a.md', 'content': f'new {atomic}'},
+                {'filename': 'sub/b.md', 'content': 'b'}
+            ]})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.read('a.md'), f'new {atomic}')
+            self.assertEqual(self.read('sub/b.md'), 'b')
+        self.assertEqual(self.listdir(), ['a.md', 'sub'])
+
+    def test_invalid_entry_writes_nothing(self):
+        """A batch with an invalid entry is rejected before any write"""
+        response = self.client.post('/api/files/batch', json={'files': [
+            {'filename': 'a.md', 'content': 'a'},
+            {'filename': '../escape.md', 'content': 'x'}
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.listdir(), [])
+
+    def test_committed_batch_is_rolled_forward(self):
+        """A batch interrupted after its journal was written is completed"""
+        from apilama import fileio
+
+        self.write('a.md', 'old')
+        target = os.path.join(self.dir, 'a.md')
+        real_replace = os.replace
+        calls = []
+
+        def crash_after_journal(src, dst):
+            # Let the journal itself be written, then "crash" on the first file
+            if dst == target:
+                calls.append(dst)
+                raise KeyboardInterrupt
+            real_replace(src, dst)
+
+        os.replace = crash_after_journal
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                fileio.write_batch(self.dir, [(target, 'new')], staged=True)
+        finally:
+            os.replace = real_replace
+
+        self.assertEqual(calls, [target])
+        self.assertEqual(self.read('a.md'), 'old')
+        self.assertEqual(fileio.recover_batches(self.dir), 1)
+        self.assertEqual(self.read('a.md'), 'new')
+        self.assertEqual(self.listdir(), ['a.md'])
+
+    @unittest.skipUnless(shutil.which('git'), 'git is required')
+    def test_batch_state_is_not_seen_by_git(self):
+        """The batch lock, journals and temporary files stay out of git"""
+        import subprocess
+
+        subprocess.run(['git', 'init', '-q'], cwd=self.dir, check=True)
+        response = self.client.post('/api/files/batch', json={'atomic': True, 'files': [
+            {'filename': 'a.md', 'content': 'a'}
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('.apilama-batch.lock', os.listdir(self.dir))
+        # A temporary file of a write caught midway
+        self.write('.b.md.0123.apilama-tmp', 'partial')
+
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=all'], cwd=self.dir,
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(status, '?? a.md\n')
+        self.assertEqual(self.client.get('/api/git/status').get_json()['files'],
+                         [{'status': '??', 'filename': 'a.md'}])
+
+    def test_concurrent_recovery(self):
+        """Workers recovering the same journals at once all succeed"""
+        import json
+        import multiprocessing
+        from apilama import fileio
+
+        for i in range(20):
+            target = os.path.join(self.dir, f'{i}.md')
+            temp_path = fileio._write_temp(target, f'content {i}'.encode(), f'batch{i}')
+            journal_path = os.path.join(self.dir, f'{fileio.JOURNAL_PREFIX}batch{i}.json')
+            with open(journal_path, 'w') as f:
+                json.dump({'renames': [[temp_path, target]]}, f)
+
+        context = multiprocessing.get_context('fork')
+        with context.Pool(4) as pool:
+            counts = pool.map(fileio.recover_batches, [self.dir] * 8)
+
+        self.assertEqual(sum(counts), 20)
+        self.assertEqual(self.listdir(), sorted(f'{i}.md' for i in range(20)))
+        self.assertEqual(self.read('7.md'), 'content 7')
+
+    def test_vanished_journal_counts_as_recovered(self):
+        """A journal completed by another worker after the listing is skipped"""
+        from apilama import fileio
+
+        journal_path = os.path.join(self.dir, f'{fileio.JOURNAL_PREFIX}gone.json')
+        real_scandir = os.scandir
+
+        class _Entry:
+            name = os.path.basename(journal_path)
+            path = journal_path
+
+        class _Listing:
+            def __enter__(self):
+                return iter([_Entry()])
+
+            def __exit__(self, *exc_info):
+                return False
+
+        os.scandir = lambda path: _Listing()
+        try:
+            self.assertEqual(fileio._recover_journals(self.dir), 0)
+        finally:
+            os.scandir = real_scandir
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,256 @@
+"""
+Tests for the persistent git engine
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.app import create_app
+from apilama.git_engine import GITPYTHON_AVAILABLE, CliGitEngine, GitEngine, close_engines
+
+
+@unittest.skipUnless(shutil.which('git') and GITPYTHON_AVAILABLE, 'git and GitPython are required')
+class TestGitEngine(unittest.TestCase):
+    """Compare the GitPython engine with the git command line"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.git('init', '-q')
+        self.git('config', 'user.name', 'Test')
+        self.git('config', 'user.email', 'test@example.com')
+        self.engine = GitEngine(self.dir)
+        self.cli = CliGitEngine(self.dir)
+
+    def tearDown(self):
+        self.engine.close()
+        shutil.rmtree(self.dir)
+
+    def git(self, *args):
+        return subprocess.run(['git', *args], cwd=self.dir, capture_output=True,
+                              text=True, check=True).stdout
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_status_matches_git(self):
+        """Untracked, staged, modified and deleted files match git status"""
+        self.write('a.md', 'a')
+        self.write('b.md', 'b')
+        self.write('sub/c.md', 'c')
+        self.write('.gitignore', '*.log\n')
+        self.write('debug.log', 'ignored')
+        self.assertEqual(self.engine.status(), self.cli.status())
+
+        self.engine.commit('initial')
+        self.assertEqual(self.engine.status(), [])
+
+        self.write('a.md', 'changed')
+        os.remove(os.path.join(self.dir, 'b.md'))
+        self.write('d.md', 'd')
+        self.git('add', 'd.md')
+        self.assertEqual(self.engine.status(), self.cli.status())
+
+    def test_commit_is_readable_by_git(self):
+        """Commits made through the engine are valid for the git command line"""
+        self.write('a.md', 'a')
+        commit = self.engine.commit('Message with "quotes"')
+        self.assertEqual(self.git('log', '--format=%h %s').strip(), f"{commit['hash']} Message with \"quotes\"")
+        self.assertEqual(self.git('status', '--porcelain'), '')
+        self.git('fsck', '--strict')
+        self.assertIsNone(self.engine.commit('nothing changed'))
+
+    def test_commit_selected_paths(self):
+        """Only the given paths are staged when committing paths"""
+        self.write('a.md', 'a')
+        self.write('b.md', 'b')
+        self.engine.commit('only a', paths=['a.md'])
+        self.assertEqual(self.git('ls-files').split(), ['a.md'])
+        self.assertEqual(self.engine.log(), self.cli.log())
+
+    def test_log_pagination(self):
+        """Pages follow each other through the after cursor"""
+        for i in range(5):
+            self.write('a.md' if i % 2 else 'sub/b.md', str(i))
+            self.engine.commit(f'commit {i}')
+
+        commits, cursor = self.engine.log(limit=2)
+        self.assertEqual([c['message'] for c in commits], ['commit 4', 'commit 3'])
+        commits, cursor = self.engine.log(after=cursor, limit=2)
+        self.assertEqual([c['message'] for c in commits], ['commit 2', 'commit 1'])
+        commits, cursor = self.engine.log(after=cursor, limit=2)
+        self.assertEqual([c['message'] for c in commits], ['commit 0'])
+        self.assertIsNone(cursor)
+
+        commits, _ = self.engine.log(path='sub')
+        self.assertEqual([c['message'] for c in commits], ['commit 4', 'commit 2', 'commit 0'])
+        self.assertEqual(self.engine.log(path='sub'), self.cli.log(path='sub'))
+        with self.assertRaises(ValueError):
+            self.engine.log(after='0000000')
+
+    def test_log_cache_follows_head(self):
+        """New commits are added to the cached history, rewrites rebuild it"""
+        self.write('a.md', 'a')
+        self.engine.commit('first')
+        self.engine.log()
+        self.write('a.md', 'b')
+        self.engine.commit('second')
+        self.assertEqual([c['message'] for c in self.engine.log()[0]], ['second', 'first'])
+
+        self.git('commit', '--amend', '-q', '-m', 'amended')
+        self.assertEqual([c['message'] for c in self.engine.log()[0]], ['amended', 'first'])
+
+    def test_status_cache_invalidation(self):
+        """The cached status is reused until it is invalidated"""
+        self.write('a.md', 'a')
+        self.engine.debounce = 60
+        self.assertEqual(len(self.engine.cached_status()), 1)
+        self.write('b.md', 'b')
+        self.assertEqual(len(self.engine.cached_status()), 1)
+        self.engine.invalidate_status()
+        self.assertEqual(len(self.engine.cached_status()), 2)
+        self.assertEqual(self.engine.stats()['status_computations'], 2)
+
+    def test_commit_runs_two_git_processes(self):
+        """A commit only runs git add and git commit"""
+        from unittest import mock
+        from apilama import git_engine
+
+        self.write('a.md', 'a')
+        with mock.patch.object(git_engine.subprocess, 'run', wraps=subprocess.run) as run:
+            self.assertIsNotNone(self.engine.commit('initial'))
+            self.assertEqual([call.args[0][1] for call in run.call_args_list], ['add', 'commit'])
+            run.reset_mock()
+            self.assertIsNone(self.engine.commit('nothing'))
+            self.assertIsNone(self.engine.commit('nothing', paths=['a.md']))
+            self.assertEqual(len(run.call_args_list), 4)
+
+    def test_status_prunes_ignored_trees(self):
+        """Ignored directories are not walked and nested repositories are not entered"""
+        self.write('.gitignore', 'node_modules/\nbuild\n')
+        self.write('a.md', 'a')
+        self.write('vendor/README', 'x')
+        self.engine.commit('initial')
+        for i in range(50):
+            self.write(f'node_modules/pkg{i}/index.js', 'x')
+        self.write('build/out.txt', 'x')
+        self.write('docs/build/out.txt', 'x')
+        self.write('docs/new.md', 'new')
+        self.write('vendor/lib/README', 'x')
+        subprocess.run(['git', 'init', '-q'], cwd=os.path.join(self.dir, 'vendor/lib'), check=True)
+
+        checked = []
+        ignored = self.engine.repo.ignored
+        self.engine.repo.ignored = lambda *paths: checked.extend(paths) or ignored(*paths)
+        self.assertEqual(self.engine.status(), self.cli.status())
+        # Directories without tracked files are reported as a whole
+        self.assertEqual(self.engine.status(), [{'status': '??', 'filename': 'docs/'},
+                                                {'status': '??', 'filename': 'vendor/lib/'}])
+        inside = [path for path in checked if path.startswith(('node_modules/', 'build/', 'vendor/lib/'))
+                  and path not in ('node_modules/', 'build/', 'vendor/lib/')]
+        self.assertEqual(inside, [])
+
+    def test_merge_conflict(self):
+        """A conflict is reported like git and resolving it makes a merge commit"""
+        self.write('a.md', 'base\n')
+        self.engine.commit('base')
+        branch = self.git('rev-parse', '--abbrev-ref', 'HEAD').strip()
+        self.git('checkout', '-q', '-b', 'other')
+        self.write('a.md', 'other\n')
+        self.engine.commit('other')
+        self.git('checkout', '-q', branch)
+        self.write('a.md', 'main\n')
+        self.engine.commit('main')
+        subprocess.run(['git', 'merge', 'other'], cwd=self.dir, capture_output=True)
+
+        self.assertEqual(self.engine.status(), [{'status': 'UU', 'filename': 'a.md'}])
+        self.assertEqual(self.engine.status(), self.cli.status())
+
+        self.write('a.md', 'resolved\n')
+        self.assertIsNotNone(self.engine.commit('merge other'))
+        self.git('fsck', '--strict')
+        self.assertEqual(len(self.git('log', '-1', '--format=%P').split()), 2)
+        self.assertEqual(self.engine.status(), [])
+
+    def test_status_special_entries(self):
+        """Renames, filters and index flags are reported like git"""
+        self.write('a.md', 'a\n' * 20)
+        self.write('b.md', 'b')
+        self.write('c.md', 'c')
+        self.engine.commit('initial')
+
+        self.git('mv', 'a.md', 'renamed.md')
+        self.git('update-index', '--assume-unchanged', 'b.md')
+        self.write('b.md', 'changed')
+        self.write('d.md', 'd')
+        self.git('add', '-N', 'd.md')
+        self.assertEqual(self.engine.status(), self.cli.status())
+        self.assertIn({'status': 'R', 'filename': 'renamed.md'}, self.engine.status())
+
+    def test_status_clean_filter(self):
+        """Files normalized by a clean filter are not reported as modified"""
+        self.git('config', 'filter.upper.clean', 'tr a-z A-Z')
+        self.git('config', 'filter.upper.smudge', 'cat')
+        self.write('.gitattributes', '*.md filter=upper\n')
+        self.write('a.md', 'A\n')
+        self.engine.commit('initial')
+        self.write('a.md', 'a\n')
+        self.assertEqual(self.engine.status(), self.cli.status())
+        self.assertEqual(self.engine.status(), [])
+
+
+@unittest.skipUnless(shutil.which('git'), 'git is required')
+class TestGitLogRoute(unittest.TestCase):
+    """Tests for /api/git/log"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.git('init', '-q')
+        self.git('config', 'user.name', 'Test')
+        self.git('config', 'user.email', 'test@example.com')
+        for i in range(3):
+            with open(os.path.join(self.dir, 'a.md'), 'w') as f:
+                f.write(str(i))
+            self.git('add', 'a.md')
+            self.git('commit', '-q', '-m', f'commit {i}')
+        self._saved = os.environ.get('MARKDOWN_DIR')
+        os.environ['MARKDOWN_DIR'] = self.dir
+        self.client = create_app({'TESTING': True}).test_client()
+
+    def tearDown(self):
+        if self._saved is None:
+            os.environ.pop('MARKDOWN_DIR', None)
+        else:
+            os.environ['MARKDOWN_DIR'] = self._saved
+        close_engines()
+        shutil.rmtree(self.dir)
+
+    def git(self, *args):
+        subprocess.run(['git', *args], cwd=self.dir, check=True)
+
+    def test_whole_history_without_limit(self):
+        """Without a limit the whole history is returned in one response"""
+        response = self.client.get('/api/git/log')
+        self.assertEqual([c['message'] for c in response.json['commits']], ['commit 2', 'commit 1', 'commit 0'])
+        self.assertIsNone(response.json['next'])
+
+    def test_pages(self):
+        """With a limit the history is returned page by page"""
+        first = self.client.get('/api/git/log?limit=2').json
+        self.assertEqual(len(first['commits']), 2)
+        rest = self.client.get(f"/api/git/log?after={first['next']}").json
+        self.assertEqual([c['message'] for c in rest['commits']], ['commit 0'])
+        self.assertIsNone(rest['next'])
+        self.assertEqual(self.client.get('/api/git/log?limit=0').status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Tests for the backend health monitor and circuit breaker
+"""
+import os
+import sys
+import time
+import unittest
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.health import BackendHealthMonitor, CLOSED, HALF_OPEN, OPEN
+
+
+class _StubClient:
+    """Upstream client stand-in that never touches the network"""
+    health = None
+
+    def get(self, path, timeout=None):
+        raise ConnectionError('backend down')
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Tests for the circuit breaker transitions of BackendHealthMonitor"""
+
+    def setUp(self):
+        self.monitor = BackendHealthMonitor('stub', _StubClient(), interval=3600,
+                                            failure_threshold=2, recovery_timeout=0.2)
+        # Keep the background thread from probing during the test
+        self.monitor.start = lambda: None
+
+    def test_opens_after_consecutive_failures(self):
+        """The circuit opens after failure_threshold consecutive failures"""
+        self.monitor.record_failure()
+        self.assertTrue(self.monitor.allow_request())
+        self.monitor.record_failure()
+        self.assertEqual(self.monitor.status()['circuit'], OPEN)
+        self.assertFalse(self.monitor.allow_request())
+        self.assertFalse(self.monitor.is_available())
+
+    def test_success_resets_failures(self):
+        """A success in between keeps the circuit closed"""
+        self.monitor.record_failure()
+        self.monitor.record_response(200)
+        self.monitor.record_failure()
+        self.assertEqual(self.monitor.status()['circuit'], CLOSED)
+
+    def test_half_open_allows_single_trial(self):
+        """After the recovery timeout exactly one trial request is allowed"""
+        self.monitor.record_failure()
+        self.monitor.record_failure()
+        time.sleep(0.25)
+        self.assertTrue(self.monitor.allow_request())
+        self.assertEqual(self.monitor.status()['circuit'], HALF_OPEN)
+        self.assertFalse(self.monitor.allow_request())
+
+        self.monitor.record_response(503)
+        self.assertEqual(self.monitor.status()['circuit'], OPEN)
+
+        time.sleep(0.25)
+        self.assertTrue(self.monitor.allow_request())
+        self.monitor.record_success()
+        self.assertEqual(self.monitor.status()['circuit'], CLOSED)
+
+    def test_probe_result_is_cached(self):
+        """A failed probe is cached and reported without probing again"""
+        self.assertIsNone(self.monitor.status()['healthy'])
+        self.assertFalse(self.monitor.probe())
+        status = self.monitor.status()
+        self.assertFalse(status['healthy'])
+        self.assertFalse(status['stale'])
+        self.assertIn('backend down', status['error'])
+
+    def test_stale_state_turns_half_open(self):
+        """Past the TTL the cached state is unknown and a trial is allowed"""
+        self.monitor.ttl = 0.2
+        self.monitor.recovery_timeout = 60
+        self.monitor.probe()
+        self.monitor.record_failure()
+        self.monitor.record_failure()
+        self.assertFalse(self.monitor.is_available())
+        self.assertFalse(self.monitor.allow_request())
+
+        time.sleep(0.25)
+        self.assertTrue(self.monitor.is_available())
+        self.assertTrue(self.monitor.allow_request())
+        self.assertEqual(self.monitor.status()['circuit'], HALF_OPEN)
+        self.assertFalse(self.monitor.allow_request())
+
+        self.monitor.record_success()
+        self.assertEqual(self.monitor.status()['circuit'], CLOSED)
+        self.assertTrue(self.monitor.allow_request())
+        self.assertTrue(self.monitor.allow_request())
+
+    def test_stale_closed_circuit_is_not_trusted(self):
+        """A closed circuit nothing was heard of for the TTL needs a trial"""
+        self.monitor.ttl = 0.2
+        self.monitor._set_probe_result(True, None, None)
+        self.assertTrue(self.monitor.allow_request())
+        self.assertTrue(self.monitor.allow_request())
+
+        time.sleep(0.25)
+        self.assertTrue(self.monitor.allow_request())
+        self.assertEqual(self.monitor.status()['circuit'], HALF_OPEN)
+        self.assertFalse(self.monitor.allow_request())
+
+        self.monitor.record_response(503)
+        self.assertEqual(self.monitor.status()['circuit'], OPEN)
+
+
+if __name__ == "__main__":
+    unittest.main()
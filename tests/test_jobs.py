@@ -0,0 +1,141 @@
+"""
+Tests for the background job manager and the SheLLama job routes
+"""
+import json
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama import jobs
+from apilama.app import create_app
+
+
+def wait_finished(job, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return job.finished
+
+
+class TestJobManager(unittest.TestCase):
+    """Tests for running local jobs"""
+
+    def setUp(self):
+        self.manager = jobs.JobManager(jobs.run_local, workers=2, per_tenant=1, max_queued=3)
+
+    def test_output_and_exit_code(self):
+        """Output of both streams is collected in order and the exit code kept"""
+        job = self.manager.submit('t', 'echo out; echo err >&2; exit 3', shell=True)
+        self.assertTrue(wait_finished(job))
+        self.assertEqual(job.state, jobs.FAILED)
+        self.assertEqual(job.exit_code, 3)
+        chunks, next_seq, truncated = job.read_output()
+        self.assertEqual({c['stream']: c['data'] for c in chunks}, {'stdout': 'out\n', 'stderr': 'err\n'})
+        self.assertFalse(truncated)
+        self.assertEqual(job.read_output(next_seq)[0], [])
+
+    def test_per_tenant_limit(self):
+        """A tenant runs one job at a time, other tenants are not held up"""
+        first = self.manager.submit('a', 'sleep 0.5')
+        second = self.manager.submit('a', 'true')
+        other = self.manager.submit('b', 'true')
+        self.assertTrue(wait_finished(other))
+        self.assertEqual(second.state, jobs.QUEUED)
+        self.assertTrue(wait_finished(second))
+        self.assertGreaterEqual(second.started_at, first.finished_at)
+
+        self.manager.submit('c', 'sleep 5').cancel()
+        for _ in range(3):
+            self.manager.submit('d', 'sleep 5')
+        with self.assertRaises(jobs.JobLimitError):
+            self.manager.submit('d', 'true')
+        for job in self.manager.list('d'):
+            job.cancel()
+
+    def test_cancel_and_timeout(self):
+        """Cancelled and timed out jobs stop their process group"""
+        job = self.manager.submit('t', 'sleep 30 & sleep 30', shell=True)
+        while job.state != jobs.RUNNING:
+            time.sleep(0.02)
+        job.cancel()
+        self.assertTrue(wait_finished(job, 5))
+        self.assertEqual(job.state, jobs.CANCELLED)
+
+        job = self.manager.submit('t', 'sleep 30', timeout=0.2)
+        self.assertTrue(wait_finished(job, 5))
+        self.assertEqual(job.state, jobs.TIMED_OUT)
+
+    def test_bounded_output(self):
+        """Old output is dropped beyond the limit and reported as truncated"""
+        job = jobs.Job('t', 'x', output_limit=10)
+        for i in range(5):
+            job.append_output('stdout', f'{i}' * 4)
+        chunks, next_seq, truncated = job.read_output()
+        self.assertEqual([c['data'] for c in chunks], ['3333', '4444'])
+        self.assertEqual(next_seq, 5)
+        self.assertTrue(truncated)
+
+
+class TestJobRoutes(unittest.TestCase):
+    """Tests for the job API with the local executor"""
+
+    def setUp(self):
+        patch = mock.patch.dict(os.environ, {'APILAMA_JOBS_EXECUTOR': 'local',
+                                             'APILAMA_TRUST_TENANT_HEADER': 'true'})
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.client = create_app({'TESTING': True}).test_client()
+
+    def test_submit_poll_and_stream(self):
+        """A job is accepted at once, then polled and streamed by its owner"""
+        response = self.client.post('/api/shellama/jobs', json={'command': 'echo hello'},
+                                    headers={'X-Tenant-Id': 'alice'})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json['job']['id']
+
+        response = self.client.get(f'/api/shellama/jobs/{job_id}/stream',
+                                   headers={'X-Tenant-Id': 'alice', 'Accept': 'text/event-stream'})
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        body = response.get_data(as_text=True)
+        self.assertIn('id: 0\nevent: output\n', body)
+        self.assertIn('event: end\n', body)
+
+        response = self.client.get(f'/api/shellama/jobs/{job_id}/stream', headers={'X-Tenant-Id': 'alice'})
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+        self.assertEqual(lines[0]['data'], 'hello\n')
+        self.assertEqual(lines[-1]['end']['state'], jobs.SUCCEEDED)
+
+        response = self.client.get(f'/api/shellama/jobs/{job_id}/output?since=1', headers={'X-Tenant-Id': 'alice'})
+        self.assertEqual(response.json['output'], [])
+        self.assertEqual(response.json['next'], 1)
+
+        response = self.client.get(f'/api/shellama/jobs/{job_id}', headers={'X-Tenant-Id': 'bob'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_tenant_header_needs_opt_in(self):
+        """Without the opt-in the tenant is the client address, not the header"""
+        os.environ['APILAMA_TRUST_TENANT_HEADER'] = 'false'
+        response = self.client.post('/api/shellama/jobs', json={'command': 'true'},
+                                    headers={'X-Tenant-Id': 'alice'})
+        job_id = response.json['job']['id']
+
+        # Another header value does not make another tenant
+        response = self.client.get(f'/api/shellama/jobs/{job_id}', headers={'X-Tenant-Id': 'bob'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(f'/api/shellama/jobs/{job_id}',
+                                   environ_overrides={'REMOTE_ADDR': '192.0.2.1'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_missing_command(self):
+        """A job without a command is rejected"""
+        response = self.client.post('/api/shellama/jobs', json={})
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,199 @@
+"""
+Tests for text generation and its streaming mode
+"""
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.app import create_app
+from apilama.llm import LLMBackend, LLMError, get_backend, parse_generate_request
+from apilama.upstream import UpstreamClient
+
+
+class _CompletionsHandler(BaseHTTPRequestHandler):
+    """Completions backend answering in 200 ms, or streaming a token every 50 ms"""
+    protocol_version = 'HTTP/1.1'
+    tokens = ['Hello', ' wor', 'ld']
+    disconnected = threading.Event()
+    batches = []
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if not payload['stream']:
+            time.sleep(0.2)
+            if isinstance(payload['prompt'], list):
+                self.batches.append(len(payload['prompt']))
+                choices = [{'index': i, 'text': prompt.upper()} for i, prompt in enumerate(payload['prompt'])]
+            else:
+                choices = [{'index': 0, 'text': ''.join(self.tokens)}]
+            body = json.dumps({'model': payload['model'], 'usage': {'total_tokens': 7},
+                               'choices': choices}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        events = [json.dumps({'choices': [{'index': 0, 'text': token}]}) for token in self.tokens]
+        try:
+            for event in events * payload['max_tokens'] + ['[DONE]']:
+                data = f'data: {event}\n\n'.encode()
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                self.wfile.flush()
+                time.sleep(0.05)
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.disconnected.set()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestLLMBackend(unittest.TestCase):
+    """Tests for the completions client"""
+
+    def setUp(self):
+        _CompletionsHandler.disconnected = threading.Event()
+        _CompletionsHandler.batches = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _CompletionsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        client = UpstreamClient('getllm-test', f'http://127.0.0.1:{self.server.server_address[1]}')
+        self.backend = LLMBackend(client)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_generate(self):
+        """A completion is returned with the token usage of the backend"""
+        result = self.backend.generate(parse_generate_request({'prompt': 'hi', 'options': {'model': 'm'}}))
+        self.assertEqual(result, {'text': 'Hello world', 'model': 'm', 'tokens_used': 7, 'cached': False})
+
+    def test_stream_relays_tokens_as_they_arrive(self):
+        """The first token arrives before the backend finished"""
+        started = time.monotonic()
+        tokens = self.backend.stream(parse_generate_request({'prompt': 'hi', 'max_tokens': 1}))
+        self.assertEqual(next(tokens), 'Hello')
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.assertEqual(list(tokens), [' wor', 'ld'])
+
+    def test_closing_stream_stops_backend(self):
+        """Closing the stream closes the upstream connection"""
+        tokens = self.backend.stream(parse_generate_request({'prompt': 'hi', 'max_tokens': 100}))
+        next(tokens)
+        tokens.close()
+        self.assertTrue(_CompletionsHandler.disconnected.wait(5))
+
+    def test_identical_requests_share_one_call(self):
+        """Concurrent deterministic requests coalesce, later ones hit the cache"""
+        params = parse_generate_request({'prompt': 'hi', 'temperature': 0})
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.backend.generate(params)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({r['text'] for r in results}, {'Hello world'})
+        self.assertTrue(self.backend.generate(params)['cached'])
+        self.assertFalse(self.backend.generate(params, cache=False)['cached'])
+        self.assertFalse(self.backend.generate(dict(params, temperature=0.5))['cached'])
+
+        stats = self.backend.stats()
+        self.assertEqual((stats['coalesced'], stats['cache']['hits']), (4, 1))
+        self.assertEqual(self.backend.client.stats()['requests'], 3)
+
+    def test_concurrent_prompts_are_batched(self):
+        """Concurrent prompts with the same settings share one upstream call"""
+        self.assertEqual(self.backend.batcher.max_size, 1)
+        self.backend = LLMBackend(self.backend.client, batch_max_size=8, batch_max_wait=0.1)
+        results = {}
+
+        def generate(prompt, model='m'):
+            params = parse_generate_request({'prompt': prompt, 'model': model})
+            results[prompt] = self.backend.generate(params)['text']
+
+        threads = [threading.Thread(target=generate, args=(f'p{i}',)) for i in range(3)]
+        threads.append(threading.Thread(target=generate, args=('other', 'n')))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {'p0': 'P0', 'p1': 'P1', 'p2': 'P2', 'other': 'Hello world'})
+        self.assertEqual(_CompletionsHandler.batches, [3])
+        self.assertEqual(self.backend.stats()['batching']['largest_batch'], 3)
+
+    def test_backend_error(self):
+        """A failing backend raises before the stream starts"""
+        self.backend.client = UpstreamClient('getllm-test-down', 'http://127.0.0.1:9')
+        with self.assertRaises(LLMError):
+            self.backend.stream(parse_generate_request({'prompt': 'hi'}))
+
+
+class TestGenerateRoute(unittest.TestCase):
+    """Tests for /api/getllm/generate without a backend"""
+
+    def setUp(self):
+        self.client = create_app({'TESTING': True}).test_client()
+
+    def test_stream_formats(self):
+        """Tokens are streamed as NDJSON by default and as SSE on request"""
+        response = self.client.post('/api/getllm/generate', json={'prompt': 'hello', 'stream': True})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(''.join(line.get('text', '') for line in lines), 'Generated text based on: hello')
+        self.assertTrue(lines[-1]['done'])
+
+        response = self.client.post('/api/getllm/generate', json={'prompt': 'hello', 'stream': True},
+                                    headers={'Accept': 'text/event-stream'})
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertTrue(response.get_data(as_text=True).startswith('event: token\ndata: {"text": "Generated"}\n\n'))
+
+    def test_stream_failing_midway(self):
+        """A backend error after the first token ends the stream as failed"""
+        def tokens(params):
+            yield 'Hello'
+            raise LLMError('Connection lost')
+
+        backend = get_backend()
+        before = backend.stats()
+        with mock.patch.object(backend, 'stream', tokens):
+            response = self.client.post('/api/getllm/generate', json={'prompt': 'hi', 'stream': True, 'cache': False})
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines[-1], {'status': 'error', 'message': 'Connection lost'})
+        stats = backend.stats()
+        self.assertEqual(stats['streams_failed'], before['streams_failed'] + 1)
+        self.assertEqual(stats['streams_completed'], before['streams_completed'])
+
+    def test_placeholder_tokens_used(self):
+        """Without a backend tokens_used counts the prompt words plus 20"""
+        response = self.client.post('/api/getllm/generate', json={'prompt': 'one two three', 'cache': False})
+        self.assertEqual(response.json['tokens_used'], 23)
+
+    def test_invalid_parameter(self):
+        """Invalid parameters are rejected"""
+        response = self.client.post('/api/getllm/generate', json={'prompt': 'x', 'max_tokens': 'many'})
+        self.assertEqual(response.status_code, 400)
+        for cache in ('false', 0, 'yes'):
+            response = self.client.post('/api/getllm/generate', json={'prompt': 'x', 'cache': cache})
+            self.assertEqual(response.status_code, 400, cache)
+        response = self.client.post('/api/getllm/generate', json={'prompt': 'x', 'cache': False})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+"""
+Tests for the asynchronous logging pipeline
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from apilama import log_pipeline
+from apilama.logger import add_request_context
+
+
+class _ListHandler(logging.Handler):
+    """Handler recording batches and the thread writing them"""
+
+    def __init__(self, delay=0):
+        super().__init__()
+        self.delay = delay
+        self.batches = []
+        self.threads = set()
+
+    def emit_batch(self, records):
+        time.sleep(self.delay)
+        self.threads.add(threading.current_thread().name)
+        self.batches.append([self.format(record) for record in records])
+
+    @property
+    def messages(self):
+        return [message for batch in self.batches for message in batch]
+
+
+def _make_logger(handler, **settings):
+    logger = logging.getLogger(f'apilama.test.{id(handler)}')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    pipeline = log_pipeline.install(logger)
+    for name, value in settings.items():
+        setattr(pipeline, name, value)
+    return logger, pipeline
+
+
+class TestLogPipeline(unittest.TestCase):
+    """Tests for queuing records and writing them in the background"""
+
+    def test_records_written_in_order_on_writer_thread(self):
+        """Records are formatted and written by the writer thread"""
+        handler = _ListHandler()
+        logger, pipeline = _make_logger(handler)
+
+        for i in range(100):
+            logger.info('record %d', i)
+        self.assertTrue(pipeline.flush(5))
+
+        self.assertEqual(handler.messages, [f'record {i}' for i in range(100)])
+        self.assertEqual(handler.threads, {'apilama-log-writer'})
+        self.assertEqual(pipeline.stats()['written'], 100)
+        pipeline.close()
+
+    def test_slow_handler_does_not_block_logging(self):
+        """Logging returns immediately while the writer is busy, and batches pile up"""
+        handler = _ListHandler(delay=0.2)
+        logger, pipeline = _make_logger(handler)
+
+        started = time.monotonic()
+        for i in range(50):
+            logger.info('record %d', i)
+        self.assertLess(time.monotonic() - started, 0.1)
+
+        self.assertTrue(pipeline.flush(5))
+        self.assertEqual(len(handler.messages), 50)
+        self.assertLess(len(handler.batches), 50)
+        pipeline.close()
+
+    def test_drop_oldest(self):
+        """A full buffer drops its oldest records and counts them"""
+        handler = _ListHandler(delay=0.3)
+        logger, pipeline = _make_logger(handler, queue_size=5)
+
+        logger.info('first')
+        time.sleep(0.1)  # The writer is now busy with the first record
+        for i in range(20):
+            logger.info('record %d', i)
+        self.assertTrue(pipeline.flush(5))
+
+        self.assertEqual(handler.messages, ['first'] + [f'record {i}' for i in range(15, 20)])
+        stats = pipeline.stats()
+        self.assertEqual(stats['dropped'], 15)
+        self.assertEqual(stats['max_depth'], 5)
+        pipeline.close()
+
+    def test_block(self):
+        """A full buffer makes callers wait for room under the block policy"""
+        handler = _ListHandler(delay=0.2)
+        logger, pipeline = _make_logger(handler, queue_size=2, policy=log_pipeline.BLOCK, batch_size=2)
+
+        started = time.monotonic()
+        for i in range(7):
+            logger.info('record %d', i)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertTrue(pipeline.flush(5))
+
+        self.assertEqual(handler.messages, [f'record {i}' for i in range(7)])
+        stats = pipeline.stats()
+        self.assertEqual(stats['dropped'], 0)
+        self.assertGreater(stats['blocked'], 0)
+        pipeline.close()
+
+    def test_request_context_captured_when_logged(self):
+        """The request of the logging thread ends up in the record"""
+        handler = _ListHandler()
+        handler.setFormatter(logging.Formatter('%(method)s %(url)s %(message)s'))
+        logger = logging.getLogger('apilama.test.context')
+        logger.propagate = False
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        pipeline = log_pipeline.install(logger, context=add_request_context)
+
+        app = Flask(__name__)
+        with app.test_request_context('/api/files?x=1', method='POST'):
+            logger.info('inside')
+        logger.info('outside')
+        self.assertTrue(pipeline.flush(5))
+
+        self.assertEqual(handler.messages, ['POST http://localhost/api/files?x=1 inside',
+                                            'No Method No URL outside'])
+        pipeline.close()
+
+    def test_exception_rendered_when_logged(self):
+        """Tracebacks are rendered before the record is queued"""
+        handler = _ListHandler()
+        logger, pipeline = _make_logger(handler)
+
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception('failed')
+        self.assertTrue(pipeline.flush(5))
+
+        self.assertIn('ValueError: boom', handler.messages[0])
+        pipeline.close()
+
+
+class TestBatchRotatingFileHandler(unittest.TestCase):
+    """Tests for the batching file handler"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'apilama.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_rollover(self):
+        """Batches roll the file over at the size limit"""
+        handler = log_pipeline.BatchRotatingFileHandler(self.path, maxBytes=100, backupCount=3)
+        records = [logging.LogRecord('apilama', logging.INFO, __file__, 1, 'x' * 29, None, None)
+                   for _ in range(6)]
+        handler.emit_batch(records[:4])
+        handler.emit_batch(records[4:])
+        handler.close()
+
+        with open(self.path) as f:
+            current = f.read()
+        with open(self.path + '.1') as f:
+            backup = f.read()
+        self.assertEqual(backup, ('x' * 29 + '\n') * 3)
+        self.assertEqual(current, ('x' * 29 + '\n') * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
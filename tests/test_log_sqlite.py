@@ -0,0 +1,108 @@
+"""
+Tests for the SQLite log sink
+"""
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.log_sqlite import SQLiteLogHandler
+
+
+def _record(message, level=logging.INFO, **extra):
+    record = logging.LogRecord('apilama.test', level, __file__, 10, message, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestSQLiteLogHandler(unittest.TestCase):
+    """Tests for batched inserts and retention"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'apilama.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _query(self, sql, *args):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute(sql, args).fetchall()
+        finally:
+            conn.close()
+
+    def test_database_setup(self):
+        """The database uses WAL and indexes the queried columns"""
+        handler = SQLiteLogHandler(self.path, retention_days=0)
+        self.assertFalse(os.path.exists(self.path))
+        handler.emit(_record('first'))
+        handler.close()
+
+        self.assertEqual(self._query('PRAGMA journal_mode'), [('wal',)])
+        indexes = {row[0] for row in self._query("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertTrue({'idx_logs_timestamp', 'idx_logs_level', 'idx_logs_logger_name'} <= indexes)
+
+    def test_flush_on_size(self):
+        """Records are inserted once enough of them are pending"""
+        handler = SQLiteLogHandler(self.path, flush_size=10, flush_interval=60, retention_days=0)
+        handler.emit_batch([_record(f'record {i}') for i in range(9)])
+        self.assertEqual(self._query('SELECT COUNT(*) FROM logs'), [(0,)])
+
+        handler.emit_batch([_record('record 9'), _record('record 10')])
+        self.assertEqual(self._query('SELECT COUNT(*) FROM logs'), [(11,)])
+        self.assertEqual(handler.stats()['flushes'], 1)
+        handler.close()
+
+    def test_flush_on_time(self):
+        """Pending records are inserted after the flush interval"""
+        handler = SQLiteLogHandler(self.path, flush_size=1000, flush_interval=0.1, retention_days=0)
+        handler.emit(_record('alone'))
+        time.sleep(0.5)
+
+        self.assertEqual(self._query('SELECT message FROM logs'), [('alone',)])
+        handler.close()
+
+    def test_close_flushes(self):
+        """Closing the handler inserts the pending records"""
+        handler = SQLiteLogHandler(self.path, flush_size=1000, flush_interval=60, retention_days=0)
+        handler.emit(_record('failed', logging.ERROR, context={'filename': 'a.md'}, url='http://localhost/x'))
+        handler.close()
+
+        rows = self._query('SELECT level, level_no, logger_name, message, context FROM logs')
+        self.assertEqual(rows, [('ERROR', logging.ERROR, 'apilama.test', 'failed',
+                                 '{"filename": "a.md", "url": "http://localhost/x"}')])
+
+    def test_prune_in_chunks(self):
+        """Rows older than the retention period are deleted chunk by chunk"""
+        handler = SQLiteLogHandler(self.path, flush_size=1000, flush_interval=60, retention_days=1,
+                                   prune_chunk=7, prune_interval=3600)
+        old = time.time() - 3 * 86400
+        records = []
+        for i in range(20):
+            record = _record(f'old {i}')
+            record.created = old
+            records.append(record)
+        records.extend(_record(f'new {i}') for i in range(5))
+        handler.emit_batch(records)
+        handler.flush()
+
+        deleted = handler.prune(now=datetime.now() + timedelta(seconds=1))
+
+        self.assertEqual(deleted, 20)
+        self.assertEqual(self._query('SELECT message FROM logs ORDER BY id'),
+                         [(f'new {i}',) for i in range(5)])
+        self.assertEqual(handler.stats()['pruned'], 20)
+        handler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+"""
+Tests for the APILama logger
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from apilama import log_pipeline
+from apilama import logger as apilama_logger
+from apilama.logger import StructuredLogger
+
+
+class _RecordingHandler(logging.Handler):
+    """Handler keeping the records it receives"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestStructuredLogger(unittest.TestCase):
+    """Tests for lazy context and sampling"""
+
+    def setUp(self):
+        self.handler = _RecordingHandler()
+        self.std_logger = logging.getLogger('apilama.test.structured')
+        self.std_logger.propagate = False
+        self.std_logger.handlers = [self.handler]
+        self.std_logger.setLevel(logging.INFO)
+        self.logger = StructuredLogger(self.std_logger)
+
+    def test_disabled_level_builds_nothing(self):
+        """Neither the context nor the message is built below the level"""
+        calls = []
+
+        class Expensive:
+            def __str__(self):
+                calls.append('str')
+                return 'expensive'
+
+        self.logger.debug('Value %s', Expensive(), context=lambda: calls.append('context'))
+
+        self.assertEqual(calls, [])
+        self.assertEqual(self.handler.records, [])
+
+    def test_context_built_when_emitted(self):
+        """A context callable becomes the context of the record"""
+        self.logger.info('Read file %s', 'a.md', context=lambda: {'file_size': 3})
+
+        record = self.handler.records[0]
+        self.assertEqual(record.getMessage(), 'Read file a.md')
+        self.assertEqual(record.context, {'file_size': 3})
+
+    def test_record_attributed_to_caller(self):
+        """The record names the calling function, not the logger class"""
+        self.logger.warning('careful')
+        self.logger.log(logging.ERROR, 'failed', context={})
+
+        self.assertEqual([record.funcName for record in self.handler.records],
+                         ['test_record_attributed_to_caller'] * 2)
+        self.assertEqual(self.handler.records[0].pathname, os.path.abspath(__file__))
+
+    def test_sampling(self):
+        """Only one of every N calls with the same message is emitted"""
+        for i in range(10):
+            self.logger.info('Request %s', i, sample=4)
+        self.logger.info('Other', sample=4)
+
+        self.assertEqual([record.getMessage() for record in self.handler.records],
+                         ['Request 0', 'Request 4', 'Request 8', 'Other'])
+
+
+class TestHandlerChain(unittest.TestCase):
+    """Tests for the single handler chain of the 'apilama' logger"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        apilama_logger.configure(database=False)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_configure_replaces_chain(self):
+        """Configuring again replaces the handlers instead of adding more"""
+        apilama_logger.configure(log_dir=self.directory, database=False, console=False)
+        handlers = apilama_logger.configure(log_dir=self.directory, database=True, console=False)
+
+        self.assertEqual(len(apilama_logger.logger.handlers), 1)
+        chain = apilama_logger.logger.handlers[0]
+        if log_pipeline.async_logging_enabled():
+            chain = chain.pipeline
+        self.assertEqual([type(handler).__name__ for handler in handlers],
+                         ['BatchRotatingFileHandler', 'SQLiteLogHandler'])
+        self.assertEqual(getattr(chain, 'handlers', [chain]), handlers)
+
+    def test_app_logger_written_once(self):
+        """Records of the Flask app logger and submodules go through the chain once"""
+        apilama_logger.configure(log_dir=self.directory, database=False, console=False)
+        app = Flask('apilama.app')
+        apilama_logger.init_app(app)
+
+        @app.route('/x')
+        def x():
+            app.logger.warning('from the app logger')
+            logging.getLogger('apilama.files').warning('from a submodule')
+            return 'ok'
+
+        app.test_client().get('/x?a=1', environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        log_pipeline.flush_all(5)
+
+        with open(os.path.join(self.directory, 'apilama.log')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        for line in lines:
+            self.assertIn('[10.0.0.1] [GET] [http://localhost/x?a=1]', line)
+
+
+class TestRequestContext(unittest.TestCase):
+    """Tests for capturing the request context once per request"""
+
+    def test_captured_once_per_request(self):
+        """Records reuse the context read by the before_request hook"""
+        app = Flask(__name__)
+        apilama_logger.init_app(app)
+        reads = []
+        records = []
+
+        @app.route('/x')
+        def x():
+            for i in range(3):
+                record = logging.LogRecord('apilama', logging.INFO, __file__, 1, 'msg', None, None)
+                apilama_logger.add_request_context(record)
+                records.append(record)
+            return 'ok'
+
+        @app.before_request
+        def count_reads():
+            reads.append(apilama_logger._request_context.get())
+
+        app.test_client().get('/x')
+
+        self.assertEqual(len(reads), 1)
+        self.assertEqual({(r.url, r.remote_addr, r.method) for r in records}, {reads[0]})
+        self.assertIsNone(apilama_logger._request_context.get())
+
+        record = logging.LogRecord('apilama', logging.INFO, __file__, 1, 'msg', None, None)
+        apilama_logger.add_request_context(record)
+        self.assertEqual(record.url, 'No URL')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+"""
+Tests for the sandboxed code execution
+"""
+import json
+import os
+import sys
+import time
+import unittest
+import uuid
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.app import create_app
+from apilama import sandbox
+from apilama.sandbox import SandboxPool
+
+
+class TestSandboxPool(unittest.TestCase):
+    """Tests for running snippets in pre-warmed workers"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = SandboxPool(size=2, timeout=5, output_limit=1000)
+        cls.pool.warm_up()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_output_and_exit_code(self):
+        """stdout, stderr, input and the exit code are returned"""
+        result = self.pool.run('import sys\nprint(input())\nprint("err", file=sys.stderr)\nsys.exit(3)',
+                               input='hello\n')
+        self.assertEqual(result['stdout'], 'hello\n')
+        self.assertEqual(result['stderr'], 'err\n')
+        self.assertEqual(result['exit_code'], 3)
+        self.assertFalse(result['timed_out'])
+
+        result = self.pool.run('1 / 0')
+        self.assertEqual(result['exit_code'], 1)
+        self.assertIn('ZeroDivisionError', result['stderr'])
+
+    def test_limits(self):
+        """Runaway snippets are stopped by the timeout and the resource limits"""
+        started = time.monotonic()
+        result = self.pool.run('while True: pass', timeout=0.5)
+        self.assertTrue(result['timed_out'])
+        self.assertLess(time.monotonic() - started, 3)
+
+        result = self.pool.run('x = bytearray(1 << 30)')
+        self.assertIn('MemoryError', result['stderr'])
+
+        result = self.pool.run('print("x" * 5000)')
+        self.assertTrue(result['truncated'])
+        self.assertEqual(len(result['stdout']), 1000)
+
+    def test_workers_are_reused_warm(self):
+        """Runs take a pre-started worker and the pool is refilled"""
+        deadline = time.monotonic() + 5
+        while self.pool.stats()['warm'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        before = self.pool.stats()['warm_starts']
+        self.pool.run('pass')
+        self.assertEqual(self.pool.stats()['warm_starts'], before + 1)
+
+
+class TestExecuteRoutes(unittest.TestCase):
+    """Tests for the BEXY and PyLama execute routes"""
+
+    def setUp(self):
+        self.client = create_app({'TESTING': True}).test_client()
+
+    def test_execute(self):
+        """Both routes run the code"""
+        for url in ('/api/bexy/execute', '/api/devlama/execute'):
+            response = self.client.post(url, json={'code': 'print(6 * 7)'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['status'], 'success')
+            self.assertEqual(response.json['output'], '42\n')
+            self.assertEqual(response.json['exit_code'], 0)
+            self.assertIn('execution_time', response.json)
+
+        response = self.client.post('/api/bexy/execute', json={'code': 'pass', 'timeout': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_results_are_cached(self):
+        """A repeated run is answered from the result cache unless opted out"""
+        code = f'# {uuid.uuid4()}\nimport time\nprint(time.time())'
+        first = self.client.post('/api/bexy/execute', json={'code': code}).json
+        second = self.client.post('/api/bexy/execute', json={'code': code}).json
+        self.assertEqual((first['cached'], second['cached']), (False, True))
+        self.assertEqual(first['output'], second['output'])
+        self.assertEqual(first['execution_time'], second['execution_time'])
+
+        other_input = self.client.post('/api/bexy/execute', json={'code': code, 'input': 'x'}).json
+        self.assertFalse(other_input['cached'])
+        opted_out = self.client.post('/api/bexy/execute', json={'code': code, 'cache': False}).json
+        self.assertFalse(opted_out['cached'])
+        self.assertNotEqual(opted_out['output'], first['output'])
+
+        response = self.client.post('/api/bexy/execute', json={'code': code, 'cache': 'false'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_devlama_results_are_not_cached(self):
+        """The PyLama route only caches results when asked to"""
+        code = f'# {uuid.uuid4()}\nimport time\nprint(time.time())'
+        first = self.client.post('/api/devlama/execute', json={'code': code}).json
+        second = self.client.post('/api/devlama/execute', json={'code': code}).json
+        self.assertEqual((first['cached'], second['cached']), (False, False))
+
+        self.client.post('/api/devlama/execute', json={'code': code, 'cache': True})
+        third = self.client.post('/api/devlama/execute', json={'code': code, 'cache': True}).json
+        self.assertTrue(third['cached'])
+
+
+class TestExecuteBatch(unittest.TestCase):
+    """Tests for the batch execute route"""
+
+    @classmethod
+    def setUpClass(cls):
+        # Run items in parallel even on a single CPU
+        os.environ['APILAMA_SANDBOX_BATCH_WORKERS'] = '4'
+        sandbox._batch_executor = None
+
+    @classmethod
+    def tearDownClass(cls):
+        os.environ.pop('APILAMA_SANDBOX_BATCH_WORKERS')
+        sandbox._batch_executor = None
+
+    def setUp(self):
+        self.client = create_app({'TESTING': True}).test_client()
+
+    def post(self, body):
+        response = self.client.post('/api/bexy/execute/batch', json=body)
+        if response.mimetype != 'application/x-ndjson':
+            return response, None
+        return response, [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def test_results_stream_in_completion_order(self):
+        """Each item is sent when it finishes, followed by a summary"""
+        items = [{'id': 'slow', 'code': 'import time; time.sleep(0.5); print("slow")', 'cache': False},
+                 'print("fast")',
+                 {'code': 'raise SystemExit(2)', 'cache': False}]
+        response, lines = self.post({'items': items})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(lines[-1], {'done': True, 'total': 3, 'success': 3, 'error': 0, 'timed_out': 0})
+        by_index = {line['index']: line for line in lines[:-1]}
+        self.assertEqual(by_index[0]['id'], 'slow')
+        self.assertEqual(by_index[1]['output'], 'fast\n')
+        self.assertEqual(by_index[2]['exit_code'], 2)
+        self.assertEqual(lines[2]['index'], 0)
+
+    def test_timeouts(self):
+        """Items are limited by their own timeout and by the batch timeout"""
+        items = [{'code': 'while True: pass', 'timeout': 0.3}, {'code': 'while True: pass'}]
+        started = time.monotonic()
+        _, lines = self.post({'items': items, 'timeout': 1, 'item_timeout': 5})
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertTrue(all(line['timed_out'] for line in lines[:-1]))
+        self.assertEqual(lines[-1]['timed_out'], 2)
+
+    def test_invalid_batch(self):
+        """Batches without items or with items without code are rejected"""
+        self.assertEqual(self.post({'items': []})[0].status_code, 400)
+        self.assertEqual(self.post({'items': [{'input': 'x'}]})[0].status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+"""
+Tests for the pre-forking production server
+"""
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import urllib.request
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def make_pid_app():
+    """Application factory answering every request with the worker pid"""
+    def app(environ, start_response):
+        body = str(os.getpid()).encode()
+        start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+        return [body]
+    return app
+
+
+def make_streaming_app():
+    """Application factory streaming /stream slowly and answering the rest with the pid"""
+    def app(environ, start_response):
+        if environ['PATH_INFO'] == '/stream':
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return (time.sleep(i) or b'tick\n' for i in (0, 5))
+        return make_pid_app()(environ, start_response)
+    return app
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+class TestPreforkServer(unittest.TestCase):
+    """Tests for PreforkServer"""
+
+    def setUp(self):
+        code = (
+            "from apilama.server import PreforkServer\n"
+            "server = PreforkServer('tests.test_server:make_pid_app', port=0, workers=2,"
+            " max_requests=2, graceful_timeout=5)\n"
+            "server.bind()\n"
+            "print(server.port, flush=True)\n"
+            "server.run()\n"
+        )
+        self.master = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT_DIR,
+                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        self.port = int(self.master.stdout.readline())
+
+    def tearDown(self):
+        if self.master.poll() is None:
+            self.master.kill()
+            self.master.wait()
+        self.master.stdout.close()
+
+    def _get_pid(self):
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{self.port}/', timeout=5) as response:
+                    return int(response.read())
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def test_workers_are_recycled(self):
+        """Workers are replaced after max_requests and the socket keeps serving"""
+        pids = [self._get_pid() for _ in range(8)]
+        self.assertNotIn(self.master.pid, pids)
+        self.assertGreaterEqual(len(set(pids)), 3)
+
+    def test_sigterm_drains_and_exits(self):
+        """SIGTERM stops the workers and the master exits cleanly"""
+        self._get_pid()
+        self.master.send_signal(signal.SIGTERM)
+        self.assertEqual(self.master.wait(timeout=10), 0)
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+class TestWorkerThreads(unittest.TestCase):
+    """Tests for the threads of a prefork worker"""
+
+    def setUp(self):
+        code = (
+            "from apilama.server import PreforkServer\n"
+            "server = PreforkServer('tests.test_server:make_streaming_app', port=0, workers=1,"
+            " threads=2, graceful_timeout=10)\n"
+            "server.bind()\n"
+            "print(server.port, flush=True)\n"
+            "server.run()\n"
+        )
+        self.master = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT_DIR,
+                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        self.port = int(self.master.stdout.readline())
+
+    def tearDown(self):
+        if self.master.poll() is None:
+            self.master.kill()
+            self.master.wait()
+        self.master.stdout.close()
+
+    def test_stream_does_not_block_worker(self):
+        """A long streaming response leaves the worker free for other requests"""
+        import http.client
+
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                stream = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+                stream.request('GET', '/stream')
+                break
+            except OSError:
+                self.assertLess(time.monotonic(), deadline, 'the worker did not start')
+                time.sleep(0.1)
+        response = stream.getresponse()
+        self.assertEqual(response.readline(), b'tick\n')
+
+        started = time.monotonic()
+        with urllib.request.urlopen(f'http://127.0.0.1:{self.port}/', timeout=4) as other:
+            self.assertEqual(other.status, 200)
+        self.assertLess(time.monotonic() - started, 4)
+
+        # SIGTERM waits for the stream to end
+        self.master.send_signal(signal.SIGTERM)
+        self.assertEqual(response.read(), b'tick\n')
+        stream.close()
+        self.assertEqual(self.master.wait(timeout=15), 0)
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+class TestPreforkCreateApp(unittest.TestCase):
+    """Tests for PreforkServer serving the real application factory"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        code = (
+            "import threading\n"
+            "from apilama.server import PreforkServer\n"
+            "from apilama.logger import logger\n"
+            "server = PreforkServer('apilama.app:create_app', port=0, workers=2, graceful_timeout=5)\n"
+            "server.bind()\n"
+            "def chatter():\n"
+            "    for _ in range(5000):\n"
+            "        logger.info('Master logging while the workers fork')\n"
+            "threading.Thread(target=chatter, daemon=True).start()\n"
+            "print(server.port, flush=True)\n"
+            "server.run()\n"
+        )
+        env = dict(os.environ, APILAMA_LOG_DIR=self.directory)
+        self.master = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT_DIR, env=env,
+                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        self.port = int(self.master.stdout.readline())
+
+    def tearDown(self):
+        if self.master.poll() is None:
+            self.master.kill()
+            self.master.wait()
+        self.master.stdout.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _started_workers(self):
+        try:
+            with open(os.path.join(self.directory, 'apilama.log')) as f:
+                return sum(' started' in line and 'worker' in line for line in f)
+        except OSError:
+            return 0
+
+    def test_workers_serve_create_app(self):
+        """Every worker builds the application, logging included, and answers requests"""
+        deadline = time.monotonic() + 15
+        while self._started_workers() < 2:
+            self.assertLess(time.monotonic(), deadline, 'the workers did not start')
+            time.sleep(0.1)
+        with urllib.request.urlopen(f'http://127.0.0.1:{self.port}/health', timeout=5) as response:
+            self.assertEqual(response.status, 200)
+
+        self.master.send_signal(signal.SIGTERM)
+        self.assertEqual(self.master.wait(timeout=10), 0)
+
+if __name__ == "__main__":
+    unittest.main()
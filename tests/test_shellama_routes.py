@@ -0,0 +1,133 @@
+"""
+Tests for the SheLLama proxy routes
+"""
+import json
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.app import create_app
+from apilama.health import BackendHealthMonitor
+from apilama.routes import shellama_routes
+from apilama.upstream import STREAM_CHUNK_SIZE, UpstreamClient
+
+# A body spanning several relayed chunks
+LARGE_BODY = json.dumps({'status': 'success', 'content': 'x' * (3 * STREAM_CHUNK_SIZE + 17)}).encode()
+
+
+class _FakeShellamaHandler(BaseHTTPRequestHandler):
+    """SheLLama stand-in serving files of known sizes and error statuses"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        filename = parse_qs(urlparse(self.path).query).get('filename', [''])[0]
+        if filename == 'large.json':
+            # Sent with chunked transfer encoding, in pieces of uneven size
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(LARGE_BODY), 5000):
+                piece = LARGE_BODY[start:start + 5000]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(piece), piece))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+
+        if filename.endswith('small.json'):
+            status, body = 200, b'{"status": "success", "content": "hi"}'
+        elif filename == 'broken.json':
+            status, body = 500, b'{"status": "error"}'
+        else:
+            status, body = 404, b'{"status": "error"}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestStreamPassthrough(unittest.TestCase):
+    """Tests for GET /api/shellama/file?stream=true"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeShellamaHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        upstream = UpstreamClient('shellama-test', f'http://127.0.0.1:{self.server.server_address[1]}')
+        monitor = BackendHealthMonitor('shellama-test', upstream, interval=3600)
+        # Keep the background thread from probing during the test
+        monitor.start = lambda: None
+        patches = [
+            mock.patch.object(shellama_routes, 'shellama_client', upstream),
+            mock.patch.object(shellama_routes, 'shellama_monitor', monitor),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(upstream.close)
+
+        self.app = create_app({'TESTING': True})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_file(self, filename, **kwargs):
+        return self.client.get('/api/shellama/file', query_string={'filename': filename, 'stream': 'true'},
+                               **kwargs)
+
+    def test_chunked_body_is_relayed(self):
+        """A chunked upstream body is streamed through unchanged"""
+        response = self.get_file('large.json', buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        chunks = list(response.response)
+        response.close()
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= STREAM_CHUNK_SIZE for chunk in chunks))
+        self.assertEqual(b''.join(chunks), LARGE_BODY)
+        self.assertEqual(response.headers['Content-Type'], 'application/json; charset=utf-8')
+        self.assertNotIn('Content-Length', response.headers)
+
+    def test_headers(self):
+        """Upstream headers are passed through and the file name is announced"""
+        response = self.get_file('docs/my small.json')
+        self.assertEqual(response.status_code, 200)
+        # Relayed as is, without the name being injected into the body
+        self.assertEqual(response.get_json(), {'status': 'success', 'content': 'hi'})
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        self.assertEqual(response.headers['Content-Length'], str(len(response.data)))
+        self.assertEqual(response.headers['X-File-Name'], 'my%20small.json')
+        self.assertEqual(response.headers['Access-Control-Expose-Headers'], 'X-File-Name')
+
+    def test_error_status(self):
+        """Upstream errors are mapped like in the buffered mode, not streamed"""
+        response = self.get_file('missing.json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json(), {'status': 'error', 'message': 'File not found: missing.json'})
+        self.assertNotIn('X-File-Name', response.headers)
+
+        response = self.get_file('broken.json')
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.get_json()['message'], 'SheLLama service returned status code 500')
+
+    def test_without_stream(self):
+        """Without stream=true the body is parsed and the name added"""
+        response = self.client.get('/api/shellama/file', query_string={'filename': 'small.json'})
+        self.assertEqual(response.get_json(), {'status': 'success', 'content': 'hi', 'name': 'small.json'})
+        self.assertNotIn('X-File-Name', response.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
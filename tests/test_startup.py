@@ -0,0 +1,51 @@
+"""
+Tests for the work done when importing the application
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+PACKAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, PACKAGE_DIR)
+
+IMPORT_SCRIPT = """
+import json, os, sys
+import apilama.app
+print(json.dumps({
+    'modules': sorted(m for m in ('git', 'requests', 'loglama', 'sqlite3') if m in sys.modules),
+    'files': os.listdir(os.environ['APILAMA_LOG_DIR']),
+}))
+apilama.app.create_app({'TESTING': True})
+"""
+
+
+class TestStartup(unittest.TestCase):
+    """Tests for lazy imports and deferred logging setup"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_import_does_no_work(self):
+        """Importing the app loads no optional library and writes no file"""
+        env = dict(os.environ, APILAMA_LOG_DIR=self.directory, APILAMA_DB_LOGGING='true')
+        result = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=PACKAGE_DIR, env=env,
+                                capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+        at_import = json.loads(result.stdout.splitlines()[0])
+        self.assertEqual(at_import, {'modules': [], 'files': []})
+        # create_app() sets the handler chain up and logs its initialization
+        self.assertIn('apilama.log', os.listdir(self.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
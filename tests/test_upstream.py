@@ -0,0 +1,103 @@
+"""
+Tests for the pooled upstream client
+"""
+import json
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory to the path so we can import the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apilama.upstream import UpstreamClient, get_pool_stats
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    """Minimal HTTP/1.1 backend answering every GET with a small JSON body"""
+    protocol_version = 'HTTP/1.1'
+    client_ports = set()
+
+    def do_GET(self):
+        self.client_ports.add(self.client_address[1])
+        body = json.dumps({'status': 'success', 'path': self.path}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestUpstreamClient(unittest.TestCase):
+    """Tests for UpstreamClient"""
+
+    def setUp(self):
+        _KeepAliveHandler.client_ports = set()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _KeepAliveHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        """Sequential requests share one pooled keep-alive connection"""
+        client = UpstreamClient('test', self.base_url, pool_size=4)
+        for _ in range(5):
+            response = client.get('/health')
+            self.assertEqual(response.json()['path'], '/health')
+
+        stats = client.stats()
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['pools'][0]['connections_opened'], 1)
+        self.assertEqual(stats['pools'][0]['idle'], 1)
+        self.assertEqual(len(_KeepAliveHandler.client_ports), 1)
+        client.close()
+
+    def test_keepalive_disabled(self):
+        """Without keep-alive every request opens a new connection"""
+        client = UpstreamClient('test', self.base_url, keepalive=False)
+        for _ in range(3):
+            client.get('/health')
+
+        self.assertEqual(len(_KeepAliveHandler.client_ports), 3)
+        client.close()
+
+    def test_errors_are_counted(self):
+        """Connection failures are reported in the client counters"""
+        client = UpstreamClient('test', 'http://127.0.0.1:9', connect_timeout=0.5)
+        with self.assertRaises(Exception):
+            client.get('/health')
+
+        stats = client.stats()
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['in_flight'], 0)
+        client.close()
+
+    def test_env_configuration(self):
+        """Backend specific settings override the global ones"""
+        os.environ['APILAMA_UPSTREAM_POOL_SIZE'] = '7'
+        os.environ['APILAMA_UPSTREAM_ENVTEST_READ_TIMEOUT'] = '42'
+        try:
+            client = UpstreamClient('envtest', self.base_url)
+            self.assertEqual(client.pool_size, 7)
+            self.assertEqual(client.read_timeout, 42.0)
+            client.close()
+        finally:
+            del os.environ['APILAMA_UPSTREAM_POOL_SIZE']
+            del os.environ['APILAMA_UPSTREAM_ENVTEST_READ_TIMEOUT']
+
+    def test_pool_stats_are_json_serializable(self):
+        """The registry statistics can be served by the metrics endpoint"""
+        json.dumps(get_pool_stats())
+
+
+if __name__ == "__main__":
+    unittest.main()